@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Leverage of the high frequencies and corner frequency recovery of fits to the
+raw spectrum, to equally weighted log-spaced bands (what fit_spectrum() does
+with bands_per_decade) and to bands weighted with their sample counts.
+
+Noisy realizations of a theoretical source spectrum, optionally on top of a
+flat noise floor which the model does not contain, are fitted with all three
+variants.
+
+Run from the repository root:
+
+    python benchmarks/band_weighting.py
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import os
+import scipy.optimize
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+from spectral_analysis import calculate_source_spectrum, fit_spectrum, \
+    grid_search_initial_parameters, log_frequency_bands
+
+REALIZATION_COUNT = 300
+SAMPLING_RATE = 200.0
+NPTS = 2000
+BANDS_PER_DECADE = 10
+OMEGA_0 = 1E-6
+CORNER_FREQUENCY = 8.0
+QUALITY_FACTOR = 200.0
+TRAVELTIME = 3.0
+# Noise floors relative to OMEGA_0.
+NOISE_FLOORS = [0.0, 0.03, 0.1]
+
+
+def fit_counts_weighted(spectrum, frequencies, initial_omega_0, initial_f_c):
+    spectrum, frequencies, weights = log_frequency_bands(spectrum,
+        frequencies, BANDS_PER_DECADE)
+
+    def f(frequencies, omega_0, f_c):
+        return calculate_source_spectrum(frequencies, omega_0, f_c,
+            QUALITY_FACTOR, TRAVELTIME)
+    popt, _ = scipy.optimize.curve_fit(f, frequencies, spectrum,
+        p0=[initial_omega_0, initial_f_c], sigma=1.0 / np.sqrt(weights),
+        maxfev=100000)
+    return popt[1]
+
+
+def main():
+    frequencies = np.fft.rfftfreq(NPTS, 1.0 / SAMPLING_RATE)
+    true = calculate_source_spectrum(frequencies, OMEGA_0, CORNER_FREQUENCY,
+        QUALITY_FACTOR, TRAVELTIME)
+    _, band_frequencies, weights = log_frequency_bands(true, frequencies,
+        BANDS_PER_DECADE)
+    positive = frequencies[frequencies > 0]
+    above = band_frequencies > CORNER_FREQUENCY
+    print "%i samples, %i bands" % (len(positive), len(band_frequencies))
+    print "Share of the leverage above the corner frequency:"
+    print "    raw spectrum:           %.2f" % \
+        (positive > CORNER_FREQUENCY).mean()
+    print "    equally weighted bands: %.2f" % above.mean()
+    print "    count weighted bands:   %.2f" % \
+        (weights[above].sum() / float(weights.sum()))
+
+    for noise_floor in NOISE_FLOORS:
+        rng = np.random.RandomState(12345)
+        corner_frequencies = {"raw": [], "equal": [], "counts": []}
+        for _i in xrange(REALIZATION_COUNT):
+            # Exponentially distributed power like a two degrees of freedom
+            # periodogram.
+            spectrum = np.sqrt(true ** 2 + (noise_floor * OMEGA_0) ** 2) * \
+                np.sqrt(rng.chisquare(2, len(frequencies)) / 2.0)
+            omega_0, f_c, _ = grid_search_initial_parameters(spectrum,
+                frequencies, TRAVELTIME, QUALITY_FACTOR)
+            corner_frequencies["raw"].append(fit_spectrum(spectrum,
+                frequencies, TRAVELTIME, omega_0, f_c, QUALITY_FACTOR)[1])
+            corner_frequencies["equal"].append(fit_spectrum(spectrum,
+                frequencies, TRAVELTIME, omega_0, f_c, QUALITY_FACTOR,
+                BANDS_PER_DECADE)[1])
+            corner_frequencies["counts"].append(fit_counts_weighted(spectrum,
+                frequencies, omega_0, f_c))
+        print "\nNoise floor %.2f * omega_0, true corner frequency %.1f Hz" % \
+            (noise_floor, CORNER_FREQUENCY)
+        for name in ("raw", "equal", "counts"):
+            values = np.array(corner_frequencies[name])
+            print "    %-6s median %5.2f Hz, 16th-84th percentile " \
+                "%5.2f-%5.2f Hz" % (name, np.median(values),
+                np.percentile(values, 16), np.percentile(values, 84))
+
+
+if __name__ == "__main__":
+    main()
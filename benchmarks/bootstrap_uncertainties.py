@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run time per event of bootstrap.bootstrap_source_parameters() for different
+numbers of stations.
+
+Run from the repository root:
+
+    python benchmarks/bootstrap_uncertainties.py
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+from bootstrap import REPLICATES, bootstrap_source_parameters
+
+STATION_COUNTS = [2, 5, 10, 30, 100]
+EVENT_COUNT = 200
+
+
+def main():
+    rng = np.random.RandomState(12345)
+    print "%i replicates per event" % REPLICATES
+    for station_count in STATION_COUNTS:
+        moments = 10 ** rng.normal(12.0, 0.3, (EVENT_COUNT, station_count))
+        source_radii = rng.uniform(50.0, 200.0, (EVENT_COUNT, station_count))
+        a = time.time()
+        for _i in xrange(EVENT_COUNT):
+            bootstrap_source_parameters(moments[_i], source_radii[_i])
+        run_time = time.time() - a
+        print "%3i stations: %.2f ms per event" % (station_count,
+            1000.0 * run_time / EVENT_COUNT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks transferring search results to the event map: one
+evaluateJavaScript() call per event versus a single addEvents() call with a
+JSON array.
+
+The real script.js is loaded into an off-screen QWebPage. jQuery and the
+Google Maps marker creation are replaced by no-op stubs so the benchmark runs
+offline and only measures the Python -> WebKit transfer and the Javascript
+event handling.
+
+Run from the repository root:
+
+    python benchmarks/event_transfer.py
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from PyQt4 import QtGui, QtWebKit
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+from obspy.core import UTCDateTime
+from gui_select_event_window import events_to_json
+
+SCRIPT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "resources", "html_resources", "script.js")
+
+# Replaces jQuery and the GMaps object.
+STUBS = """
+var $ = function() { return {ready: function(f) {}}; };
+window.events = new Array();
+var map = {addMarker: function(options) {
+    return {setMap: function(m) {}};
+}};
+"""
+
+EVENT_COUNTS = [2500, 25000]
+
+
+def create_events(count):
+    """
+    Creates random events in the format returned by the SeisHub client.
+    """
+    events = []
+    for _i in xrange(count):
+        events.append({
+            "latitude": random.uniform(47.0, 48.0),
+            "longitude": random.uniform(12.0, 13.0),
+            "depth": random.uniform(0.0, 10.0),
+            "magnitude": random.uniform(-1.0, 4.0),
+            "magnitude_type": "ML",
+            "datetime": UTCDateTime(2012, 1, 1) + _i,
+            "resource_name": "event_%i" % _i,
+            "account": "account",
+            "user": "user",
+            "localisation_method": "hyp2000"})
+    return events
+
+
+def create_frame():
+    page = QtWebKit.QWebPage()
+    frame = page.mainFrame()
+    with open(SCRIPT_FILE, "r") as open_file:
+        frame.evaluateJavaScript(STUBS + open_file.read())
+    # Keep the page alive as long as the frame is used.
+    frame.page_reference = page
+    return frame
+
+
+def transfer_one_by_one(frame, events):
+    """
+    The previous implementation: one call per event.
+    """
+    for event in events:
+        js_call = "addEvent({lat}, {lng}, {depth}, {magnitude}, " + \
+            "'{magnitude_type}', '{datetime}', '{event_id}', " + \
+            "'{misc_info}', '{server}')"
+        js_call = js_call.format( \
+            lat=event["latitude"],
+            lng=event["longitude"],
+            depth=event["depth"],
+            magnitude=event["magnitude"],
+            magnitude_type=event["magnitude_type"],
+            datetime=event["datetime"],
+            event_id=event["resource_name"],
+            misc_info=("SeisHub account: {account}; " + \
+                "SeisHub user: {user}; Localisation Method: " + \
+                "{localisation_method}").format( \
+                account=event["account"],
+                user=event["user"],
+                localisation_method=event["localisation_method"]),
+            server="SeisHub")
+        frame.evaluateJavaScript(js_call)
+
+
+def transfer_as_json(frame, events):
+    frame.evaluateJavaScript("addEvents(%s)" % events_to_json(events))
+
+
+def main():
+    app = QtGui.QApplication(sys.argv)
+    for count in EVENT_COUNTS:
+        events = create_events(count)
+        timings = []
+        for function in (transfer_one_by_one, transfer_as_json):
+            frame = create_frame()
+            a = time.time()
+            function(frame, events)
+            timings.append(time.time() - a)
+            # Make sure all events actually arrived.
+            transferred = frame.evaluateJavaScript("window.events.length")
+            assert int(transferred.toPyObject()) == count
+        print "%6i events: one by one: %7.3f s | JSON: %7.3f s | " \
+            "speedup: %.1fx" % (count, timings[0], timings[1],
+            timings[0] / timings[1])
+    del app
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares seeding the Levenberg-Marquardt spectral fit with the old fixed
+initial values (corner frequency of 10 Hz, omega_0 the mean below it) and
+with the grid search of spectral_analysis.grid_search_initial_parameters().
+
+Noisy synthetic source spectra with random corner frequencies are fitted.
+Reported are the number of evaluations of the theoretical spectrum, the
+failure rate (the fit raised or ended more than 25 % away from the true
+corner frequency) and the run time.
+
+Run from the repository root:
+
+    python benchmarks/initial_fit.py
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import spectral_analysis
+
+SPECTRUM_COUNT = 1000
+FREQUENCIES = np.linspace(0.0, 100.0, 201)
+QUALITY_FACTOR = 100.0
+# Standard deviation of the multiplicative log-normal noise.
+NOISE = 0.2
+
+
+class EvaluationCounter(object):
+    """
+    Counts the calls of the wrapped function.
+    """
+    def __init__(self, function):
+        self.function = function
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self.function(*args, **kwargs)
+
+
+def create_spectra(seed=12345):
+    rng = np.random.RandomState(seed)
+    spectra = []
+    for _i in xrange(SPECTRUM_COUNT):
+        corner_frequency = 10 ** rng.uniform(np.log10(0.5), np.log10(60.0))
+        traveltime = rng.uniform(1.0, 15.0)
+        spectrum = spectral_analysis.calculate_source_spectrum(FREQUENCIES,
+            10 ** rng.uniform(-9.0, -6.0), corner_frequency, QUALITY_FACTOR,
+            traveltime) * np.exp(rng.normal(0.0, NOISE, len(FREQUENCIES)))
+        spectra.append((spectrum, traveltime, corner_frequency))
+    return spectra
+
+
+def fixed_initial_values(spectrum, traveltime):
+    return spectral_analysis.initial_spectral_parameters(spectrum,
+        FREQUENCIES)
+
+
+def grid_search_initial_values(spectrum, traveltime):
+    return spectral_analysis.grid_search_initial_parameters(spectrum,
+        FREQUENCIES, traveltime, QUALITY_FACTOR)[:2]
+
+
+def run(spectra, initial_values):
+    counter = EvaluationCounter(spectral_analysis.calculate_source_spectrum)
+    spectral_analysis.calculate_source_spectrum = counter
+    failures = 0
+    a = time.time()
+    try:
+        for spectrum, traveltime, corner_frequency in spectra:
+            omega_0, f_c = initial_values(spectrum, traveltime)
+            try:
+                _, f_c, _, _ = spectral_analysis.fit_spectrum(spectrum,
+                    FREQUENCIES, traveltime, omega_0, f_c, QUALITY_FACTOR)
+            except Exception:
+                failures += 1
+                continue
+            if not np.isfinite(f_c) or \
+                    abs(f_c - corner_frequency) > 0.25 * corner_frequency:
+                failures += 1
+    finally:
+        spectral_analysis.calculate_source_spectrum = counter.function
+    return counter.count, failures, time.time() - a
+
+
+def main():
+    spectra = create_spectra()
+    for name, initial_values in [
+            ("Fixed initial values", fixed_initial_values),
+            ("Grid search", grid_search_initial_values)]:
+        evaluations, failures, run_time = run(spectra, initial_values)
+        print "%s: %.1f evaluations per fit, %.1f %% failed, %.3f s" % (
+            name, evaluations / float(SPECTRUM_COUNT),
+            100.0 * failures / SPECTRUM_COUNT, run_time)
+
+
+if __name__ == "__main__":
+    main()
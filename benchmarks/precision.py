@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Accuracy versus throughput of processing the waveforms and spectra in float32
+instead of float64.
+
+Synthetic Brune sources recorded by a 1 Hz seismometer are digitized to 24 bit
+counts. Each trace is instrument corrected, windowed around the pick, its
+spectrum is calculated and fitted, exactly like in the GUI and the batch
+script. The moment magnitudes of both precisions are compared.
+
+Run from the repository root, optionally with one of
+spectral_analysis.SPECTRAL_ESTIMATORS. The default multitaper estimator
+falls back to "hann" if mtspec is not installed:
+
+    python benchmarks/precision.py [estimator]
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+from obspy.core import Trace, UTCDateTime
+from spectral_analysis import PRECISIONS, calculate_spectrum, \
+    grid_search_initial_parameters, window_indices, fit_spectrum
+
+TRACE_COUNT = 200
+SAMPLING_RATE = 200.0
+DURATION = 40.0
+PICK_OFFSET = 20.0
+TRAVELTIME = 5.0
+QUALITY_FACTOR = 100.0
+# 1 Hz seismometer with an additional zero to correct to displacement.
+PAZ = {
+    "poles": [-4.44 + 4.44j, -4.44 - 4.44j],
+    "zeros": [0j, 0j, 0j],
+    "gain": 1.0,
+    "sensitivity": 1.0E9}
+# Converts Omega_0 to Mw for a fixed density, velocity and distance.
+MOMENT_FACTOR = 4.0 * np.pi * 2700.0 * 4800.0 ** 3 * 20000.0 / 0.52
+
+
+def create_counts(seed=12345):
+    """
+    Creates TRACE_COUNT synthetic recordings as 24 bit integer counts.
+    """
+    rng = np.random.RandomState(seed)
+    npts = int(DURATION * SAMPLING_RATE)
+    freqs = np.fft.rfftfreq(npts, 1.0 / SAMPLING_RATE)
+    omega = 2.0 * np.pi * freqs * 1j
+    response = PAZ["sensitivity"] * omega ** 3 / \
+        ((omega - PAZ["poles"][0]) * (omega - PAZ["poles"][1]))
+    traces = []
+    for _i in xrange(TRACE_COUNT):
+        corner_frequency = rng.uniform(2.0, 30.0)
+        omega_0 = 10 ** rng.uniform(-9.0, -6.0)
+        spectrum = omega_0 / np.sqrt(1.0 + (freqs / corner_frequency) ** 4) * \
+            np.exp(-np.pi * freqs * TRAVELTIME / QUALITY_FACTOR)
+        # Shift the source to the pick.
+        spectrum = spectrum * np.exp(-2.0 * np.pi * 1j * freqs * PICK_OFFSET)
+        counts = np.fft.irfft(spectrum * response, npts) * SAMPLING_RATE
+        # Scale to use most of the 24 bit range and add some noise.
+        counts *= 2 ** 22 / np.abs(counts).max()
+        counts += rng.normal(0.0, 50.0, npts)
+        traces.append(np.round(counts).astype(np.int32))
+    return traces
+
+
+def process(counts, precision, estimator="multitaper"):
+    """
+    Runs the whole processing chain. Returns the moment magnitudes and corner
+    frequencies, the number of bytes of the corrected waveforms and the run
+    time.
+    """
+    dtype = PRECISIONS[precision]
+    starttime = UTCDateTime(2012, 1, 1)
+    pick_time = starttime + PICK_OFFSET
+    magnitudes = []
+    corner_frequencies = []
+    waveform_bytes = 0
+    a = time.time()
+    for data in counts:
+        trace = Trace(data=data.astype(dtype))
+        trace.stats.sampling_rate = SAMPLING_RATE
+        trace.stats.starttime = starttime
+        trace.detrend()
+        trace.simulate(paz_remove=dict(PAZ), water_level=10.0)
+        trace.data = trace.data.astype(dtype, copy=False)
+        waveform_bytes += trace.data.nbytes
+        start, end = window_indices(trace, pick_time, 0.2, 0.8)
+        spec, freq, _ = calculate_spectrum(trace.data[start:end],
+            trace.stats.delta, dtype=dtype, estimator=estimator)
+        try:
+            omega_0, f_c, _ = grid_search_initial_parameters(spec, freq,
+                TRAVELTIME, QUALITY_FACTOR)
+            omega_0, f_c, _, _ = fit_spectrum(spec, freq, TRAVELTIME, omega_0,
+                f_c, QUALITY_FACTOR)
+        except Exception:
+            omega_0 = f_c = np.nan
+        magnitudes.append(2.0 / 3.0 * (np.log10(MOMENT_FACTOR * omega_0) -
+            9.1))
+        corner_frequencies.append(f_c)
+    return np.array(magnitudes), np.array(corner_frequencies), \
+        waveform_bytes, time.time() - a
+
+
+def main():
+    estimator = sys.argv[1] if len(sys.argv) > 1 else "multitaper"
+    if estimator == "multitaper":
+        try:
+            import mtspec
+        except ImportError:
+            print "mtspec is not installed. Using the hann estimator instead."
+            estimator = "hann"
+    print "Creating %i synthetic traces..." % TRACE_COUNT
+    counts = create_counts()
+    results = {}
+    print "Spectral estimator: %s" % estimator
+    for precision in ["float64", "float32"]:
+        results[precision] = process(counts, precision, estimator)
+        mw, f_c, waveform_bytes, run_time = results[precision]
+        print "%s: %.3f s (%.1f traces/s), %.1f MB of waveforms, %i failed " \
+            "fits" % (precision, run_time, TRACE_COUNT / run_time,
+            waveform_bytes / 1024.0 ** 2, np.isnan(mw).sum())
+
+    mw_64, f_c_64 = results["float64"][:2]
+    mw_32, f_c_32 = results["float32"][:2]
+    valid = np.isfinite(mw_64) & np.isfinite(mw_32)
+    mw_diff = np.abs(mw_32 - mw_64)[valid]
+    f_c_diff = (np.abs(f_c_32 - f_c_64) / f_c_64)[valid]
+    print "Mw difference: median %.2e, max %.2e" % (np.median(mw_diff),
+        mw_diff.max())
+    print "Relative corner frequency difference: median %.2e, max %.2e, " \
+        "%i of %i above 1%%" % (np.median(f_c_diff), f_c_diff.max(),
+        (f_c_diff > 0.01).sum(), len(f_c_diff))
+    print "Speedup of float32: %.2f" % (results["float64"][3] /
+        results["float32"][3])
+
+
+if __name__ == "__main__":
+    main()
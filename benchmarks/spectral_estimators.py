@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput and moment magnitude bias of the spectral estimators of
+spectral_analysis.SPECTRAL_ESTIMATORS.
+
+Synthetic displacement pulses with a known omega_0 and corner frequency are
+placed behind the pick in noisy traces. The default window of the GUI around
+the pick is estimated and fitted with every estimator. The magnitude bias is
+relative to the true omega_0 normalized like a power spectral density of the
+window. If mtspec is installed, the Hann and Welch estimators are also
+compared trace by trace with the multitaper estimator used so far, which is
+the offset a catalog would see when switching the estimator.
+
+Run from the repository root:
+
+    python benchmarks/spectral_estimators.py
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+from spectral_analysis import SPECTRAL_ESTIMATORS, calculate_spectrum, \
+    calculate_source_spectrum, grid_search_initial_parameters, fit_spectrum
+
+TRACE_COUNT = 500
+SAMPLING_RATE = 200.0
+DURATION = 10.0
+PICK_OFFSET = 5.0
+# Same window as the GUI.
+SECONDS_BEFORE_PICK = 0.2
+SECONDS_AFTER_PICK = 0.8
+# The pulses are centered this long after the pick.
+PULSE_DELAY = 0.2
+TRAVELTIME = 2.0
+QUALITY_FACTOR = 200.0
+# Noise level relative to the maximum amplitude of every pulse.
+NOISE = 0.01
+
+
+def create_windows(seed=12345):
+    """
+    Returns a list of (data_window, omega_0, corner_frequency) tuples.
+    """
+    rng = np.random.RandomState(seed)
+    npts = int(DURATION * SAMPLING_RATE)
+    freqs = np.fft.rfftfreq(npts, 1.0 / SAMPLING_RATE)
+    start = int((PICK_OFFSET - SECONDS_BEFORE_PICK) * SAMPLING_RATE)
+    end = int((PICK_OFFSET + SECONDS_AFTER_PICK) * SAMPLING_RATE)
+    windows = []
+    for _i in xrange(TRACE_COUNT):
+        corner_frequency = rng.uniform(3.0, 20.0)
+        omega_0 = 10 ** rng.uniform(-9.0, -6.0)
+        spectrum = calculate_source_spectrum(freqs, omega_0, corner_frequency,
+            QUALITY_FACTOR, TRAVELTIME) * \
+            np.exp(-2.0 * np.pi * 1j * freqs * (PICK_OFFSET + PULSE_DELAY))
+        data = np.fft.irfft(spectrum, npts) * SAMPLING_RATE
+        data += rng.normal(0.0, NOISE * np.abs(data).max(), npts)
+        windows.append((data[start:end], omega_0, corner_frequency))
+    return windows
+
+
+def process(windows, estimator):
+    """
+    Returns the time spent estimating the spectra, the total time and the
+    errors of the moment magnitudes and corner frequencies.
+    """
+    delta = 1.0 / SAMPLING_RATE
+    # A transient in a window of this length has a power spectral density of
+    # 2 * |X(f)| ^ 2 / length.
+    normalization = np.sqrt(2.0 / (SECONDS_BEFORE_PICK + SECONDS_AFTER_PICK))
+    spectra = []
+    a = time.time()
+    for data, _, _ in windows:
+        spectra.append(calculate_spectrum(data, delta,
+            estimator=estimator)[:2])
+    estimation_time = time.time() - a
+    mw_errors = []
+    f_c_errors = []
+    for (spec, freq), (_, omega_0, corner_frequency) in zip(spectra, windows):
+        try:
+            initial_omega_0, initial_f_c, _ = grid_search_initial_parameters(
+                spec, freq, TRAVELTIME, QUALITY_FACTOR)
+            fit_omega_0, f_c, _, _ = fit_spectrum(spec, freq, TRAVELTIME,
+                initial_omega_0, initial_f_c, QUALITY_FACTOR)
+        except Exception:
+            fit_omega_0 = f_c = np.nan
+        # Mw only depends on log10(omega_0).
+        mw_errors.append(2.0 / 3.0 * np.log10(fit_omega_0 /
+            (normalization * omega_0)))
+        f_c_errors.append((f_c - corner_frequency) / corner_frequency)
+    return estimation_time, time.time() - a, np.array(mw_errors), \
+        np.array(f_c_errors)
+
+
+def main():
+    windows = create_windows()
+    results = {}
+    for estimator in SPECTRAL_ESTIMATORS:
+        try:
+            results[estimator] = process(windows, estimator)
+        except ImportError, e:
+            print "%s: skipped (%s)" % (estimator, str(e))
+            continue
+        estimation_time, run_time, mw_errors, f_c_errors = results[estimator]
+        valid = np.isfinite(mw_errors) & np.isfinite(f_c_errors)
+        print "%s: %.0f spectra/s, %.0f spectra and fits/s, %i failed fits" \
+            % (estimator, TRACE_COUNT / estimation_time,
+            TRACE_COUNT / run_time, (~valid).sum())
+        print "    Mw bias %+.3f (std %.3f), relative corner frequency bias " \
+            "%+.3f (std %.3f)" % (mw_errors[valid].mean(),
+            mw_errors[valid].std(), f_c_errors[valid].mean(),
+            f_c_errors[valid].std())
+
+    if "multitaper" not in results:
+        return
+    _, _, reference_mw, reference_f_c = results["multitaper"]
+    for estimator in SPECTRAL_ESTIMATORS:
+        if estimator == "multitaper" or estimator not in results:
+            continue
+        _, _, mw_errors, f_c_errors = results[estimator]
+        # The errors share the true values, so their difference is the
+        # difference of the estimates.
+        mw_diff = mw_errors - reference_mw
+        f_c_ratio = (1.0 + f_c_errors) / (1.0 + reference_f_c) - 1.0
+        valid = np.isfinite(mw_diff) & np.isfinite(f_c_ratio)
+        print "%s - multitaper: Mw %+.3f (std %.3f), relative corner " \
+            "frequency %+.3f (std %.3f)" % (estimator, mw_diff[valid].mean(),
+            mw_diff[valid].std(), f_c_ratio[valid].mean(),
+            f_c_ratio[valid].std())
+
+
+if __name__ == "__main__":
+    main()
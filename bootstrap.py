@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bootstrap uncertainties of the event source parameters.
+
+The station estimates of the seismic moment and the source radius are
+resampled in pairs. All replicates are drawn at once as one index array so
+there is no Python loop per replicate.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+
+# Number of bootstrap replicates.
+REPLICATES = 2000
+# The lower and upper percentiles of the reported intervals.
+PERCENTILES = (2.5, 97.5)
+# The parameters for which intervals are calculated.
+SOURCE_PARAMETERS = ("seismic_moment", "moment_magnitude", "source_radius",
+    "stress_drop")
+
+
+def _source_parameters(moments, source_radii):
+    """
+    Derives all event parameters from the mean seismic moments and source
+    radii. Works on arrays of any shape.
+    """
+    return {
+        "seismic_moment": moments,
+        # After Hanks and Kanamori, see utils.moment_to_moment_magnitude().
+        "moment_magnitude": 2.0 / 3.0 * (np.log10(moments) - 9.1),
+        "source_radius": source_radii,
+        # After Eshelby, see utils.calculate_stress_drop().
+        "stress_drop": (7 * moments) / (16 * source_radii ** 3)}
+
+
+def bootstrap_source_parameters(moments, source_radii, replicates=REPLICATES,
+        percentiles=PERCENTILES, seed=None):
+    """
+    Bootstrap percentile intervals of the seismic moment, the moment
+    magnitude, the source radius and the stress drop of an event.
+
+    Needs at least two stations to be meaningful.
+
+    :param moments: Seismic moment in [Nm] of every station.
+    :param source_radii: Source radius in [m] of every station.
+    :param replicates: Number of bootstrap replicates.
+    :param percentiles: Lower and upper percentile of the intervals.
+    :param seed: Seed of the random number generator.
+    :returns: Dictionary mapping the parameter names to (std, lower, upper)
+        tuples of the bootstrap distributions.
+    """
+    moments = np.asarray(moments, dtype=np.float64)
+    source_radii = np.asarray(source_radii, dtype=np.float64)
+    rng = np.random.RandomState(seed)
+    # Every row is one replicate.
+    indices = rng.randint(0, len(moments), size=(replicates, len(moments)))
+    parameters = _source_parameters(moments[indices].mean(axis=1),
+        source_radii[indices].mean(axis=1))
+    intervals = {}
+    for name, values in parameters.iteritems():
+        lower, upper = np.percentile(values, percentiles)
+        intervals[name] = (values.std(), lower, upper)
+    return intervals
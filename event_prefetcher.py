@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Speculative background download of event details from the SeisHub server.
+
+While the user browses the map, the details of the events most likely to be
+looked at next are downloaded and parsed in a few background threads. The
+parsed Event objects are kept in a small LRU cache so "Load Details" does not
+have to wait for the network.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import collections
+import StringIO
+import threading
+
+from seishub_event_format_parser import readSeishubEventFile
+
+
+class LRUCache(object):
+    """
+    Thread-safe dictionary like cache discarding the least recently used item
+    once it holds more than max_size items.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            # Move it to the end.
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+class EventDetailPrefetcher(object):
+    """
+    Downloads and parses SeisHub event resources in background threads.
+
+    :param base_url: The URL of the SeisHub server.
+    :param cache_size: Number of parsed events to keep.
+    :param worker_count: Number of download threads.
+    :param max_pending: Maximum number of queued resources. Each call to
+        prefetch() replaces the queue so only the most recent candidates
+        will be downloaded.
+    """
+    def __init__(self, base_url, cache_size=30, worker_count=2,
+            max_pending=10):
+        self.base_url = base_url
+        self.cache = LRUCache(cache_size)
+        self.max_pending = max_pending
+        self._pending = []
+        self._in_progress = set()
+        self._condition = threading.Condition()
+        for _i in xrange(worker_count):
+            thread = threading.Thread(target=self._work)
+            # Do not keep the application alive.
+            thread.daemon = True
+            thread.start()
+
+    def prefetch(self, resource_names):
+        """
+        Queues the given resources in order of priority. Already cached or
+        currently downloading resources are skipped.
+        """
+        with self._condition:
+            self._pending = [_i for _i in resource_names
+                if _i not in self.cache and _i not in self._in_progress]
+            self._pending = self._pending[:self.max_pending]
+            self._condition.notify_all()
+
+    def get(self, resource_name):
+        """
+        Returns the parsed event or None if it has not been downloaded yet.
+        """
+        return self.cache.get(resource_name)
+
+    def fetch(self, resource_name):
+        """
+        Returns the parsed event, downloading it right away if it is not yet
+        cached. Errors are raised.
+        """
+        event = self.cache.get(resource_name)
+        if event is None:
+            event = self._download(resource_name)
+            self.cache.put(resource_name, event)
+        return event
+
+    def _download(self, resource_name):
+        from obspy.seishub import Client
+        client = Client(base_url=self.base_url)
+        resource = client.event.getResource(resource_name)
+        return readSeishubEventFile(StringIO.StringIO(resource))[0]
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                resource_name = self._pending.pop(0)
+                self._in_progress.add(resource_name)
+            try:
+                if resource_name not in self.cache:
+                    self.cache.put(resource_name,
+                        self._download(resource_name))
+            except Exception:
+                # Speculative only. A failure will be reported once the user
+                # actually requests the event.
+                pass
+            finally:
+                with self._condition:
+                    self._in_progress.discard(resource_name)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cache for the event index queries sent to the SeisHub server.
+
+A query that is completely contained in an earlier query (e.g. after zooming
+into the map or raising the minimum magnitude) can be answered locally by
+filtering the events of the earlier query. The events of every cached query
+are sorted by time and the time, location and magnitude are kept in NumPy
+arrays so the filtering is a binary search followed by a vectorized mask.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import time
+
+
+class EventQuery(object):
+    """
+    The parameters of one event index query. All bounds are inclusive.
+    """
+    def __init__(self, starttime, endtime, min_latitude, max_latitude,
+            min_longitude, max_longitude, min_magnitude, max_magnitude):
+        self.starttime = float(starttime.timestamp)
+        self.endtime = float(endtime.timestamp)
+        # Make sure min and max are in the right order.
+        self.min_latitude, self.max_latitude = \
+            sorted([min_latitude, max_latitude])
+        self.min_longitude, self.max_longitude = \
+            sorted([min_longitude, max_longitude])
+        self.min_magnitude = min_magnitude
+        self.max_magnitude = max_magnitude
+
+    def contains(self, other):
+        """
+        Returns True if every event matching the other query also matches this
+        one.
+        """
+        return self.starttime <= other.starttime and \
+            self.endtime >= other.endtime and \
+            self.min_latitude <= other.min_latitude and \
+            self.max_latitude >= other.max_latitude and \
+            self.min_longitude <= other.min_longitude and \
+            self.max_longitude >= other.max_longitude and \
+            self.min_magnitude <= other.min_magnitude and \
+            self.max_magnitude >= other.max_magnitude
+
+
+class _CacheEntry(object):
+    """
+    The result of one query together with the search index.
+    """
+    def __init__(self, query, events):
+        self.query = query
+        self.timestamp = time.time()
+        times = np.array([float(_i["datetime"].timestamp) for _i in events],
+            dtype="float64")
+        order = np.argsort(times, kind="mergesort")
+        self.events = [events[_i] for _i in order]
+        self.times = times[order]
+        self.latitudes = np.array([_i["latitude"] for _i in self.events],
+            dtype="float64")
+        self.longitudes = np.array([_i["longitude"] for _i in self.events],
+            dtype="float64")
+        self.magnitudes = np.array([_i["magnitude"] for _i in self.events],
+            dtype="float64")
+
+    def filter(self, query):
+        """
+        Returns all events of this entry matching the given query.
+        """
+        start = np.searchsorted(self.times, query.starttime, side="left")
+        end = np.searchsorted(self.times, query.endtime, side="right")
+        s = slice(start, end)
+        mask = (self.latitudes[s] >= query.min_latitude) & \
+            (self.latitudes[s] <= query.max_latitude) & \
+            (self.longitudes[s] >= query.min_longitude) & \
+            (self.longitudes[s] <= query.max_longitude) & \
+            (self.magnitudes[s] >= query.min_magnitude) & \
+            (self.magnitudes[s] <= query.max_magnitude)
+        return [self.events[start + _i] for _i in np.nonzero(mask)[0]]
+
+
+class EventQueryCache(object):
+    """
+    Caches the results of event index queries.
+
+    Only complete results, e.g. results that have not been truncated by the
+    server side limit, can be used to answer other queries.
+
+    :param ttl: Time in seconds after which a cached query expires.
+    :param max_entries: Maximum number of cached queries. The oldest query
+        will be discarded first.
+    """
+    def __init__(self, ttl=600.0, max_entries=20):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = []
+
+    def _expire(self):
+        now = time.time()
+        self._entries = [_i for _i in self._entries
+            if now - _i.timestamp <= self.ttl]
+
+    def get(self, query):
+        """
+        Returns the list of events matching query or None if the query cannot
+        be answered from the cache.
+        """
+        self._expire()
+        # Prefer the most recent results.
+        for entry in reversed(self._entries):
+            if entry.query.contains(query):
+                return entry.filter(query)
+        return None
+
+    def put(self, query, events, complete=True):
+        """
+        Adds the results of a query to the cache.
+
+        :param complete: False if the server truncated the results. Such
+            results will not be cached.
+        """
+        self._expire()
+        if not complete:
+            return
+        entry = _CacheEntry(query, events)
+        # Entries contained in the new one are no longer needed.
+        self._entries = [_i for _i in self._entries
+            if not query.contains(_i.query)]
+        self._entries.append(entry)
+        self._entries = self._entries[-self.max_entries:]
+
+    def clear(self):
+        self._entries = []
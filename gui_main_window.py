@@ -18,21 +18,46 @@ rcParams["figure.figsize"] = (8, 6)
 
 import copy
 import matplotlib.patches
-import matplotlib.widgets
-import mtspec
 import numpy as np
-from obspy.core.event import Comment, Magnitude, Catalog
-from obspy.seishub import Client
 import os
 
-from gui_select_event_window import SelectEventWindow
+# mtspec, ObsPy and the event selection window (QtWebKit) are imported on
+# first use to keep the startup time of the GUI low.
+from bootstrap import bootstrap_source_parameters, PERCENTILES
+from event_query_cache import EventQueryCache
 from gui_pick_table_view import PickTableView
 from gui_result_table_view import ResultsTableView
+from result_aggregator import ResultAggregator
 import ui_main_window
-from utils import center_Qt_window, calculate_source_spectrum, fit_spectrum, \
-    moment_from_low_freq_amplitude, lat_long_to_distance, \
-    moment_to_moment_magnitude, source_radius_from_corner_frequency, \
-    calculate_stress_drop
+from spectral_analysis import PRECISIONS, calculate_spectrum, \
+    grid_search_initial_parameters, window_indices, \
+    calculate_source_spectrum, fit_spectrum
+from spectrum_precomputation import SpectrumPrecomputer, spectrum_key
+from waveform_envelope import EnvelopePyramid
+from waveform_store import WaveformStore
+from utils import center_Qt_window
+
+# Time in seconds after which cached event searches expire.
+EVENT_QUERY_CACHE_TTL = 600.0
+# Default window around every pick whose spectrum is calculated and fitted in
+# the background after the data has been downloaded.
+DEFAULT_SECONDS_BEFORE_PICK = 0.2
+DEFAULT_SECONDS_AFTER_PICK = 0.8
+DEFAULT_QUALITY_FACTOR = 100.0
+# If set, spectra are averaged in this many logarithmically spaced frequency
+# bands per decade before fitting. The plots always show the full spectrum.
+FIT_BANDS_PER_DECADE = None
+# The spectral estimator, one of spectral_analysis.SPECTRAL_ESTIMATORS. Do not
+# mix estimators for the magnitudes of a catalog, see the comment there.
+SPECTRAL_ESTIMATOR = "multitaper"
+# Precision of the instrument corrected waveforms and their spectra. Either
+# "float32" or "float64". The spectral fits are always done in float64.
+WAVEFORM_PRECISION = "float64"
+# The instrument corrected waveforms of all events are stored here. The least
+# recently used events are deleted once it exceeds the size in bytes.
+WAVEFORM_STORE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "waveform_store")
+WAVEFORM_STORE_MAX_SIZE = 10 * 1024 ** 3
 
 
 class MainWindow(QtGui.QMainWindow):
@@ -61,7 +86,21 @@ class MainWindow(QtGui.QMainWindow):
         self.ui.density.setValue(self.current_state["density"])
         self.ui.v_p.setValue(self.current_state["p_wave_speed"])
         self.ui.v_s.setValue(self.current_state["s_wave_speed"])
-        self.results = []
+        # The results model is kept for the whole session and updated in
+        # place.
+        self.results_model = ResultsTableView()
+        self.ui.fit_table.setModel(self.results_model)
+        self.ui.fit_table.horizontalHeader().setStretchLastSection(True)
+        self.results = self.results_model.results
+        # Created once an event has been chosen.
+        self.result_aggregator = None
+        # Shared by all event selection windows.
+        self.event_query_cache = EventQueryCache(ttl=EVENT_QUERY_CACHE_TTL)
+        self.event_prefetcher = None
+        # Default spectra and fits of all picks.
+        self.spectrum_precomputer = SpectrumPrecomputer()
+        self.waveform_store = WaveformStore(WAVEFORM_STORE_DIRECTORY,
+            WAVEFORM_STORE_MAX_SIZE)
 
         # Connect all necessary signals and slots.
         self.__connect_signals_and_slots()
@@ -89,6 +128,8 @@ class MainWindow(QtGui.QMainWindow):
         # to avoid having to write real methods.
         def update_value(key, value):
             self.current_state[key] = value
+            if self.result_aggregator is not None:
+                setattr(self.result_aggregator, key, value)
             self._calculate_final_values()
         self.ui.density.valueChanged.connect( \
             lambda x: update_value("density", x))
@@ -112,12 +153,20 @@ class MainWindow(QtGui.QMainWindow):
         Creates a new obspy.core.event.Magnitude object and writes the moment
         magnitude to it.
         """
+        from obspy.core.event import Comment, Magnitude, Catalog
+
         # Get the save filename.
         filename = QtGui.QFileDialog.getSaveFileName(caption="Save as...")
         filename = os.path.abspath(str(filename))
         mag = Magnitude()
         mag.mag = self.final_result["moment_magnitude"]
         mag.magnitude_type = "Mw"
+        if "moment_magnitude_lower" in self.final_result:
+            mag.mag_errors.lower_uncertainty = mag.mag - \
+                self.final_result["moment_magnitude_lower"]
+            mag.mag_errors.upper_uncertainty = \
+                self.final_result["moment_magnitude_upper"] - mag.mag
+            mag.mag_errors.confidence_level = PERCENTILES[1] - PERCENTILES[0]
         mag.station_count = self.final_result["station_count"]
         mag.evaluation_mode = "manual"
         # Link to the used origin.
@@ -139,8 +188,11 @@ class MainWindow(QtGui.QMainWindow):
                 Comment("Very rough Q estimation: %.1f" % \
             self.final_result["quality_factor"]))
 
-        event = copy.deepcopy(self.current_state["event"])
-        event.magnitudes.append(mag)
+        # Only a shallow copy with its own list of magnitudes. Deep copying
+        # would duplicate all waveform data attached to the picks which is
+        # not written to the QuakeML file anyways.
+        event = copy.copy(self.current_state["event"])
+        event.magnitudes = list(event.magnitudes) + [mag]
         cat = Catalog()
         cat.events.append(event)
         cat.write(filename, format="quakeml")
@@ -150,12 +202,10 @@ class MainWindow(QtGui.QMainWindow):
         column = index.column()
         if column != 5 or (row + 1) > len(self.results):
             return
-        self.results.pop(row)
-        model = ResultsTableView(self.results)
-        self.ui.fit_table.setModel(model)
-        self.ui.fit_table.resizeRowsToContents()
-        self.ui.fit_table.resizeColumnsToContents()
-        self.ui.fit_table.horizontalHeader().setStretchLastSection(True)
+        result = self.results[row]
+        self.results_model.removeRows(row, 1)
+        if self.result_aggregator is not None:
+            self.result_aggregator.remove(result["channel"], result["phase"])
         self._calculate_final_values()
 
     def _on_waveform_canvas_mouse_button_press(self, event):
@@ -184,14 +234,31 @@ class MainWindow(QtGui.QMainWindow):
         stored in self.waveform_canvas_button_presses.
         """
         state = self.current_state["waveform_canvas_button_presses"]
+        current_ax = state["first_press"].inaxes
+        x1 = state["first_press"].xdata
+        x2 = state["second_press"].xdata
+        self._draw_selection(current_ax, x1, x2)
+        self.ui.waveform_figure.canvas.draw()
+
+        # The x-axis is in samples. Map the selection to exact sample
+        # indices.
+        npts = current_ax.waveform_trace.stats.npts
+        selection = [min(max(int(round(_i)), 0), npts) for _i in (x1, x2)]
+        selection.sort()
+
+        # Now calculate and plot the spectrum.
+        self.calculate_spectrum(current_ax.waveform_trace, selection)
+
+    def _draw_selection(self, current_ax, x1, x2):
+        """
+        Marks the selected time frame in current_ax and removes any previous
+        selection. Does not redraw the canvas.
+        """
         # Remove any previous boxes
         for ax in self.ui.waveform_figure.axes:
             if hasattr(ax, "selection_rectangle_patch"):
                 ax.selection_rectangle_patch.remove()
                 del ax.selection_rectangle_patch
-        current_ax = state["first_press"].inaxes
-        x1 = state["first_press"].xdata
-        x2 = state["second_press"].xdata
         ylim = current_ax.get_ylim()
         p = matplotlib.patches.Rectangle((min(x1, x2), ylim[0]),
             abs(x2 - x1), ylim[1] - ylim[0], facecolor="orange",
@@ -200,26 +267,57 @@ class MainWindow(QtGui.QMainWindow):
         current_ax.set_ylim(*ylim)
         # Only add it now in case something goes wrong earlier on.
         current_ax.selection_rectangle_patch = p
-        self.ui.waveform_figure.canvas.draw()
-
-        selection = [x1, x2]
-        selection.sort()
-
-        # Now calculate and plot the spectrum.
-        self.calculate_spectrum(current_ax.waveform_trace, selection)
 
     def calculate_spectrum(self, trace, selection_indices):
         """
-        Calculates the multitaper spectrum of the trace going from
+        Calculates the spectrum of the trace going from
         selection_indices[0] to selection_indices[1].
+
+        Spectra and fits already calculated in the background are reused.
         """
-        data = trace.data[selection_indices[0]: selection_indices[1]]
-        spec, freq, jackknife_errors, _, _ = mtspec.mtspec(data,
-            trace.stats.delta, 2, statistics=True)
-        spec = np.sqrt(spec)
-        jackknife_errors = np.sqrt(jackknife_errors)
+        precomputed = self.spectrum_precomputer.get(spectrum_key(trace,
+            selection_indices[0], selection_indices[1], SPECTRAL_ESTIMATOR))
+        if precomputed is not None:
+            spec = precomputed["spectrum"]
+            freq = precomputed["frequencies"]
+            jackknife_errors = precomputed["jackknife_errors"]
+        else:
+            data = trace.data[selection_indices[0]: selection_indices[1]]
+            # The spectra have the same precision as the waveforms.
+            spec, freq, jackknife_errors = calculate_spectrum(data,
+                trace.stats.delta, statistics=True, dtype=data.dtype,
+                estimator=SPECTRAL_ESTIMATOR)
 
         self.current_state["channel"] = trace.id
+        self._plot_spectrum(spec, freq, jackknife_errors)
+
+        if precomputed is not None and precomputed["fit"] is not None:
+            self.current_state["omega_0"], \
+                self.current_state["corner_frequency"], \
+                self.current_state["omega_0_var"], \
+                self.current_state["corner_frequency_var"] = \
+                precomputed["fit"]
+            self.current_state["quality_factor"] = \
+                precomputed["quality_factor"]
+            self.plot_theoretical_spectrum()
+            return
+
+        # Now guess some values with a coarse grid search, and fit the
+        # curve.
+        self.current_state["omega_0"], \
+            self.current_state["corner_frequency"], \
+            self.current_state["quality_factor"] = \
+            grid_search_initial_parameters(spec, freq,
+                self.current_state["pick"].time - \
+                self.current_state["event"].origins[0].time,
+                DEFAULT_QUALITY_FACTOR)
+        self._on_fit_spectrum()
+
+    def _plot_spectrum(self, spec, freq, jackknife_errors):
+        """
+        Plots a measured spectrum and its confidence intervals.
+        """
+        import matplotlib.widgets
 
         self.ui.spectrum_figure.clear()
         self.ui.spectrum_figure.subplots_adjust(left=0.1, bottom=0.1)
@@ -243,17 +341,6 @@ class MainWindow(QtGui.QMainWindow):
         ax.set_xlim(1.0, 100)
         self.ui.spectrum_figure.canvas.draw()
 
-        # Now guess guess some values, and fit the curve. Setting it to 10 is
-        # reasonable.
-        self.current_state["corner_frequency"] = 10.0
-        # Set omega_0 to the mean value of all values lower than the corner
-        # frequency.
-        corn_freq_index = \
-            np.abs(freq - self.current_state["corner_frequency"]).argmin()
-        self.current_state["omega_0"] = spec[:corn_freq_index].mean()
-        self.current_state["quality_factor"] = 100.0
-        self._on_fit_spectrum()
-
     def _on_spectrum_canvas_mouse_scroll(self, event):
         """
         Scrolling the mouse wheel fits the Q value.
@@ -346,7 +433,7 @@ class MainWindow(QtGui.QMainWindow):
                 self.current_state["event"].origins[0].time, \
                 self.current_state["omega_0"], \
                 self.current_state["corner_frequency"], \
-                self.current_state["quality_factor"])
+                self.current_state["quality_factor"], FIT_BANDS_PER_DECADE)
         self.plot_theoretical_spectrum()
 
     def _on_load_pick(self, model_index):
@@ -368,7 +455,16 @@ class MainWindow(QtGui.QMainWindow):
         self.ui.waveform_figure.subplots_adjust(left=0.1)
         for _i, trace in enumerate(pick.data):
             ax = self.ui.waveform_figure.add_subplot(len(pick.data), 1, _i + 1)
-            ax.plot(trace.data, color="black")
+            # Only plot the min/max envelope at the resolution of the screen.
+            # It is computed only once per trace.
+            if not hasattr(trace, "envelope_pyramid"):
+                trace.envelope_pyramid = EnvelopePyramid(trace.data)
+            x, y = trace.envelope_pyramid.get(0, trace.stats.npts,
+                ax.bbox.width)
+            ax.waveform_line = ax.plot(x, y, color="black")[0]
+            ax.set_xlim(0, trace.stats.npts)
+            ax.callbacks.connect("xlim_changed",
+                self._on_waveform_xlim_changed)
             ylim = ax.get_ylim()
             ax.text(0.99, 0.95, trace.id,
                 horizontalalignment="right", verticalalignment="top",
@@ -382,6 +478,34 @@ class MainWindow(QtGui.QMainWindow):
             # Append a reference of the trace to the axis.
             ax.waveform_trace = trace
         self.ui.waveform_figure.canvas.draw()
+        self._select_default_window()
+
+    def _select_default_window(self):
+        """
+        Selects the default window of the first trace of the current pick if
+        its spectrum has already been calculated in the background.
+        """
+        if not self.ui.waveform_figure.axes:
+            return
+        ax = self.ui.waveform_figure.axes[0]
+        trace = ax.waveform_trace
+        start, end = window_indices(trace, self.current_state["pick"].time,
+            DEFAULT_SECONDS_BEFORE_PICK, DEFAULT_SECONDS_AFTER_PICK)
+        if self.spectrum_precomputer.get(spectrum_key(trace, start, end,
+                SPECTRAL_ESTIMATOR)) is None:
+            return
+        self._draw_selection(ax, start, end)
+        self.ui.waveform_figure.canvas.draw()
+        self.calculate_spectrum(trace, [start, end])
+
+    def _on_waveform_xlim_changed(self, ax):
+        """
+        Switch to the envelope resolution fitting the new visible range.
+        """
+        xlim = ax.get_xlim()
+        x, y = ax.waveform_trace.envelope_pyramid.get(xlim[0], xlim[1] + 1,
+            ax.bbox.width)
+        ax.waveform_line.set_data(x, y)
 
     def _on_download_data(self):
         """
@@ -389,6 +513,7 @@ class MainWindow(QtGui.QMainWindow):
         """
         if "event" not in self.current_state:
             return
+        from obspy.seishub import Client
 
         event = self.current_state["event"]
         client = Client(base_url=str(self.ui.seishub_server.text()),
@@ -399,6 +524,7 @@ class MainWindow(QtGui.QMainWindow):
             len(event.picks))
         progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
         progress_dialog.forceShow()
+        saved_picks = []
         # Attempt to load all the station information for all picks.
         for _i, pick in enumerate(event.picks):
             progress_dialog.setValue(_i)
@@ -411,6 +537,12 @@ class MainWindow(QtGui.QMainWindow):
                     pick.data[0].stats.starttime) - \
                     2.0 * float(self.ui.buffer_seconds.value())) < 0.1:
                     continue
+            # Already downloaded and corrected in an earlier session.
+            st = self.waveform_store.load(event, pick,
+                float(self.ui.buffer_seconds.value()))
+            if st is not None:
+                pick.data = st
+                continue
             try:
                 st = client.waveform.getWaveform( \
                     network=pick.waveform_id.network_code,
@@ -435,9 +567,31 @@ class MainWindow(QtGui.QMainWindow):
             st.merge(-1)
             st.detrend()
             st.simulate(paz_remove="self", water_level=10.0)
+            for trace in st:
+                trace.data = trace.data.astype(PRECISIONS[WAVEFORM_PRECISION],
+                    copy=False)
+            self.waveform_store.save(event, pick,
+                float(self.ui.buffer_seconds.value()), st)
             pick.data = st
+            saved_picks.append(pick)
+        if saved_picks:
+            self.waveform_store.commit(event)
+        # Continue with the memory mapped copies to free the memory.
+        for pick in saved_picks:
+            st = self.waveform_store.load(event, pick,
+                float(self.ui.buffer_seconds.value()))
+            if st is not None:
+                pick.data = st
         # Finish the progress dialog.
         progress_dialog.setValue(len(event.picks))
+        self._precompute_default_spectra(event)
+
+        for pick in event.picks:
+            if hasattr(pick, "data") and len(pick.data):
+                stats = pick.data[0].stats
+                self.result_aggregator.set_station_coordinates("%s.%s" % \
+                    (stats.network, stats.station), stats.coordinates)
+        self._calculate_final_values()
 
         # Display all picks in a table view.
         model = PickTableView(event)
@@ -446,6 +600,26 @@ class MainWindow(QtGui.QMainWindow):
         self.ui.pick_table.resizeColumnsToContents()
         self.ui.pick_table.horizontalHeader().setStretchLastSection(True)
 
+    def _precompute_default_spectra(self, event):
+        """
+        Queues the calculation and fit of the spectra of the default window
+        of every trace of every pick with data.
+        """
+        for pick in event.picks:
+            if not hasattr(pick, "data"):
+                continue
+            traveltime = pick.time - event.origins[0].time
+            for trace in pick.data:
+                start, end = window_indices(trace, pick.time,
+                    DEFAULT_SECONDS_BEFORE_PICK, DEFAULT_SECONDS_AFTER_PICK)
+                if end - start < 2:
+                    continue
+                self.spectrum_precomputer.submit(
+                    spectrum_key(trace, start, end, SPECTRAL_ESTIMATOR),
+                    trace.data[start:end], trace.stats.delta, traveltime,
+                    DEFAULT_QUALITY_FACTOR, FIT_BANDS_PER_DECADE,
+                    SPECTRAL_ESTIMATOR)
+
     def event_chosen(self, event):
         """
         This is called when a new event has been selected.
@@ -455,6 +629,15 @@ class MainWindow(QtGui.QMainWindow):
         # The window might be hidden when this function is called.
         self.show()
         self.current_state["event"] = event
+        # The spectra of the previous event are no longer needed.
+        self.spectrum_precomputer.clear()
+        origin = event.origins[0]
+        self.result_aggregator = ResultAggregator(origin.latitude,
+            origin.longitude, origin.depth, self.current_state["density"],
+            self.current_state["p_wave_speed"],
+            self.current_state["s_wave_speed"])
+        for result in self.results:
+            self.result_aggregator.add(result)
         # Set some labels.
         self.ui.selected_event_id_label.setText(event.resource_id.resource_id)
         self.ui.selected_latitude_label.setText("%.4f" % \
@@ -486,117 +669,51 @@ class MainWindow(QtGui.QMainWindow):
             "quality_factor": self.current_state["quality_factor"],
             "phase": self.current_state["pick"].phase_hint,
             "channel": self.current_state["channel"]}
-        done = False
-        for res in self.results:
-            if res["channel"] == result["channel"] and \
-                res["phase"] == result["phase"]:
-                res.update(result)
-                done = True
-                break
-        if done is False:
-            self.results.append(result)
-        model = ResultsTableView(self.results)
-        self.ui.fit_table.setModel(model)
-        self.ui.fit_table.resizeRowsToContents()
-        self.ui.fit_table.resizeColumnsToContents()
-        self.ui.fit_table.horizontalHeader().setStretchLastSection(True)
+        is_first_result = not self.results
+        self.results_model.set_result(result)
+        self.result_aggregator.add(result)
+        # Size the columns once, the formatted values all have similar widths.
+        if is_first_result:
+            self.ui.fit_table.resizeRowsToContents()
+            self.ui.fit_table.resizeColumnsToContents()
 
         self._calculate_final_values()
 
     def _calculate_final_values(self):
         """
-        Takes every dict stored in self.results and produces the final output.
+        Displays the final output aggregated from all dicts stored in
+        self.results.
         """
+        final_result = None
+        if self.result_aggregator is not None:
+            final_result = self.result_aggregator.final_result()
         # If no results are available, nothing is to be done.
-        if len(self.results) == 0:
+        if final_result is None:
             self.ui.mean_parameter_line_1.setText("-")
             self.ui.mean_parameter_line_2.setText("-")
             if hasattr(self, "current_status"):
                 self.current_status["final_results"] = {}
             self.ui.save_file_button.setEnabled(False)
             return
-        # Do all the calculations per station and phase.
-        stations = {}
-        for result in self.results:
-            station = ".".join(result["channel"].split(".")[:2])
-            if not station in stations:
-                stations[station] = { \
-                    "p": [],
-                    "s": []}
-            # The conditional is not strictly necessary but takes care that no
-            # other phases slip in.
-            if result["phase"].lower() == "p":
-                stations[station]["p"].append(result)
-            elif result["phase"].lower() == "s":
-                stations[station]["s"].append(result)
-        # Save the station count for later inclusion in the QuakeML file.
-        station_count = len(stations.keys())
-        # For every phase, calculate the seismic source parameters M_0 and r.
-        # Also take the mean of all Q values, just because they are available.
-        final_results = { \
-            "M_0": [],
-            "r": [],
-            "Q": []}
-        # Loop over all picks and calculate the values.
-        for station_id, phases in stations.iteritems():
-            for phase, results in phases.iteritems():
-                if len(results) == 0:
-                    continue
-                # Collect the three variables extracted from the spectra.
-                omega_0 = [_i["omega_0"] for _i in results]
-                f_c = [_i["corner_frequency"] for _i in results]
-                Q = [_i["quality_factor"] for _i in results]
-
-                # The traveltime is necessary for the seismic moment
-                # calculation.
-                # XXX: This is also calculated for the pick table. Get it from
-                # there!
-                coordinates = None
-                for pick in self.current_state["event"].picks:
-                    if ("%s.%s" % (pick.data[0].stats.network,
-                        pick.data[0].stats.station)) == station_id:
-                        coordinates = pick.data[0].stats.coordinates
-                if coordinates is None:
-                    print "Warning: No coordinates for the station found."
-                    continue
-                # Hypocentral distance in meter.
-                distance = lat_long_to_distance( \
-                    self.current_state["event"].origins[0].latitude,
-                    self.current_state["event"].origins[0].longitude,
-                    self.current_state["event"].origins[0].depth,
-                    coordinates.latitude,
-                    coordinates.longitude,
-                    coordinates.elevation / 1000.0) * 1000.0
-                # Now everything necessary is available. Call the function
-                # necessary to calculate everything.
-                M_0 = moment_from_low_freq_amplitude(omega_0,
-                    self.current_state["density"],
-                    self.current_state["p_wave_speed"],
-                    distance, phase)
-                source_radius = source_radius_from_corner_frequency(f_c,
-                    self.current_state["s_wave_speed"], phase)
-                # Append it to the final result.
-                final_results["M_0"].append(M_0)
-                final_results["r"].append(source_radius)
-                final_results["Q"].extend(Q)
-        # Now calculate the composite result.
-        station_count = len(final_results["M_0"])
-        M_0 = sum(final_results["M_0"]) / float(len(final_results["M_0"]))
-        mag = moment_to_moment_magnitude(M_0)
-        source_radius = \
-            sum(final_results["r"]) / float(len(final_results["r"]))
-        stress_drop = calculate_stress_drop(M_0, source_radius)
-        quality_factor = sum(final_results["Q"]) / \
-            float(len(final_results["Q"]))
-        self.final_result = { \
-            "seismic_moment": M_0,
-            "moment_magnitude": mag,
-            "source_radius": source_radius,
-            "stress_drop": stress_drop,
-            "quality_factor": quality_factor,
-            "station_count": station_count}
+        # Bootstrap the stations for the uncertainties.
+        if final_result["station_count"] > 1:
+            intervals = bootstrap_source_parameters(
+                *self.result_aggregator.station_estimates())
+            for name, (_, lower, upper) in intervals.iteritems():
+                final_result[name + "_lower"] = lower
+                final_result[name + "_upper"] = upper
+        self.final_result = final_result
+        M_0 = final_result["seismic_moment"]
+        mag = final_result["moment_magnitude"]
+        quality_factor = final_result["quality_factor"]
+        source_radius = final_result["source_radius"]
+        stress_drop = final_result["stress_drop"]
         string = u"M₀: %.3e [Nm] || Mw: %.3f || Q: %.1f" % \
             (M_0, mag, quality_factor)
+        if "moment_magnitude_lower" in final_result:
+            string = u"M₀: %.3e [Nm] || Mw: %.3f (%.3f - %.3f) || Q: %.1f" \
+                % (M_0, mag, final_result["moment_magnitude_lower"],
+                final_result["moment_magnitude_upper"], quality_factor)
         self.ui.mean_parameter_line_1.setText(string)
         string = u"Source radius: %.1f || Stress drop: %.2f" % \
             (source_radius, stress_drop / 1E5)
@@ -607,7 +724,17 @@ class MainWindow(QtGui.QMainWindow):
         """
         Launches the select event window.
         """
-        window = SelectEventWindow(str(self.ui.seishub_server.text()))
+        from event_prefetcher import EventDetailPrefetcher
+        from gui_select_event_window import SelectEventWindow
+
+        base_url = str(self.ui.seishub_server.text())
+        # Cached results are only valid for the server they came from.
+        if self.event_prefetcher is None or \
+                self.event_prefetcher.base_url != base_url:
+            self.event_query_cache.clear()
+            self.event_prefetcher = EventDetailPrefetcher(base_url)
+        window = SelectEventWindow(base_url, self.event_query_cache,
+            self.event_prefetcher)
         window.closed.connect(self.show)
         window.event_chosen.connect(self.event_chosen)
         # Show the main window and bring it to the foreground.
@@ -10,16 +10,27 @@
 from PyQt4 import QtCore, QtGui
 
 
+def format_value(value):
+    if isinstance(value, basestring):
+        return value
+    elif value < 100.0 and value >= 0.1:
+        return "%.2f" % value
+    return "%.2e" % value
+
+
 class ResultsTableView(QtCore.QAbstractTableModel):
     """
     The results table view.
+
+    Persistent model with at most one result per channel and phase. Results
+    are added, updated and removed in place so the view does not have to be
+    rebuilt.
     """
-    def __init__(self, results):
+    def __init__(self, results=None):
         """
-        :param result: A list of result objects
+        :param results: A list of initial result objects
         """
         QtCore.QAbstractTableModel.__init__(self)
-        self.results = results
         self.header_value_map = { \
             "Channel": "channel",
             u"Ω₀": "omega_0",
@@ -29,6 +40,53 @@ class ResultsTableView(QtCore.QAbstractTableModel):
             "": ""}
 
         self.header_values = ["Channel", u"Ω₀", "f_c", "Q", "Phase", ""]
+        self.results = []
+        # (channel, phase) -> row.
+        self._rows = {}
+        # The formatted strings of every row.
+        self._display = []
+        for result in results or []:
+            self.set_result(result)
+
+    def _format_row(self, result):
+        row = []
+        for header in self.header_values:
+            if header == "":
+                row.append("Delete")
+            else:
+                row.append(format_value( \
+                    result[self.header_value_map[header]]))
+        return row
+
+    def set_result(self, result):
+        """
+        Adds the result or replaces the one with the same channel and phase.
+        """
+        key = (result["channel"], result["phase"])
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self.results)
+            self.beginInsertRows(QtCore.QModelIndex(), row, row)
+            self.results.append(result)
+            self._display.append(self._format_row(result))
+            self._rows[key] = row
+            self.endInsertRows()
+            return
+        self.results[row].update(result)
+        self._display[row] = self._format_row(self.results[row])
+        self.dataChanged.emit(self.index(row, 0),
+            self.index(row, self.columnCount() - 1))
+
+    def removeRows(self, row, count, parent=QtCore.QModelIndex()):
+        if row < 0 or count < 1 or row + count > len(self.results):
+            return False
+        self.beginRemoveRows(parent, row, row + count - 1)
+        del self.results[row:row + count]
+        del self._display[row:row + count]
+        self._rows = dict(((_i["channel"], _i["phase"]), _j)
+            for _j, _i in enumerate(self.results))
+        self.endRemoveRows()
+        return True
 
     def rowCount(self, *args):
         return len(self.results)
@@ -40,19 +98,7 @@ class ResultsTableView(QtCore.QAbstractTableModel):
         if not index.isValid():
             return QtCore.QVariant()
         if role == QtCore.Qt.DisplayRole:
-            column = index.column()
-            result_type = self.header_values[column]
-            if result_type == "":
-                return QtCore.QVariant("Delete")
-            value = \
-                self.results[index.row()][self.header_value_map[result_type]]
-            if isinstance(value, basestring):
-                pass
-            elif value < 100.0 and value >= 0.1:
-                value = "%.2f" % value
-            else:
-                value = "%.2e" % value
-            return QtCore.QVariant(value)
+            return QtCore.QVariant(self._display[index.row()][index.column()])
         # Set the background color for column id 4
         elif role == QtCore.Qt.BackgroundRole and index.column() == 5:
             return QtGui.QBrush(QtGui.QColor("#ff6060"))
@@ -9,22 +9,75 @@ PyQt4 window handling the event selection.
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
-from PyQt4 import QtGui, QtCore
+from PyQt4 import QtGui, QtCore, QtWebKit
 
+import heapq
 import inspect
+import json
 from obspy.core import UTCDateTime
 from obspy.core.event import Event
 import os
-import StringIO
 
-# Custom Seishub event file format reading routine.
-from seishub_event_format_parser import readSeishubEventFile
-from utils import GoogleMapsWebView, UTCtoQDateTime, QDatetoUTCDateTime, \
-    center_Qt_window
+from event_prefetcher import EventDetailPrefetcher
+from event_query_cache import EventQuery, EventQueryCache
+from incremental_event_loader import EventPageLoader, uncovered_regions
+from utils import UTCtoQDateTime, QDatetoUTCDateTime, center_Qt_window
 
 # Import the ui file.
 import ui_select_event_window
 
+# Maximum number of events requested from the SeisHub server per query.
+EVENT_LIMIT = 2500
+# Time in milliseconds the map bounds have to be stable before the events of
+# newly visible areas are loaded.
+BOUNDS_CHANGED_DELAY = 500
+# The details of the selected event, of its PREFETCH_NEIGHBOURS closest
+# events and of the PREFETCH_LARGEST largest events are downloaded in the
+# background.
+PREFETCH_NEIGHBOURS = 4
+PREFETCH_LARGEST = 4
+
+
+class GoogleMapsWebView(QtWebKit.QWebPage):
+    """
+    Subclass QWebPage to implement a custom user agent string and be able to
+    debug Javascript.
+    """
+    def javaScriptConsoleMessage(self, msg, line, source):
+        """
+        Print all Javascript Console Messages as a red string.
+        """
+        print "\033[1;31m" + \
+            "[JavaScript Console - {source} line {line}] {msg}".format( \
+            source=source, line=line, msg=msg) + \
+            "\033[1;m"
+
+
+def events_to_json(events):
+    """
+    Serializes a list of events as returned by the SeisHub client to a JSON
+    array that can directly be passed to the addEvents() Javascript function.
+    """
+    js_events = []
+    for event in events:
+        js_events.append({
+            "lat": event["latitude"],
+            "lng": event["longitude"],
+            "depth": event["depth"],
+            "magnitude": event["magnitude"],
+            "magnitude_type": event["magnitude_type"],
+            "datetime": str(event["datetime"]),
+            "event_id": event["resource_name"],
+            # Misc information in a human readable form. Use ; as delimiter.
+            "misc_info": ("SeisHub account: {account}; " + \
+                "SeisHub user: {user}; Localisation Method: " + \
+                "{localisation_method}").format( \
+                account=event["account"],
+                user=event["user"],
+                localisation_method=event["localisation_method"]),
+            "server": "SeisHub"})
+    return json.dumps(js_events)
+
 
 class SelectEventWindow(QtGui.QMainWindow):
     # Give the window a closed signal. This is necessary for the faked
@@ -34,10 +87,24 @@ class SelectEventWindow(QtGui.QMainWindow):
     # A signal that is emitted when the "Choose event" button has been clicked.
     event_chosen = QtCore.pyqtSignal(Event)
 
-    def __init__(self, base_url):
+    def __init__(self, base_url, query_cache=None, prefetcher=None):
+        """
+        :param base_url: The URL of the SeisHub server.
+        :param query_cache: An EventQueryCache object. Pass the same object
+            to every new window to reuse the results of earlier searches.
+        :param prefetcher: An EventDetailPrefetcher object for the same
+            server. Pass the same object to every new window to keep the
+            already downloaded events.
+        """
         QtGui.QMainWindow.__init__(self)
 
         self.base_url = base_url
+        if query_cache is None:
+            query_cache = EventQueryCache()
+        self.query_cache = query_cache
+        if prefetcher is None:
+            prefetcher = EventDetailPrefetcher(base_url)
+        self.prefetcher = prefetcher
 
         self.ui = ui_select_event_window.Ui_SelectEventWindow()
         self.ui.setupUi(self)
@@ -45,9 +112,22 @@ class SelectEventWindow(QtGui.QMainWindow):
 
         # Init event list and currently selected event.
         self.events = []
+        self.events_by_name = {}
         self.currently_selected_event = None
         self.current_selected_event_object = None
 
+        # Search parameters of the incremental loading mode. None until the
+        # first search in that mode.
+        self.incremental_search = None
+        # All regions already requested with the current search parameters.
+        self.loaded_regions = []
+        self.event_loaders = []
+
+        # Only react to changed bounds once the user stopped panning.
+        self.bounds_timer = QtCore.QTimer(self)
+        self.bounds_timer.setSingleShot(True)
+        self.bounds_timer.setInterval(BOUNDS_CHANGED_DELAY)
+
         self.init_widgets()
 
         self.connect_signals_and_slots()
@@ -72,6 +152,7 @@ class SelectEventWindow(QtGui.QMainWindow):
                 self)
 
     def closeEvent(self, event):
+        self._abort_event_loaders()
         self.closed.emit()
         event.accept()
 
@@ -89,6 +170,8 @@ class SelectEventWindow(QtGui.QMainWindow):
             self.north_east[1]))
         self.ui.southwest_label.setText("%.3f, %.3f" % (self.south_west[0],
             self.south_west[1]))
+        # (Re)start the timer.
+        self.bounds_timer.start()
 
     @QtCore.pyqtSlot(str)
     def event_selected(self, event_id):
@@ -106,10 +189,8 @@ class SelectEventWindow(QtGui.QMainWindow):
         self.ui.selected_event_warning.setText("")
 
         self.current_selected_event_object = None
-        for event in self.events:
-            if event["resource_name"] == event_id:
-                self.currently_selected_event = event
-                break
+        self.currently_selected_event = \
+            self.events_by_name.get(str(event_id))
         # Handle an eventual error.
         if self.currently_selected_event is None:
             QtGui.QMessageBox.critical(self, "Error",
@@ -129,12 +210,15 @@ class SelectEventWindow(QtGui.QMainWindow):
         # Last but not least enable the detail loading button.
         self.ui.selected_event_load_details.setEnabled(True)
 
+        self._prefetch_event_details()
+
     def connect_signals_and_slots(self):
         self.ui.search_events_button.clicked.connect(self.search_for_events)
         self.ui.selected_event_load_details.clicked.connect(\
             self.load_event_object)
         self.ui.choose_event_button.clicked.connect(self.choose_event)
         self.ui.cancel_button.clicked.connect(self.close)
+        self.bounds_timer.timeout.connect(self._on_bounds_settled)
 
     def choose_event(self):
         if self.current_selected_event_object is None:
@@ -154,10 +238,9 @@ class SelectEventWindow(QtGui.QMainWindow):
                 "Selected event not found - something is wrong. Please " + \
                 "contact the developer or fix the code yourself...")
             return
-        from obspy.seishub import Client
-        client = Client(base_url=self.base_url)
         try:
-            resource = client.event.getResource( \
+            # Usually already downloaded in the background.
+            self.current_selected_event_object = self.prefetcher.fetch( \
                 self.currently_selected_event["resource_name"])
         except Exception, e:
             error_type_str = e.__class__.__name__
@@ -170,9 +253,6 @@ class SelectEventWindow(QtGui.QMainWindow):
                 message=str(e)))
             msg_box.exec_()
             return
-        file_object = StringIO.StringIO(resource)
-        self.current_selected_event_object = \
-            readSeishubEventFile(file_object)[0]
         # Get the P and S wave pick counts.
         p_picks = len([_i for _i in self.current_selected_event_object.picks \
             if _i.phase_hint == "P"])
@@ -203,6 +283,44 @@ class SelectEventWindow(QtGui.QMainWindow):
         min_mag = self.ui.min_magnitude.value()
         max_mag = self.ui.max_magnitude.value()
 
+        self._abort_event_loaders()
+        if self.ui.incremental_loading.isChecked():
+            self._start_incremental_search(starttime, endtime, min_mag,
+                max_mag)
+            return
+        self.incremental_search = None
+
+        query = EventQuery(starttime, endtime, self.north_east[0],
+            self.south_west[0], self.north_east[1], self.south_west[1],
+            min_mag, max_mag)
+        # Subsets of earlier queries can be answered locally.
+        events = self.query_cache.get(query)
+        if events is None:
+            events = self._download_event_index(starttime, endtime, min_mag,
+                max_mag)
+            if events is None:
+                return
+            # Truncated results cannot be used to answer other queries.
+            self.query_cache.put(query, events,
+                complete=len(events) < EVENT_LIMIT)
+
+        # Clear the old events.
+        self.ui.webView.page().mainFrame().evaluateJavaScript("clearEvents()")
+
+        # Transfer all events in one go.
+        self.ui.webView.page().mainFrame().evaluateJavaScript( \
+            "addEvents(%s)" % events_to_json(events))
+
+        # Make it a instance attribute.
+        self.events = events
+        self.events_by_name = dict((_i["resource_name"], _i) for _i in events)
+        self._prefetch_event_details()
+
+    def _download_event_index(self, starttime, endtime, min_mag, max_mag):
+        """
+        Downloads the event index from the SeisHub server. Returns None if it
+        failed.
+        """
         model_box = QtGui.QMessageBox(QtGui.QMessageBox.Information,
             "", "Downloading event index. Please wait...",
             QtGui.QMessageBox.NoButton)
@@ -211,7 +329,7 @@ class SelectEventWindow(QtGui.QMainWindow):
         from obspy.seishub import Client
         c = Client(base_url=self.base_url)
         try:
-            events = c.event.getList(limit=2500, min_datetime=starttime,
+            events = c.event.getList(limit=EVENT_LIMIT, min_datetime=starttime,
                 max_datetime=endtime, min_latitude=self.north_east[0],
                 max_latitude=self.south_west[0],
                 min_longitude=self.north_east[1],
@@ -228,34 +346,120 @@ class SelectEventWindow(QtGui.QMainWindow):
                 err_type=error_type_str,
                 message=str(e)))
             msg_box.exec_()
-            return
+            return None
+        model_box.done(0)
+        return events
 
-        # Clear the old events.
+    def _current_region(self):
+        """
+        Returns the currently visible map region.
+        """
+        lats = sorted([self.north_east[0], self.south_west[0]])
+        lngs = sorted([self.north_east[1], self.south_west[1]])
+        return (lats[0], lats[1], lngs[0], lngs[1])
+
+    def _start_incremental_search(self, starttime, endtime, min_mag, max_mag):
+        """
+        Starts a new search in the incremental loading mode. Afterwards the
+        events of every newly visible region will be loaded automatically.
+        """
         self.ui.webView.page().mainFrame().evaluateJavaScript("clearEvents()")
+        self.events = []
+        self.events_by_name = {}
+        self.loaded_regions = []
+        self.incremental_search = {
+            "starttime": starttime,
+            "endtime": endtime,
+            "min_magnitude": min_mag,
+            "max_magnitude": max_mag}
+        self._load_missing_regions()
+
+    def _on_bounds_settled(self):
+        if self.incremental_search is None or \
+                not self.ui.incremental_loading.isChecked():
+            return
+        self._load_missing_regions()
 
-        for event in events:
-            js_call = "addEvent({lat}, {lng}, {depth}, {magnitude}, " + \
-                "'{magnitude_type}', '{datetime}', '{event_id}', " + \
-                "'{misc_info}', '{server}')"
-            js_call = js_call.format( \
-                lat=event["latitude"],
-                lng=event["longitude"],
-                depth=event["depth"],
-                magnitude=event["magnitude"],
-                magnitude_type=event["magnitude_type"],
-                datetime=event["datetime"],
-                event_id=event["resource_name"],
-                # Misc information in a human readable form. Use ; as
-                # delimiter.
-                misc_info=("SeisHub account: {account}; " + \
-                    "SeisHub user: {user}; Localisation Method: " + \
-                    "{localisation_method}").format( \
-                    account=event["account"],
-                    user=event["user"],
-                    localisation_method=event["localisation_method"]),
-                server="SeisHub")
-            self.ui.webView.page().mainFrame().evaluateJavaScript(js_call)
+    def _load_missing_regions(self):
+        """
+        Requests the events of all visible regions that have not yet been
+        loaded in a background thread.
+        """
+        region = self._current_region()
+        # Regions that are still being loaded are not requested again.
+        regions = uncovered_regions(region, self.loaded_regions +
+            [_i.region for _i in self.event_loaders])
+        if not regions:
+            return
+        search = self.incremental_search
+        loader = EventPageLoader(self.base_url, regions, search["starttime"],
+            search["endtime"], search["min_magnitude"],
+            search["max_magnitude"], page_size=EVENT_LIMIT)
+        # Only marked as loaded once the loader succeeded.
+        loader.region = region
+        loader.request_failed = False
+        loader.page_loaded.connect(self._on_event_page_loaded)
+        loader.failed.connect(self._on_event_page_failed)
+        loader.finished.connect(self._on_event_loader_finished)
+        self.event_loaders.append(loader)
+        loader.start()
+
+    def _abort_event_loaders(self):
+        for loader in self.event_loaders:
+            loader.abort()
+        self.event_loaders = []
+
+    def _on_event_loader_finished(self):
+        loader = self.sender()
+        # Aborted loaders have already been removed.
+        if loader not in self.event_loaders:
+            return
+        self.event_loaders.remove(loader)
+        if not loader.request_failed:
+            self.loaded_regions.append(loader.region)
 
-        # Make it a instance attribute.
-        self.events = events
-        model_box.done(0)
+    def _on_event_page_loaded(self, events):
+        """
+        Adds a page of events from a background loader to the map.
+        """
+        # Ignore late pages of aborted loaders.
+        if self.sender() not in self.event_loaders:
+            return
+        # Neighbouring regions share their borders.
+        events = [_i for _i in events
+            if _i["resource_name"] not in self.events_by_name]
+        if not events:
+            return
+        for event in events:
+            self.events_by_name[event["resource_name"]] = event
+        self.events.extend(events)
+        self.ui.webView.page().mainFrame().evaluateJavaScript( \
+            "addEvents(%s)" % events_to_json(events))
+        self._prefetch_event_details()
+
+    def _on_event_page_failed(self, message):
+        # The regions of the loader will be requested again.
+        self.sender().request_failed = True
+        print "Problem while downloading the event index:", message
+
+    def _prefetch_event_details(self):
+        """
+        Starts downloading the details of the events the user most likely
+        looks at next: the selected event, the events closest to it and the
+        largest events.
+        """
+        candidates = []
+        selected = self.currently_selected_event
+        if selected is not None:
+            candidates.append(selected)
+            candidates.extend(heapq.nsmallest(PREFETCH_NEIGHBOURS + 1,
+                self.events, key=lambda x: \
+                (x["latitude"] - selected["latitude"]) ** 2 + \
+                (x["longitude"] - selected["longitude"]) ** 2))
+        candidates.extend(heapq.nlargest(PREFETCH_LARGEST, self.events,
+            key=lambda x: x["magnitude"]))
+        names = []
+        for event in candidates:
+            if event["resource_name"] not in names:
+                names.append(event["resource_name"])
+        self.prefetcher.prefetch(names)
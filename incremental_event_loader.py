@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental loading of the event index while panning the map.
+
+Only the parts of the map that have not been loaded before are requested
+from the SeisHub server. The requests run in a background thread which pages
+through the results beyond the server side limit and hands every page to the
+GUI thread as soon as it arrives.
+
+Regions are (min_latitude, max_latitude, min_longitude, max_longitude)
+tuples.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from PyQt4 import QtCore
+
+
+# Keep a reference to all running loaders. A QThread must not be garbage
+# collected while it is still running, even if the window that started it has
+# already been closed.
+_RUNNING_LOADERS = set()
+
+
+def subtract_region(region, other):
+    """
+    Returns a list of up to four regions that together cover all of region
+    that is not covered by other.
+    """
+    min_lat, max_lat, min_lng, max_lng = region
+    o_min_lat, o_max_lat, o_min_lng, o_max_lng = other
+    # No overlap at all.
+    if o_min_lat >= max_lat or o_max_lat <= min_lat or \
+            o_min_lng >= max_lng or o_max_lng <= min_lng:
+        return [region]
+    pieces = []
+    # Southern and northern strips over the full width.
+    if o_min_lat > min_lat:
+        pieces.append((min_lat, o_min_lat, min_lng, max_lng))
+    if o_max_lat < max_lat:
+        pieces.append((o_max_lat, max_lat, min_lng, max_lng))
+    # Western and eastern strips in the remaining latitude band.
+    band_min_lat = max(min_lat, o_min_lat)
+    band_max_lat = min(max_lat, o_max_lat)
+    if o_min_lng > min_lng:
+        pieces.append((band_min_lat, band_max_lat, min_lng, o_min_lng))
+    if o_max_lng < max_lng:
+        pieces.append((band_min_lat, band_max_lat, o_max_lng, max_lng))
+    return pieces
+
+
+def uncovered_regions(region, covered):
+    """
+    Returns the parts of region not covered by any of the regions in covered.
+    """
+    pieces = [region]
+    for other in covered:
+        new_pieces = []
+        for piece in pieces:
+            new_pieces.extend(subtract_region(piece, other))
+        pieces = new_pieces
+    return pieces
+
+
+class EventPageLoader(QtCore.QThread):
+    """
+    Downloads the event index of a number of regions page by page.
+
+    page_loaded is emitted with the list of events of every single page.
+    failed is emitted with an error message if a request failed.
+    """
+    page_loaded = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, base_url, regions, starttime, endtime, min_magnitude,
+            max_magnitude, page_size):
+        QtCore.QThread.__init__(self)
+        self.base_url = base_url
+        self.regions = regions
+        self.starttime = starttime
+        self.endtime = endtime
+        self.min_magnitude = min_magnitude
+        self.max_magnitude = max_magnitude
+        self.page_size = page_size
+        self._aborted = False
+
+    def start(self):
+        _RUNNING_LOADERS.add(self)
+        self.finished.connect(lambda: _RUNNING_LOADERS.discard(self))
+        QtCore.QThread.start(self)
+
+    def abort(self):
+        """
+        Stops the loader after the currently running request.
+        """
+        self._aborted = True
+
+    def run(self):
+        from obspy.seishub import Client
+        client = Client(base_url=self.base_url)
+        for region in self.regions:
+            offset = 0
+            while not self._aborted:
+                try:
+                    events = client.event.getList(limit=self.page_size,
+                        offset=offset, min_datetime=self.starttime,
+                        max_datetime=self.endtime, min_latitude=region[0],
+                        max_latitude=region[1], min_longitude=region[2],
+                        max_longitude=region[3],
+                        min_magnitude=self.min_magnitude,
+                        max_magnitude=self.max_magnitude)
+                except Exception, e:
+                    self.failed.emit("{err_type}({message})".format( \
+                        err_type=e.__class__.__name__, message=str(e)))
+                    return
+                if self._aborted:
+                    return
+                if events:
+                    self.page_loaded.emit(events)
+                # A page that is not full is the last one.
+                if len(events) < self.page_size:
+                    break
+                offset += self.page_size
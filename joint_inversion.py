@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Joint inversion of many spectra for their omega_0 and corner frequencies and
+shared quality factors.
+
+Inverting a single spectrum for Q is very unstable. Fitting all spectra of an
+event, a station or a whole catalog together with one Q per group constrains
+it much better. All spectra are fitted in one sparse least squares problem
+instead of one curve_fit() call per spectrum.
+
+The logarithm of the spectra is fitted, so the model is linear in
+log(omega_0) and 1/Q:
+
+    log(Omega(f)) = log(omega_0) - pi * f * T / Q -
+                    0.5 * log(1 + (f / f_c) ^ 4)
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+
+from spectral_analysis import grid_search_initial_parameters
+
+# Bounds of the inverted quality factors.
+MIN_QUALITY_FACTOR = 10.0
+MAX_QUALITY_FACTOR = 1.0E5
+
+
+def _flatten(spectra, frequencies, traveltimes, q_groups):
+    """
+    Concatenates all spectra. Only positive frequencies and spectral values
+    are used.
+    """
+    values = []
+    freqs = []
+    index = []
+    for _i, (spec, freq) in enumerate(zip(spectra, frequencies)):
+        spec = np.asarray(spec, dtype=np.float64)
+        freq = np.asarray(freq, dtype=np.float64)
+        mask = (spec > 0) & (freq > 0)
+        values.append(np.log(spec[mask]))
+        freqs.append(freq[mask])
+        index.append(np.empty(mask.sum(), dtype=np.int64))
+        index[-1].fill(_i)
+    index = np.concatenate(index)
+    traveltimes = np.asarray(traveltimes, dtype=np.float64)
+    return np.concatenate(values), np.concatenate(freqs), index, \
+        traveltimes[index], np.asarray(q_groups)[index]
+
+
+def joint_q_inversion(spectra, frequencies, traveltimes, q_groups,
+        initial_q=None):
+    """
+    Fits all amplitude spectra at once with one omega_0 and corner frequency
+    per spectrum and one quality factor per group.
+
+    :param spectra: List of amplitude spectra.
+    :param frequencies: List of the corresponding frequencies.
+    :param traveltimes: Traveltime in [s] of every spectrum.
+    :param q_groups: Integer array mapping every spectrum to its quality
+        factor, e.g. all zeros for a single Q or the index of the station.
+    :param initial_q: Initial guess for all quality factors. If None, every
+        spectrum is grid searched for Q and every group starts with the
+        median of its spectra.
+    :returns: (omega_0, corner_frequency, omega_0_var, corner_frequency_var,
+        quality_factors). The first four are arrays with one value per
+        spectrum, quality_factors has one value per group. The variances
+        ignore the trade-off with Q. The values of spectra without any usable
+        samples are NaN.
+    """
+    import scipy.optimize
+    import scipy.sparse
+
+    count = len(spectra)
+    traveltimes = np.asarray(traveltimes, dtype=np.float64)
+    q_groups = np.asarray(q_groups, dtype=np.int64)
+    group_count = q_groups.max() + 1
+    values, freqs, index, tt, groups = _flatten(spectra, frequencies,
+        traveltimes, q_groups)
+    rows = np.arange(len(values))
+
+    # Parameters: log(omega_0) and log(f_c) of every spectrum followed by
+    # 1 / Q of every group.
+    x0 = np.empty(2 * count + group_count)
+    inverse_q = np.empty(count)
+    for _i, (spec, freq) in enumerate(zip(spectra, frequencies)):
+        spec = np.asarray(spec, dtype=np.float64)
+        freq = np.asarray(freq, dtype=np.float64)
+        mask = (spec > 0) & (freq > 0)
+        if not mask.any():
+            x0[_i] = 0.0
+            x0[count + _i] = np.log(10.0)
+            inverse_q[_i] = np.nan
+            continue
+        omega_0, corner_frequency, Q = grid_search_initial_parameters(
+            spec[mask], freq[mask], traveltimes[_i], initial_q)
+        x0[_i] = np.log(omega_0) if omega_0 > 0 else 0.0
+        x0[count + _i] = np.log(corner_frequency)
+        inverse_q[_i] = 1.0 / Q
+    for group in xrange(group_count):
+        group_values = inverse_q[(q_groups == group) &
+            np.isfinite(inverse_q)]
+        x0[2 * count + group] = np.median(group_values) \
+            if len(group_values) else 1.0 / 1000.0
+    lower = np.empty_like(x0)
+    upper = np.empty_like(x0)
+    lower[:2 * count] = -np.inf
+    upper[:2 * count] = np.inf
+    lower[2 * count:] = 1.0 / MAX_QUALITY_FACTOR
+    upper[2 * count:] = 1.0 / MIN_QUALITY_FACTOR
+    x0 = np.clip(x0, lower, upper)
+
+    def ratio(x):
+        return (freqs * np.exp(-x[count + index])) ** 4
+
+    def residuals(x):
+        model = x[index] - np.pi * freqs * tt * x[2 * count + groups] - \
+            0.5 * np.log1p(ratio(x))
+        return values - model
+
+    def jacobian(x):
+        r = ratio(x)
+        data = np.concatenate([-np.ones(len(values)), -2.0 * r / (1.0 + r),
+            np.pi * freqs * tt])
+        columns = np.concatenate([index, count + index, 2 * count + groups])
+        return scipy.sparse.csr_matrix((data, (np.tile(rows, 3), columns)),
+            shape=(len(values), len(x0)))
+
+    result = scipy.optimize.least_squares(residuals, x0, jac=jacobian,
+        bounds=(lower, upper), method="trf", tr_solver="lsmr",
+        x_scale="jac")
+    x = result.x
+
+    # Per spectrum variances from the 2x2 blocks of J^T J, scaled by the
+    # residual variance of every spectrum.
+    r = ratio(x)
+    d_b = 2.0 * r / (1.0 + r)
+    n = np.bincount(index, minlength=count).astype(np.float64)
+    s_ab = np.bincount(index, weights=d_b, minlength=count)
+    s_bb = np.bincount(index, weights=d_b ** 2, minlength=count)
+    sigma_2 = np.bincount(index, weights=result.fun ** 2, minlength=count) / \
+        np.maximum(n - 2.0, 1.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        determinant = n * s_bb - s_ab ** 2
+        var_a = sigma_2 * s_bb / determinant
+        var_b = sigma_2 * n / determinant
+    omega_0 = np.exp(x[:count])
+    corner_frequency = np.exp(x[count:2 * count])
+    # Propagate the variances of the logarithms.
+    omega_0_var = omega_0 ** 2 * var_a
+    corner_frequency_var = corner_frequency ** 2 * var_b
+    empty = n == 0
+    for array in (omega_0, corner_frequency, omega_0_var,
+            corner_frequency_var):
+        array[empty] = np.nan
+    return omega_0, corner_frequency, omega_0_var, corner_frequency_var, \
+        1.0 / x[2 * count:]
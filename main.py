@@ -8,7 +8,14 @@ Launching the Moment Magnitude Calculator.
 :license:
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
+
+Pass --benchmark-startup to measure the time it takes until the main window
+is shown. The application will exit right afterwards.
 """
+# Take the time as early as possible for the startup benchmark.
+import time
+STARTUP_TIME = time.time()
+
 # Compile the .ui files if necessary. Needs to happen first before the compiled
 # .py files are possibly imported by other modules.
 import inspect
@@ -21,7 +28,7 @@ from utils import compile_ui_files
 compile_ui_files(ui_file_directory, current_directory)
 
 
-from PyQt4 import QtGui
+from PyQt4 import QtCore, QtGui
 
 import sys
 
@@ -39,6 +46,14 @@ def main():
     window.show()
     window.raise_()
 
+    if "--benchmark-startup" in sys.argv:
+        # Fires as soon as the event loop has processed all pending events,
+        # e.g. once the window has been drawn.
+        def print_startup_time():
+            print "Startup time: %.3f seconds" % (time.time() - STARTUP_TIME)
+            app.quit()
+        QtCore.QTimer.singleShot(0, print_startup_time)
+
     os._exit(app.exec_())
 
 
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compact, array backed representation of the picks and origins of a catalog.
+
+Walking the obspy.core.event object graph for every single pick is slow and
+memory hungry for large catalogs. The functions in here flatten a Catalog once
+into two NumPy structured arrays (one row per event and one row per pick) so
+the magnitude calculation can run on plain arrays.
+
+All times are stored as int64 nanoseconds since 1970-01-01 and all strings
+(resource ids and SEED ids) are interned, e.g. stored once in a list and
+referenced by their index.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+from obspy.core import UTCDateTime
+
+
+# Integer codes of the phases.
+PHASE_UNKNOWN = 0
+PHASE_P = 1
+PHASE_S = 2
+
+# Marks a missing time, e.g. for events without an origin.
+NO_TIME = np.iinfo(np.int64).min
+
+EVENT_DTYPE = np.dtype([
+    # Index into PickTable.resource_ids.
+    ("resource_id", np.int32),
+    ("origin_time", np.int64),
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    # Depth in whatever unit the origin uses.
+    ("depth", np.float64),
+    # The first magnitude of the event. NaN if not available.
+    ("magnitude", np.float64),
+    # The picks of the event are picks[pick_start:pick_end].
+    ("pick_start", np.int64),
+    ("pick_end", np.int64)])
+
+PICK_DTYPE = np.dtype([
+    # Index into PickTable.events.
+    ("event", np.int32),
+    ("time", np.int64),
+    # Index into PickTable.seed_ids.
+    ("seed_id", np.int32),
+    ("phase", np.int8)])
+
+
+def utcdatetime_to_ns(time):
+    """
+    Converts a UTCDateTime object to integer nanoseconds since the epoch.
+    """
+    # Newer ObsPy versions internally already store nanoseconds.
+    ns = getattr(time, "_ns", None)
+    if ns is not None:
+        return ns
+    return int(round(time.timestamp * 1E9))
+
+
+def ns_to_utcdatetime(ns):
+    """
+    Converts integer nanoseconds since the epoch to a UTCDateTime object.
+    """
+    # Only the fraction of a second goes through a float. A float of the
+    # whole timestamp cannot hold nanoseconds.
+    seconds, ns = divmod(int(ns), 10 ** 9)
+    return UTCDateTime(seconds) + ns / 1E9
+
+
+def phase_code(phase_hint):
+    """
+    Converts a phase hint string to one of the integer phase codes.
+    """
+    if not phase_hint:
+        return PHASE_UNKNOWN
+    phase_hint = phase_hint.lower()
+    if phase_hint == "p":
+        return PHASE_P
+    elif phase_hint == "s":
+        return PHASE_S
+    return PHASE_UNKNOWN
+
+
+class PickTable(object):
+    """
+    Columnar view of a catalog.
+
+    :ivar events: Structured array with EVENT_DTYPE, one row per event in
+        catalog order.
+    :ivar picks: Structured array with PICK_DTYPE, one row per pick. The picks
+        are grouped by event.
+    :ivar resource_ids: List of the event resource ids.
+    :ivar seed_ids: List of all distinct SEED ids of the picks.
+    """
+    def __init__(self, events, picks, resource_ids, seed_ids):
+        self.events = events
+        self.picks = picks
+        self.resource_ids = resource_ids
+        self.seed_ids = seed_ids
+
+    def __len__(self):
+        return len(self.events)
+
+    def event_picks(self, event_index):
+        """
+        Returns the indices of all picks of the given event.
+        """
+        event = self.events[event_index]
+        return np.arange(event["pick_start"], event["pick_end"])
+
+    def traveltimes(self):
+        """
+        Returns the traveltime of every pick in seconds. NaN if the
+        corresponding event has no origin.
+        """
+        origin_times = self.events["origin_time"][self.picks["event"]]
+        # Subtracting the NO_TIME sentinel would overflow.
+        valid = origin_times != NO_TIME
+        traveltimes = np.empty(len(self.picks), dtype=np.float64)
+        traveltimes.fill(np.nan)
+        traveltimes[valid] = (self.picks["time"][valid] -
+            origin_times[valid]) / 1E9
+        return traveltimes
+
+    def pick_time(self, pick_index):
+        """
+        Returns the time of the given pick as a UTCDateTime object.
+        """
+        return ns_to_utcdatetime(self.picks["time"][pick_index])
+
+    def seed_id(self, pick_index):
+        """
+        Returns the SEED id of the given pick.
+        """
+        return self.seed_ids[self.picks["seed_id"][pick_index]]
+
+
+def catalog_to_pick_table(cat):
+    """
+    Flattens an obspy.core.event.Catalog object to a PickTable.
+
+    This is the only place the object graph of the catalog is walked.
+
+    :param cat: obspy.core.event.Catalog object.
+    """
+    event_count = len(cat)
+    pick_count = sum(len(event.picks) for event in cat)
+    events = np.empty(event_count, dtype=EVENT_DTYPE)
+    picks = np.empty(pick_count, dtype=PICK_DTYPE)
+
+    resource_ids = []
+    seed_ids = []
+    # Map every SEED id to its index in seed_ids.
+    seed_id_index = {}
+
+    current_pick = 0
+    for event_index, event in enumerate(cat):
+        row = events[event_index]
+        resource_ids.append(str(event.resource_id))
+        row["resource_id"] = event_index
+        if event.origins:
+            origin = event.origins[0]
+            row["origin_time"] = utcdatetime_to_ns(origin.time)
+            row["latitude"] = _float_or_nan(origin.latitude)
+            row["longitude"] = _float_or_nan(origin.longitude)
+            row["depth"] = _float_or_nan(origin.depth)
+        else:
+            row["origin_time"] = NO_TIME
+            row["latitude"] = row["longitude"] = row["depth"] = np.nan
+        if event.magnitudes:
+            row["magnitude"] = _float_or_nan(event.magnitudes[0].mag)
+        else:
+            row["magnitude"] = np.nan
+        row["pick_start"] = current_pick
+        for pick in event.picks:
+            seed_id = pick.waveform_id.getSEEDString()
+            if seed_id not in seed_id_index:
+                seed_id_index[seed_id] = len(seed_ids)
+                seed_ids.append(seed_id)
+            pick_row = picks[current_pick]
+            pick_row["event"] = event_index
+            pick_row["time"] = utcdatetime_to_ns(pick.time)
+            pick_row["seed_id"] = seed_id_index[seed_id]
+            pick_row["phase"] = phase_code(pick.phase_hint)
+            current_pick += 1
+        row["pick_end"] = current_pick
+    return PickTable(events, picks, resource_ids, seed_ids)
+
+
+def _float_or_nan(value):
+    if value is None:
+        return np.nan
+    return float(value)
@@ -12,6 +12,14 @@ map.
     ...
 - icon_magnitude_9.png
 
+Additionally creates 11 icons for clusters of events. They have the same
+sizes as the magnitude icons and are used for the largest magnitude in the
+cluster. A darker ring distinguishes them from single events.
+
+- icon_cluster_-1.png
+    ...
+- icon_cluster_9.png
+
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
 :license:
@@ -29,11 +37,10 @@ MAX_SIZE = 50
 COLOR = 'red'
 DPI = 100
 
-# Loop 9 times to create 9 icons.
-for i in xrange(-1, 10):
-    # Calculate the size of the current icon.
-    size = MIN_SIZE + (i + 1) * float(MAX_SIZE - MIN_SIZE) / 10.0
+CLUSTER_EDGE_COLOR = 'darkred'
 
+
+def create_icon(filename, size, cluster=False):
     fig = plt.figure(num=None, dpi=DPI,
                           figsize=(size / DPI, size / DPI))
     fig.set_figwidth(size / DPI)
@@ -47,4 +54,17 @@ for i in xrange(-1, 10):
     ax.set_xticks([])
 
     ax.add_patch(circle)
-    fig.savefig("icon_magnitude_%i.png" % i, transparent=True)
+    if cluster:
+        ring = patches.Circle((0.5, 0.5), radius=0.45,
+            edgecolor=CLUSTER_EDGE_COLOR, facecolor="none", linewidth=2)
+        ax.add_patch(ring)
+    fig.savefig(filename, transparent=True)
+    plt.close(fig)
+
+
+# Loop 11 times to create 11 icons of each type.
+for i in xrange(-1, 10):
+    # Calculate the size of the current icon.
+    size = MIN_SIZE + (i + 1) * float(MAX_SIZE - MIN_SIZE) / 10.0
+    create_icon("icon_magnitude_%i.png" % i, size)
+    create_icon("icon_cluster_%i.png" % i, size, cluster=True)
@@ -2,11 +2,23 @@
 // google map. Some function are called from Qt, other JS methods call Qt
 // methods.
 
+// Markers are clustered on a grid whose cells are roughly
+// CLUSTER_CELL_PIXELS wide on screen. Starting at MAX_CLUSTER_ZOOM every event
+// gets its own marker.
+var CLUSTER_CELL_PIXELS = 60;
+var MAX_CLUSTER_ZOOM = 14;
+
 // Upon page load simple display a full screen map.
 var map;
 $(document).ready(function(){
     // Init global array that stores all events.
     window.events = new Array();
+    // Grid index over window.events for every zoom level it has been
+    // requested for. Maps the zoom level to an object mapping cell keys to
+    // arrays of events.
+    window.eventGrids = {};
+    // All markers currently on the map, keyed by event or cluster id.
+    window.visibleMarkers = {};
 
     map = new GMaps({
         div: '#map',
@@ -18,16 +30,22 @@ $(document).ready(function(){
         // Inform the PyQt application that the bounds have changed.
         bounds_changed: function(e) {
            pyObj.set_lat_long_bounds(this.getBounds());
+        },
+        // Only update the markers once panning or zooming is finished.
+        idle: function(e) {
+           updateMarkers();
         }
         });
 })
 
 // Remove all events from the global events array and the map.
 function clearEvents() {
-    // Loop over array and remove all markers from the map.
-    for (var i=0; i < window.events.length; i++) {
-        window.events[i].marker.setMap(null);
+    // Only the visible markers exist on the map.
+    for (var key in window.visibleMarkers) {
+        removeMarker(window.visibleMarkers[key]);
     }
+    window.visibleMarkers = {};
+    window.eventGrids = {};
     // Clear the actual array.
     window.events.length = 0;
 }
@@ -48,12 +66,172 @@ function addEvent(lat, lng, depth, magnitude, magnitude_type, datetime,
         misc_info: misc_info,
         server: server,
     };
-    addMarker(event);
-    window.events.push(event);
+    addEvents([event]);
+};
+
+
+// Add a whole array of events at once. Each event is an object with the same
+// keys as the arguments of addEvent(). Called from Qt with a JSON array which
+// avoids one round trip through WebKit per event.
+function addEvents(events) {
+    for (var i=0; i < events.length; i++) {
+        window.events.push(events[i]);
+    }
+    // The grids are outdated now and will be rebuilt on demand.
+    window.eventGrids = {};
+    updateMarkers();
 };
 
 
-// Add a marker for the given event object to the map.
+// Size of one grid cell in degrees for the given zoom level.
+function getCellSize(zoom) {
+    return CLUSTER_CELL_PIXELS * 360.0 / (256.0 * Math.pow(2, zoom));
+}
+
+
+// Returns the grid index for the given zoom level, building it if necessary.
+function getEventGrid(zoom) {
+    if (window.eventGrids[zoom]) {
+        return window.eventGrids[zoom];
+    }
+    var cell_size = getCellSize(zoom);
+    var grid = {};
+    for (var i=0; i < window.events.length; i++) {
+        var event = window.events[i];
+        var key = Math.floor(event.lat / cell_size) + "_" +
+            Math.floor(event.lng / cell_size);
+        if (!grid[key]) {
+            grid[key] = new Array();
+        }
+        grid[key].push(event);
+    }
+    window.eventGrids[zoom] = grid;
+    return grid;
+}
+
+
+// Creates the markers for all events and clusters inside the current map
+// bounds and removes all others.
+function updateMarkers() {
+    if (!map || !map.map || !map.map.getBounds()) {
+        return;
+    }
+    var zoom = map.getZoom();
+    var bounds = map.map.getBounds();
+    var ne = bounds.getNorthEast();
+    var sw = bounds.getSouthWest();
+    var cell_size = getCellSize(zoom);
+    var grid = getEventGrid(zoom);
+
+    var row_start = Math.floor(sw.lat() / cell_size);
+    var row_end = Math.floor(ne.lat() / cell_size);
+    // Take care of maps spanning the date line.
+    var east = ne.lng();
+    if (east < sw.lng()) {
+        east += 360.0;
+    }
+    var col_start = Math.floor(sw.lng() / cell_size);
+    var col_end = Math.floor(east / cell_size);
+    var cols_per_world = Math.round(360.0 / cell_size);
+
+    var wanted = {};
+    for (var row=row_start; row <= row_end; row++) {
+        for (var col=col_start; col <= col_end; col++) {
+            var wrapped_col = col;
+            if (wrapped_col * cell_size >= 180.0) {
+                wrapped_col -= cols_per_world;
+            }
+            var key = row + "_" + wrapped_col;
+            var cell = grid[key];
+            if (!cell) {
+                continue;
+            }
+            if (cell.length == 1 || zoom >= MAX_CLUSTER_ZOOM) {
+                for (var i=0; i < cell.length; i++) {
+                    if (bounds.contains(new google.maps.LatLng(cell[i].lat,
+                            cell[i].lng))) {
+                        wanted["event_" + cell[i].event_id] = cell[i];
+                    }
+                }
+            }
+            else {
+                wanted["cluster_" + zoom + "_" + key] = cell;
+            }
+        }
+    }
+
+    // Remove all markers no longer needed.
+    for (var id in window.visibleMarkers) {
+        if (!wanted[id]) {
+            removeMarker(window.visibleMarkers[id]);
+            delete window.visibleMarkers[id];
+        }
+    }
+    // And add the missing ones.
+    for (var id in wanted) {
+        if (window.visibleMarkers[id]) {
+            continue;
+        }
+        if (id.indexOf("cluster_") == 0) {
+            window.visibleMarkers[id] = addClusterMarker(wanted[id]);
+        }
+        else {
+            window.visibleMarkers[id] = addMarker(wanted[id]);
+        }
+    }
+}
+
+
+// Removes a single marker from the map.
+function removeMarker(marker) {
+    marker.setMap(null);
+    var index = map.markers.indexOf(marker);
+    if (index != -1) {
+        map.markers.splice(index, 1);
+    }
+}
+
+
+// Clamp and convert magnitude to integer for the icon filenames.
+function magnitudeIconIndex(magnitude) {
+    return Math.floor(Math.min(Math.max(magnitude, -1), 9));
+}
+
+
+// Add a marker representing a number of events to the map. It is placed at
+// the mean location of the events and its size is chosen according to the
+// largest magnitude. Clicking it zooms into the cluster.
+function addClusterMarker(events) {
+    var lat = 0.0;
+    var lng = 0.0;
+    var max_magnitude = -Infinity;
+    for (var i=0; i < events.length; i++) {
+        lat += events[i].lat;
+        lng += events[i].lng;
+        max_magnitude = Math.max(max_magnitude, events[i].magnitude);
+    }
+    lat /= events.length;
+    lng /= events.length;
+    return map.addMarker({
+        lat: lat,
+        lng: lng,
+        title: "{0} events, largest magnitude {1}".format(events.length,
+            max_magnitude),
+        icon: "icon_cluster_{0}.png".format(magnitudeIconIndex(max_magnitude)),
+        label: {
+            text: "" + events.length,
+            fontSize: "10px",
+            fontWeight: "bold"
+        },
+        click: function(e) {
+            map.setCenter(lat, lng);
+            map.setZoom(Math.min(map.getZoom() + 2, MAX_CLUSTER_ZOOM));
+        }
+    });
+}
+
+
+// Add a marker for the given event object to the map and return it.
 function addMarker(event) {
     // Parse the misc_info attribute of the event and create a HTML
     // list off it.
@@ -65,7 +243,7 @@ function addMarker(event) {
     }
 
     // Add a marker to the map.
-    event.marker = map.addMarker({
+    return map.addMarker({
         lat: event.lat,
         lng: event.lng,
         title: event.event_id,
@@ -74,10 +252,9 @@ function addMarker(event) {
         click: function(e) {
             pyObj.event_selected(event.event_id);
         },
-        // Choose iceon. Clamp and convert magnitude to integer for the
-        // filename.
+        // Choose icon.
         icon : "icon_magnitude_{0}.png".format(
-            Math.floor(Math.min(Math.max(event.magnitude, -1), 9))),
+            magnitudeIconIndex(event.magnitude)),
         infoWindow: {
             content: '<div class="infoWindow"> \
                 <h1 id="event_header">{0}</h1> \
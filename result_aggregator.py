@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental aggregation of the accepted spectral fits into the final source
+parameters of an event.
+
+The results are grouped per station and phase. Every group keeps its
+contribution to the seismic moment and the source radius normalized to unit
+density and wave speeds, so accepting or deleting a single result and
+changing the density or the velocities only touches a single group and some
+running sums.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+
+from utils import moment_from_low_freq_amplitude, lat_long_to_distance, \
+    moment_to_moment_magnitude, source_radius_from_corner_frequency, \
+    calculate_stress_drop
+
+
+def station_id_from_channel(channel_id):
+    """
+    "BW.FURT..EHZ" -> "BW.FURT"
+    """
+    return ".".join(channel_id.split(".")[:2])
+
+
+class ResultAggregator(object):
+    """
+    Keeps the final source parameters up to date while results are accepted
+    and deleted.
+
+    :param latitude: Latitude of the origin.
+    :param longitude: Longitude of the origin.
+    :param depth: Depth of the origin in km.
+    :param density: Rock density in [kg/m^3].
+    :param p_wave_speed: P-wave speed in [m/s]. Used for the seismic moment of
+        all phases.
+    :param s_wave_speed: S-wave speed in [m/s]. Used for the source radius.
+    """
+    def __init__(self, latitude, longitude, depth, density, p_wave_speed,
+            s_wave_speed):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.depth = depth
+        self.density = density
+        self.p_wave_speed = p_wave_speed
+        self.s_wave_speed = s_wave_speed
+        # Station id -> coordinates and hypocentral distance in meter.
+        self._coordinates = {}
+        self._distances = {}
+        # (station id, phase) -> group dictionary.
+        self._groups = {}
+        # Running sums over all groups with coordinates.
+        self._moment_sum = 0.0
+        self._radius_sum = 0.0
+        self._group_count = 0
+        self._q_sum = 0.0
+        self._q_count = 0
+
+    def set_station_coordinates(self, station_id, coordinates):
+        """
+        Sets the coordinates of a station. Groups of this station are updated.
+
+        :param coordinates: Object with latitude, longitude and elevation (in
+            meter) attributes.
+        """
+        self._coordinates[station_id] = coordinates
+        self._distances.pop(station_id, None)
+        for phase in ("p", "s"):
+            if (station_id, phase) in self._groups:
+                self._update_group((station_id, phase))
+
+    def add(self, result):
+        """
+        Adds a result dictionary. An existing result for the same channel and
+        phase is replaced.
+        """
+        phase = result["phase"].lower()
+        # The conditional is not strictly necessary but takes care that no
+        # other phases slip in.
+        if phase not in ("p", "s"):
+            return
+        key = (station_id_from_channel(result["channel"]), phase)
+        group = self._groups.setdefault(key, {"results": {},
+            "contribution": None})
+        group["results"][result["channel"]] = result
+        self._update_group(key)
+
+    def remove(self, channel, phase):
+        """
+        Removes the result of the given channel and phase if it exists.
+        """
+        phase = phase.lower()
+        key = (station_id_from_channel(channel), phase)
+        group = self._groups.get(key)
+        if group is None or channel not in group["results"]:
+            return
+        del group["results"][channel]
+        self._update_group(key)
+        if not group["results"]:
+            del self._groups[key]
+
+    def _distance(self, station_id):
+        """
+        Hypocentral distance in meter or None if the station coordinates are
+        unknown.
+        """
+        if station_id not in self._distances:
+            coordinates = self._coordinates.get(station_id)
+            if coordinates is None:
+                return None
+            self._distances[station_id] = lat_long_to_distance( \
+                self.latitude, self.longitude, self.depth,
+                coordinates.latitude, coordinates.longitude,
+                coordinates.elevation / 1000.0) * 1000.0
+        return self._distances[station_id]
+
+    def _update_group(self, key):
+        """
+        Replaces the contribution of a single group to the running sums.
+        """
+        group = self._groups[key]
+        old = group["contribution"]
+        if old is not None:
+            self._moment_sum -= old[0]
+            self._radius_sum -= old[1]
+            self._group_count -= 1
+            self._q_sum -= old[2]
+            self._q_count -= old[3]
+        group["contribution"] = None
+
+        results = group["results"].values()
+        station_id, phase = key
+        if results:
+            distance = self._distance(station_id)
+            if distance is None:
+                print "Warning: No coordinates for the station found."
+            else:
+                # Normalized to unit density and wave speeds.
+                moment = moment_from_low_freq_amplitude( \
+                    [_i["omega_0"] for _i in results], 1.0, 1.0, distance,
+                    phase)
+                radius = source_radius_from_corner_frequency( \
+                    [_i["corner_frequency"] for _i in results], 1.0, phase)
+                q_values = [_i["quality_factor"] for _i in results]
+                group["contribution"] = (moment, radius, sum(q_values),
+                    len(q_values))
+                self._moment_sum += moment
+                self._radius_sum += radius
+                self._group_count += 1
+                self._q_sum += sum(q_values)
+                self._q_count += len(q_values)
+
+        # Avoid accumulating rounding errors once everything is removed.
+        if self._group_count == 0:
+            self._moment_sum = self._radius_sum = self._q_sum = 0.0
+            self._q_count = 0
+
+    def station_estimates(self):
+        """
+        Returns the seismic moments and source radii of all station and phase
+        groups as two arrays, e.g. for bootstrap.bootstrap_source_parameters().
+        """
+        contributions = np.array([_i["contribution"][:2]
+            for _i in self._groups.itervalues()
+            if _i["contribution"] is not None]).reshape(-1, 2)
+        return self.density * self.p_wave_speed ** 3 * contributions[:, 0], \
+            self.s_wave_speed * contributions[:, 1]
+
+    def final_result(self):
+        """
+        Returns the final source parameters as a dictionary or None if no
+        usable results are available.
+        """
+        if self._group_count == 0:
+            return None
+        M_0 = self.density * self.p_wave_speed ** 3 * self._moment_sum / \
+            float(self._group_count)
+        source_radius = self.s_wave_speed * self._radius_sum / \
+            float(self._group_count)
+        return { \
+            "seismic_moment": M_0,
+            "moment_magnitude": moment_to_moment_magnitude(M_0),
+            "source_radius": source_radius,
+            "stress_drop": calculate_stress_drop(M_0, source_radius),
+            "quality_factor": self._q_sum / float(self._q_count),
+            "station_count": self._group_count}
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Columnar storage of the moment magnitude results.
+
+The QuakeML output only carries the results as Magnitude objects with free
+text comments which is slow to write and painful to read back. The
+ResultStore keeps the same information in two NumPy structured arrays, one row
+per event and one row per fitted channel, which can be written to and read from
+NPZ, SQLite or (if pyarrow is installed) Parquet files.
+
+Example::
+
+    store = ResultStore.read("moment_magnitudes.npz")
+    events = store.events[store.events["moment_magnitude"] > 2.0]
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import os
+
+
+# Numeric columns of the per-event table. All values are in SI units.
+EVENT_FIELDS = [
+    ("local_magnitude", np.float64),
+    ("seismic_moment", np.float64),
+    ("seismic_moment_std", np.float64),
+    ("moment_magnitude", np.float64),
+    ("moment_magnitude_std", np.float64),
+    ("corner_frequency", np.float64),
+    ("corner_frequency_std", np.float64),
+    ("source_radius", np.float64),
+    ("source_radius_std", np.float64),
+    ("stress_drop", np.float64),
+    ("stress_drop_std", np.float64),
+    # Bootstrap percentile intervals.
+    ("seismic_moment_lower", np.float64),
+    ("seismic_moment_upper", np.float64),
+    ("moment_magnitude_lower", np.float64),
+    ("moment_magnitude_upper", np.float64),
+    ("source_radius_lower", np.float64),
+    ("source_radius_upper", np.float64),
+    ("stress_drop_lower", np.float64),
+    ("stress_drop_upper", np.float64),
+    ("station_count", np.int32)]
+
+# Numeric columns of the per-channel table. The seismic moment and source
+# radius are the estimates of the whole (three component) pick the channel
+# belongs to.
+PICK_FIELDS = [
+    ("traveltime", np.float64),
+    ("omega_0", np.float64),
+    ("omega_0_var", np.float64),
+    ("corner_frequency", np.float64),
+    ("corner_frequency_var", np.float64),
+    ("quality_factor", np.float64),
+    ("seismic_moment", np.float64),
+    ("source_radius", np.float64)]
+
+# String columns of both tables.
+EVENT_STRING_FIELDS = ["resource_id"]
+PICK_STRING_FIELDS = ["resource_id", "channel", "phase"]
+
+
+def _fill_value(dtype):
+    """
+    The value of missing entries in a column of the given dtype: NaN for
+    floats, -1 for integers and an empty string for strings.
+    """
+    if dtype.kind == "f":
+        return np.nan
+    if dtype.kind == "i":
+        return -1
+    return ""
+
+
+def _create_array(records, string_fields, fields):
+    """
+    Creates a structured array out of a list of dictionaries. The string
+    columns are sized to the longest value.
+    """
+    dtype = []
+    for name in string_fields:
+        length = max([len(_i[name]) for _i in records] + [1])
+        dtype.append((name, "S%i" % length))
+    dtype.extend(fields)
+    array = np.zeros(len(records), dtype=dtype)
+    fill_values = dict((name, _fill_value(array.dtype[name]))
+        for name in array.dtype.names)
+    for _i, record in enumerate(records):
+        for name in array.dtype.names:
+            array[_i][name] = record.get(name, fill_values[name])
+    return array
+
+
+class ResultStore(object):
+    """
+    Per-event and per-channel moment magnitude results.
+
+    :ivar events: Structured array with one row per event.
+    :ivar picks: Structured array with one row per fitted channel.
+    """
+    def __init__(self, events, picks):
+        self.events = events
+        self.picks = picks
+
+    @classmethod
+    def from_records(cls, event_records, pick_records):
+        """
+        Creates a new store from lists of dictionaries. Keys not given will be
+        set to NaN, or -1 for integer columns like station_count.
+        """
+        return cls(
+            _create_array(event_records, EVENT_STRING_FIELDS, EVENT_FIELDS),
+            _create_array(pick_records, PICK_STRING_FIELDS, PICK_FIELDS))
+
+    @classmethod
+    def concatenate(cls, stores):
+        """
+        Combines several stores into one, e.g. the partial results of
+        independent runs.
+        """
+        event_records = []
+        pick_records = []
+        for store in stores:
+            for array, records in ((store.events, event_records),
+                                   (store.picks, pick_records)):
+                records.extend(dict(zip(array.dtype.names, row))
+                    for row in array.tolist())
+        return cls.from_records(event_records, pick_records)
+
+    def __len__(self):
+        return len(self.events)
+
+    def event(self, resource_id):
+        """
+        Returns the row of the given event. Raises a KeyError if the event is
+        not part of the store.
+        """
+        index = np.nonzero(self.events["resource_id"] == resource_id)[0]
+        if not len(index):
+            raise KeyError(resource_id)
+        return self.events[index[0]]
+
+    def picks_of_event(self, resource_id):
+        """
+        Returns all channel rows of the given event.
+        """
+        return self.picks[self.picks["resource_id"] == resource_id]
+
+    def write(self, filename):
+        """
+        Writes the store to a file. The format is determined by the extension:
+        .npz, .sqlite/.db or .parquet.
+        """
+        fmt = _get_format(filename)
+        if fmt == "npz":
+            np.savez(filename, events=self.events, picks=self.picks)
+        elif fmt == "sqlite":
+            _write_sqlite(filename, self)
+        elif fmt == "parquet":
+            _write_parquet(filename, self)
+
+    @classmethod
+    def read(cls, filename):
+        """
+        Reads a store previously written with write().
+        """
+        fmt = _get_format(filename)
+        if fmt == "npz":
+            with np.load(filename) as data:
+                return cls(data["events"], data["picks"])
+        elif fmt == "sqlite":
+            return _read_sqlite(filename)
+        elif fmt == "parquet":
+            return _read_parquet(filename)
+
+
+def _get_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".npz":
+        return "npz"
+    elif extension in (".sqlite", ".db"):
+        return "sqlite"
+    elif extension == ".parquet":
+        return "parquet"
+    msg = "Unknown result store format '%s'." % extension
+    raise ValueError(msg)
+
+
+def _sql_type(dtype):
+    if dtype.kind == "S":
+        return "TEXT"
+    elif dtype.kind == "i":
+        return "INTEGER"
+    return "REAL"
+
+
+def _write_sqlite(filename, store):
+    """
+    Writes one table "events" and one table "picks". An existing file will be
+    overwritten.
+    """
+    import sqlite3
+    if os.path.exists(filename):
+        os.remove(filename)
+    connection = sqlite3.connect(filename)
+    with connection:
+        for table_name, array in (("events", store.events),
+                                  ("picks", store.picks)):
+            columns = ", ".join(["%s %s" % (name, _sql_type(array.dtype[name]))
+                for name in array.dtype.names])
+            connection.execute("CREATE TABLE %s (%s)" % (table_name, columns))
+            connection.executemany("INSERT INTO %s VALUES (%s)" % (
+                table_name, ", ".join("?" * len(array.dtype.names))),
+                array.tolist())
+        connection.execute("CREATE INDEX picks_resource_id ON "
+            "picks (resource_id)")
+    connection.close()
+
+
+def _read_sqlite(filename):
+    import sqlite3
+    connection = sqlite3.connect(filename)
+    # Store strings as bytes to match the other formats.
+    connection.text_factory = str
+    arrays = {}
+    for table_name, string_fields, fields in (
+            ("events", EVENT_STRING_FIELDS, EVENT_FIELDS),
+            ("picks", PICK_STRING_FIELDS, PICK_FIELDS)):
+        names = string_fields + [_i[0] for _i in fields]
+        rows = connection.execute("SELECT %s FROM %s" % (", ".join(names),
+            table_name)).fetchall()
+        # NULL values are treated as missing, i.e. NaN or -1 for integers.
+        records = [dict((key, value) for key, value in zip(names, row)
+            if value is not None) for row in rows]
+        arrays[table_name] = _create_array(records, string_fields, fields)
+    connection.close()
+    return ResultStore(arrays["events"], arrays["picks"])
+
+
+def _write_parquet(filename, store):
+    """
+    Parquet only stores flat tables. The two tables will be written to
+    "basename_events.parquet" and "basename_picks.parquet".
+    """
+    import pyarrow
+    import pyarrow.parquet
+    for table_name, array in (("events", store.events),
+                              ("picks", store.picks)):
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(array[name]) for name in array.dtype.names],
+            names=list(array.dtype.names))
+        pyarrow.parquet.write_table(table, _parquet_filename(filename,
+            table_name))
+
+
+def _read_parquet(filename):
+    import pyarrow.parquet
+    arrays = {}
+    for table_name, string_fields, fields in (
+            ("events", EVENT_STRING_FIELDS, EVENT_FIELDS),
+            ("picks", PICK_STRING_FIELDS, PICK_FIELDS)):
+        table = pyarrow.parquet.read_table(_parquet_filename(filename,
+            table_name)).to_pydict()
+        names = string_fields + [_i[0] for _i in fields]
+        records = [dict(zip(names, row)) for row in
+            zip(*[table[name] for name in names])]
+        arrays[table_name] = _create_array(records, string_fields, fields)
+    return ResultStore(arrays["events"], arrays["picks"])
+
+
+def _parquet_filename(filename, table_name):
+    basename, extension = os.path.splitext(filename)
+    return "%s_%s%s" % (basename, table_name, extension)
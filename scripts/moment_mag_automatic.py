@@ -17,6 +17,33 @@ station information as (dataless)SEED files for every station.
 The script could use some heavy refactoring but its program flow is quite
 linear and it works well enough.
 
+Large catalogs can be split across several machines (or processes) sharing
+the input files. Every shard processes the events whose hashed resource id
+falls into it and writes partial output files. The merge step combines them
+into the same output files a single run would produce:
+
+    for i in 0 1 2 3; do python moment_mag_automatic.py --shard $i/4 & done
+    wait
+    python moment_mag_automatic.py --merge 4
+
+tests/test_sharding.py runs exactly this on a small synthetic data set and
+compares the merged output with a single process run.
+
+With --watch the script keeps running, polls the event, station and waveform
+directories for new or modified files and writes one QuakeML file per event to
+WATCH_OUTPUT_DIRECTORY as soon as enough data is available.
+
+With --serve PORT the script keeps all indices and the recently used
+instrument corrected waveforms in memory and answers requests on a local HTTP
+server with JSON:
+
+    curl "http://127.0.0.1:PORT/magnitude?event=smi:local/event/1"
+    curl --data-binary @event.xml http://127.0.0.1:PORT/magnitude
+
+The first request calculates the magnitudes of the event in the event files,
+the second one those of all events in the posted QuakeML document.
+tests/test_magnitude_service.py runs the service offline on synthetic data.
+
 Requirements:
     * numpy
     * scipy
@@ -24,7 +51,8 @@ Requirements:
     * ObsPy
     * colorama
     * progressbar
-    * mtspec (https://github.com/krischer/mtspec)
+    * mtspec (https://github.com/krischer/mtspec), only for the multitaper
+      spectral estimator
 
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
@@ -32,18 +60,39 @@ Requirements:
     GNU Lesser General Public License, Version 3
     (http://www.gnu.org/copyleft/lesser.html)
 """
+import argparse
+import BaseHTTPServer
 import colorama
 import glob
+import hashlib
+import json
 import matplotlib.pylab as plt
-import mtspec
 import numpy as np
-from obspy import read, Stream
+from obspy import read, Stream, UTCDateTime
 from obspy.core.event import readEvents, Comment, Magnitude, Catalog
-from obspy.xseed import Parser
+import os
 import progressbar
+import re
 import scipy
 import scipy.optimize
-import warnings
+import StringIO
+import sys
+import time
+import urlparse
+
+# The shared modules live in the root directory of the repository.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+from bootstrap import bootstrap_source_parameters, PERCENTILES, \
+    SOURCE_PARAMETERS
+from event_prefetcher import LRUCache
+from joint_inversion import joint_q_inversion
+from pick_table import catalog_to_pick_table, ns_to_utcdatetime, NO_TIME, \
+    PHASE_P, PHASE_S
+from result_store import ResultStore
+from spectral_analysis import PRECISIONS, grid_search_initial_parameters, \
+    log_frequency_bands, power_spectrum, signal_to_noise_band
+from station_index import StationIndex
 
 # Rock density in km/m^3.
 DENSITY = 2700.0
@@ -60,15 +109,72 @@ WATERLEVEL = 10.0
 # on the final seismic moment estimations but has some influence on the corner
 # frequency estimation and therefore on the source radius estimation.
 QUALITY_FACTOR = 1000
+# Instead of using the fixed QUALITY_FACTOR, Q can be inverted for together
+# with Omega_0 and the corner frequencies of all spectra in a single joint
+# inversion. None, "catalog" (one Q for all picks), "event" (one Q per event) or
+# "station" (one Q per station).
+JOINT_Q_INVERSION = None
+# If set, the spectra are averaged in this many logarithmically spaced
+# frequency bands per decade before fitting. Much faster and not dominated by
+# the many samples above the corner frequency.
+FREQUENCY_BANDS_PER_DECADE = None
+# Precision of the instrument corrected waveforms and the spectra. "float32"
+# halves the memory traffic, see benchmarks/precision.py for its accuracy. The
+# spectral fits are always done in float64.
+PRECISION = "float64"
+# The spectral estimator, one of spectral_analysis.SPECTRAL_ESTIMATORS. "hann"
+# and "welch" are much faster than "multitaper" at the cost of a higher
+# variance and shift the magnitudes, see the comment there and
+# benchmarks/spectral_estimators.py. Do not mix them within a catalog.
+SPECTRAL_ESTIMATOR = "multitaper"
+# If set, the spectrum of every component is compared to the spectrum of a
+# noise window of the same length before the P arrival at the station, or
+# before the origin time if there is no P pick. Picks with a
+# component whose amplitude spectrum exceeds the noise by this factor at less
+# than SNR_MIN_FREQUENCY_COUNT consecutive frequencies are not fitted.
+# Otherwise the fits are restricted to that frequency band.
+SNR_THRESHOLD = None
+SNR_MIN_FREQUENCY_COUNT = 10
 
 # Specifiy where to find the files. One large event file contain all events and
 # an arbitrary number of waveform and station information files.
-EVENT_FILES = glob.glob("events/*")
-STATION_FILES = glob.glob("stations/*")
-WAVEFORM_FILES = glob.glob("waveforms/*")
+EVENT_FILE_PATTERN = "events/*"
+STATION_FILE_PATTERN = "stations/*"
+WAVEFORM_FILE_PATTERN = "waveforms/*"
+EVENT_FILES = glob.glob(EVENT_FILE_PATTERN)
+STATION_FILES = glob.glob(STATION_FILE_PATTERN)
+WAVEFORM_FILES = glob.glob(WAVEFORM_FILE_PATTERN)
+# The poles and zeros of all channels in the station files are cached in this
+# directory. Only new or modified station files are parsed again.
+STATION_INDEX_DIRECTORY = "station_index"
 
 # Where to write the output file to.
 OUTPUT_FILE = "events_with_moment_magnitudes.xml"
+# Additionally write all results to a columnar result store. The format is
+# determined by the extension: .npz, .sqlite/.db or .parquet (needs pyarrow).
+RESULT_STORE_FILE = "moment_magnitudes.npz"
+
+# Settings of the continuous mode (--watch). Seconds between two polls of the
+# directories.
+WATCH_POLL_INTERVAL = 5.0
+# Events with less stations are retried every WATCH_RETRY_INTERVAL seconds
+# until WATCH_MAX_WAIT seconds after the event file has been written. Then the
+# result is written with whatever data is available.
+WATCH_MIN_STATION_COUNT = 3
+WATCH_RETRY_INTERVAL = 30.0
+WATCH_MAX_WAIT = 3600.0
+# One QuakeML file per event and a log file with the latency of every event
+# are written to this directory.
+WATCH_OUTPUT_DIRECTORY = "realtime_output"
+
+# Settings of the local magnitude service (--serve). Only listens on the given
+# host. The results of this many requests are cached.
+SERVICE_HOST = "127.0.0.1"
+SERVICE_CACHE_SIZE = 1000
+# Number of instrument corrected three component streams kept in memory across
+# requests. About 200 kB each with the default PADDING and 200 Hz data. The
+# station index and the waveform index are always kept in memory.
+SERVICE_STREAM_CACHE_SIZE = 500
 
 
 def fit_spectrum(spectrum, frequencies, traveltime, initial_omega_0,
@@ -89,6 +195,9 @@ def fit_spectrum(spectrum, frequencies, traveltime, initial_omega_0,
         (Omega_0, f_c, Omega_0_std, f_c_std)
         Returns None, if the fit failed.
     """
+    spectrum = np.asarray(spectrum, dtype=np.float64)
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+
     def f(frequencies, omega_0, f_c):
         return calculate_source_spectrum(frequencies, omega_0, f_c,
                 QUALITY_FACTOR, traveltime)
@@ -129,140 +238,464 @@ def calculate_source_spectrum(frequencies, omega_0, corner_frequency, Q,
 
 
 
-def calculate_moment_magnitudes(cat, output_file):
+def usable_event(table, event_index):
     """
-    :param cat: obspy.core.event.Catalog object.
+    Only events with an origin and a magnitude are processed.
     """
+    event = table.events[event_index]
+    resource_id = table.resource_ids[event["resource_id"]]
+    if event["origin_time"] == NO_TIME:
+        print "No origin for event %s" % resource_id
+        return False
+    if np.isnan(event["magnitude"]):
+        print "No magnitude for event %s" % resource_id
+        return False
+    #if event["magnitude"] < 1.0:
+        #return False
+    return True
 
-    Mws = []
-    Mls = []
-    Mws_std = []
 
-    for event in cat:
-        if not event.origins:
-            print "No origin for event %s" % event.resource_id
-            continue
-        if not event.magnitudes:
-            print "No magnitude for event %s" % event.resource_id
-            continue
-        origin_time = event.origins[0].time
-        local_magnitude = event.magnitudes[0].mag
-        #if local_magnitude < 1.0:
-            #continue
-        moments = []
-        source_radii = []
-        corner_frequencies = []
-        for pick in event.picks:
-            # Only p phase picks.
-            if pick.phase_hint.lower() == "p":
-                radiation_pattern = 0.52
-                velocity = V_P
-                k = 0.32
-            elif pick.phase_hint.lower() == "s":
-                radiation_pattern = 0.63
-                velocity = V_S
-                k = 0.21
-            else:
-                continue
-            distance = (pick.time - origin_time) * velocity
-            if distance <= 0.0:
+def noise_window_end(table, pick_index):
+    """
+    The end of the noise window of a pick. The window of the P pick of the
+    same station and event is noise free, so S picks are not compared to the
+    P coda. Without a P pick, the noise window ends at the origin time.
+    """
+    event_index = table.picks["event"][pick_index]
+    station = table.seed_id(pick_index).split(".")[:2]
+    for _i in table.event_picks(event_index):
+        if table.picks["phase"][_i] == PHASE_P and \
+                table.seed_id(_i).split(".")[:2] == station:
+            return table.pick_time(_i) - TIME_BEFORE_PICK
+    return ns_to_utcdatetime(table.events["origin_time"][event_index])
+
+
+def calculate_pick_spectrum(table, pick_index, traveltime):
+    """
+    Calculates the spectra of all three components of a P or S pick.
+
+    If SNR_THRESHOLD is set, the spectra are restricted to the frequency
+    band with a sufficient signal to noise ratio. Picks without such a band
+    are marked as "gated" and have no channels. "noise_time" is the time
+    spent on the noise spectra.
+
+    :param table: A pick_table.PickTable object.
+    :param pick_index: Index of the pick in the table.
+    :param traveltime: Traveltime of the pick in [s].
+    :returns: A dictionary or None if it is neither a P nor a S pick or has
+        no data.
+    """
+    phase = table.picks["phase"][pick_index]
+    # Only P and S phase picks.
+    if phase == PHASE_P:
+        phase_name = "P"
+    elif phase == PHASE_S:
+        phase_name = "S"
+    else:
+        return None
+    if not traveltime > 0.0:
+        return None
+    pick_time = table.pick_time(pick_index)
+    stream = get_corresponding_stream(table.seed_id(pick_index),
+        pick_time, PADDING)
+    if stream is None or len(stream) != 3:
+        return None
+    if SNR_THRESHOLD:
+        noise_end = noise_window_end(table, pick_index)
+    channels = []
+    gated = False
+    noise_time = 0.0
+    for trace in stream:
+        # Get the index of the pick.
+        sample_index = int(round((pick_time - trace.stats.starttime) / \
+            trace.stats.delta))
+        # Choose date window 0.5 seconds before and 1 second after pick.
+        start = sample_index - \
+            int(TIME_BEFORE_PICK * trace.stats.sampling_rate)
+        end = sample_index + \
+            int(TIME_AFTER_PICK * trace.stats.sampling_rate)
+        data_window = trace.data[start:end]
+        # Calculate the spectrum.
+        spec, freq, _ = power_spectrum(data_window, trace.stats.delta,
+            SPECTRAL_ESTIMATOR)
+        if SNR_THRESHOLD:
+            noise_end_index = int(round((noise_end -
+                trace.stats.starttime) / trace.stats.delta))
+            noise_start_index = noise_end_index - (end - start)
+        # Only possible if the padding covers the noise window.
+        if SNR_THRESHOLD and noise_start_index >= 0 and \
+                noise_end_index <= start:
+            a = time.time()
+            noise_spec, _, _ = power_spectrum(
+                trace.data[noise_start_index:noise_end_index],
+                trace.stats.delta, SPECTRAL_ESTIMATOR)
+            noise_time += time.time() - a
+            band = signal_to_noise_band(spec, noise_spec,
+                SNR_THRESHOLD)
+            if band.stop - band.start < SNR_MIN_FREQUENCY_COUNT:
+                gated = True
+                break
+            spec = spec[band]
+            freq = freq[band]
+        spec = spec.astype(trace.data.dtype, copy=False)
+        if FREQUENCY_BANDS_PER_DECADE:
+            spec, freq, _ = log_frequency_bands(spec, freq,
+                FREQUENCY_BANDS_PER_DECADE)
+        channels.append({
+            "channel": trace.id,
+            "spectrum": spec,
+            "frequencies": freq})
+    return {
+        "phase": phase_name,
+        "traveltime": traveltime,
+        "gated": gated,
+        "noise_time": noise_time,
+        # A gated pick is not fitted at all.
+        "channels": [] if gated else channels}
+
+
+def calculate_pick_spectra(table, event_index, traveltimes):
+    """
+    Calculates the spectra of all picks of an event.
+
+    :param traveltimes: The output of table.traveltimes().
+    :returns: A list of dictionaries, one for every pick with data.
+    """
+    picks = []
+    for _i in table.event_picks(event_index):
+        pick = calculate_pick_spectrum(table, _i, traveltimes[_i])
+        if pick is not None:
+            picks.append(pick)
+    return picks
+
+
+def fit_pick_spectra(picks):
+    """
+    Fits every spectrum on its own with the fixed QUALITY_FACTOR.
+
+    Sets "fit" of every channel to (Omega_0, f_c, Omega_0_var, f_c_var) or
+    None if the fit failed and "quality_factor" to the used Q.
+    """
+    for pick in picks:
+        for channel in pick["channels"]:
+            channel["quality_factor"] = QUALITY_FACTOR
+            spec = channel["spectrum"]
+            try:
+                initial_omega_0, initial_f_c, _ = \
+                    grid_search_initial_parameters(spec,
+                    channel["frequencies"], pick["traveltime"],
+                    QUALITY_FACTOR)
+                fit = fit_spectrum(spec, channel["frequencies"],
+                    pick["traveltime"], initial_omega_0, initial_f_c)
+            except:
+                fit = None
+            if fit is None:
+                channel["fit"] = None
                 continue
-            stream = get_corresponding_stream(pick.waveform_id, pick.time,
-                                              PADDING)
-            if stream is None or len(stream) != 3:
+            Omega_0, f_c, err, f_c_err = fit
+            # The fit is done on the power spectrum. Propagate the variance
+            # to the amplitude.
+            channel["fit"] = (np.sqrt(Omega_0), f_c,
+                err / (4.0 * Omega_0), f_c_err)
+
+
+def fit_pick_spectra_jointly(picks):
+    """
+    Fits all spectra of the given picks in a single joint inversion with one
+    shared quality factor.
+
+    Sets the same keys as fit_pick_spectra(). Unlike the single fits, the
+    amplitude spectra are fitted.
+    """
+    channels = []
+    traveltimes = []
+    for pick in picks:
+        for channel in pick["channels"]:
+            channels.append(channel)
+            traveltimes.append(pick["traveltime"])
+    if not channels:
+        return
+    omega_0, f_c, omega_0_var, f_c_var, quality_factors = joint_q_inversion(
+        [np.sqrt(_i["spectrum"]) for _i in channels],
+        [_i["frequencies"] for _i in channels], traveltimes,
+        np.zeros(len(channels), dtype=np.int64))
+    for _i, channel in enumerate(channels):
+        channel["quality_factor"] = quality_factors[0]
+        if np.isnan(omega_0[_i]):
+            channel["fit"] = None
+            continue
+        channel["fit"] = (omega_0[_i], f_c[_i], omega_0_var[_i], f_c_var[_i])
+
+
+def joint_inversion_group(table, event_index, pick_index, mode):
+    """
+    The key of the quality factor group of a pick for the joint inversion:
+    one Q for the whole catalog, per event or per station.
+    """
+    if mode == "catalog":
+        return ""
+    elif mode == "event":
+        return event_index
+    elif mode == "station":
+        return ".".join(table.seed_id(pick_index).split(".")[:2])
+    msg = "Unknown joint Q inversion mode '%s'." % mode
+    raise ValueError(msg)
+
+
+def discard_spectra(picks):
+    """
+    Frees the spectra of fitted picks. Only the fits are needed afterwards.
+    """
+    for pick in picks:
+        for channel in pick["channels"]:
+            del channel["spectrum"]
+            del channel["frequencies"]
+
+
+def calculate_event_result(table, event_index, picks):
+    """
+    Combines the fitted picks of an event to its source parameters.
+
+    :returns: A dictionary or None if no moment could be calculated.
+    """
+    event = table.events[event_index]
+    resource_id = table.resource_ids[event["resource_id"]]
+    local_magnitude = event["magnitude"]
+    moments = []
+    source_radii = []
+    corner_frequencies = []
+    pick_results = []
+    for pick in picks:
+        if pick["phase"] == "P":
+            radiation_pattern = 0.52
+            velocity = V_P
+            k = 0.32
+        else:
+            radiation_pattern = 0.63
+            velocity = V_S
+            k = 0.21
+        distance = pick["traveltime"] * velocity
+        omegas = []
+        corner_freqs = []
+        channels = []
+        for channel in pick["channels"]:
+            if channel["fit"] is None:
                 continue
-            omegas = []
-            corner_freqs = []
-            for trace in stream:
-                # Get the index of the pick.
-                pick_index = int(round((pick.time - trace.stats.starttime) / \
-                    trace.stats.delta))
-                # Choose date window 0.5 seconds before and 1 second after pick.
-                data_window = trace.data[pick_index - \
-                    int(TIME_BEFORE_PICK * trace.stats.sampling_rate): \
-                    pick_index + int(TIME_AFTER_PICK * trace.stats.sampling_rate)]
-                # Calculate the spectrum.
-                spec, freq = mtspec.mtspec(data_window, trace.stats.delta, 2)
-                try:
-                    fit = fit_spectrum(spec, freq, pick.time - origin_time,
-                            spec.max(), 10.0)
-                except:
-                    continue
-                if fit is None:
-                    continue
-                Omega_0, f_c, err, _ = fit
-                Omega_0 = np.sqrt(Omega_0)
-                omegas.append(Omega_0)
-                corner_freqs.append(f_c)
-            M_0 = 4.0 * np.pi * DENSITY * velocity ** 3 * distance * \
-                np.sqrt(omegas[0] ** 2 + omegas[1] ** 2 + omegas[2] ** 2) / \
-                radiation_pattern
-            r = 3 * k * V_S / sum(corner_freqs)
-            moments.append(M_0)
-            source_radii.append(r)
-            corner_frequencies.extend(corner_freqs)
-        if not len(moments):
-            print "No moments could be calculated for event %s" % \
-                event.resource_id.resource_id
+            Omega_0, f_c, Omega_0_err, f_c_err = channel["fit"]
+            omegas.append(Omega_0)
+            corner_freqs.append(f_c)
+            channels.append({
+                "resource_id": resource_id,
+                "channel": channel["channel"],
+                "phase": pick["phase"],
+                "traveltime": pick["traveltime"],
+                "omega_0": Omega_0,
+                "omega_0_var": Omega_0_err,
+                "corner_frequency": f_c,
+                "corner_frequency_var": f_c_err,
+                "quality_factor": channel["quality_factor"]})
+        # All three components are needed.
+        if len(omegas) != 3:
             continue
+        M_0 = 4.0 * np.pi * DENSITY * velocity ** 3 * distance * \
+            np.sqrt(omegas[0] ** 2 + omegas[1] ** 2 + omegas[2] ** 2) / \
+            radiation_pattern
+        r = 3 * k * V_S / sum(corner_freqs)
+        moments.append(M_0)
+        source_radii.append(r)
+        corner_frequencies.extend(corner_freqs)
+        for channel in channels:
+            channel["seismic_moment"] = M_0
+            channel["source_radius"] = r
+        pick_results.extend(channels)
+    if not len(moments):
+        print "No moments could be calculated for event %s" % \
+            resource_id
+        return None
+
+    # Calculate the seismic moment via basic statistics.
+    moments = np.array(moments)
+    moment = moments.mean()
+    moment_std = moments.std()
+
+    corner_frequencies = np.array(corner_frequencies)
+    corner_frequency = corner_frequencies.mean()
+    corner_frequency_std = corner_frequencies.std()
+
+    # Calculate the source radius.
+    source_radii = np.array(source_radii)
+    source_radius = source_radii.mean()
+    source_radius_std = source_radii.std()
+
+    # Calculate the stress drop of the event based on the average moment and
+    # source radii.
+    stress_drop = (7 * moment) / (16 * source_radius ** 3)
+    stress_drop_std = np.sqrt((stress_drop ** 2) * \
+        (((moment_std ** 2) / (moment ** 2)) + \
+        (9 * (source_radius_std ** 2) / (source_radius ** 2))))
+    if source_radius > 0 and source_radius_std < source_radius:
+        print "Source radius:", source_radius, " Std:", source_radius_std
+        print "Stress drop:", stress_drop / 1E5, " Std:", stress_drop_std / 1E5
+
+    Mw = 2.0 / 3.0 * (np.log10(moment) - 9.1)
+    Mw_std = 2.0 / 3.0 * moment_std / (moment * np.log(10))
+    # Additionally bootstrap the stations for percentile intervals. A single
+    # station has no meaningful interval. Seeded with the resource id so the
+    # intervals do not depend on the sharding or the order of the events.
+    if len(moments) > 1:
+        intervals = bootstrap_source_parameters(moments, source_radii,
+            seed=int(hashlib.md5(resource_id).hexdigest()[:8], 16))
+    else:
+        intervals = dict((name, (np.nan, np.nan, np.nan))
+            for name in SOURCE_PARAMETERS)
+    calc_diff = abs(Mw - local_magnitude)
+    Mw_str = ("%.3f" % Mw).rjust(7)
+    Ml_str = ("%.3f" % local_magnitude).rjust(7)
+    diff = ("%.3e" % calc_diff).rjust(7)
+
+    ret_string = colorama.Fore.GREEN + \
+        "For event %s: Ml=%s | Mw=%s | " % (resource_id, Ml_str, Mw_str)
+    if calc_diff >= 1.0:
+        ret_string += colorama.Fore.RED
+    ret_string += "Diff=%s" % diff
+    ret_string += colorama.Fore.GREEN
+    ret_string += " | Determined at %i stations" % len(moments)
+    ret_string += colorama.Style.RESET_ALL
+    print ret_string
+
+    result = {
+        "event_index": event_index,
+        "resource_id": resource_id,
+        "local_magnitude": local_magnitude,
+        "moment_magnitude": Mw,
+        "moment_magnitude_std": Mw_std,
+        "seismic_moment": moment,
+        "seismic_moment_std": moment_std,
+        "corner_frequency": corner_frequency,
+        "corner_frequency_std": corner_frequency_std,
+        "source_radius": source_radius,
+        "source_radius_std": source_radius_std,
+        "stress_drop": stress_drop,
+        "stress_drop_std": stress_drop_std,
+        "station_count": len(moments),
+        "picks": pick_results}
+    for name, (_, lower, upper) in intervals.iteritems():
+        result[name + "_lower"] = lower
+        result[name + "_upper"] = upper
+    return result
+
+
+def calculate_moment_magnitudes(table):
+    """
+    Calculates the moment magnitudes of all events in the given pick table.
+
+    Runs entirely on the columnar pick table; the event object graph is not
+    touched. With a fixed quality factor the spectra of every event are
+    fitted and discarded before the next event is processed. The joint
+    inversion keeps the spectra of a single quality factor group in memory.
+
+    :param table: A pick_table.PickTable object.
+    :returns: A list of dictionaries, one for every event for which a moment
+        magnitude could be calculated.
+    """
+    traveltimes = table.traveltimes()
+    event_indices = [_i for _i in xrange(len(table.events))
+        if usable_event(table, _i)]
+    # The gate of every pick.
+    gates = []
+    fit_time = 0.0
+    noise_time = 0.0
+
+    if JOINT_Q_INVERSION is None:
+        results = []
+        for event_index in event_indices:
+            picks = calculate_pick_spectra(table, event_index, traveltimes)
+            gates.extend(_i["gated"] for _i in picks)
+            noise_time += sum(_i["noise_time"] for _i in picks)
+            a = time.time()
+            fit_pick_spectra(picks)
+            fit_time += time.time() - a
+            result = calculate_event_result(table, event_index, picks)
+            if result is not None:
+                results.append(result)
+    else:
+        # Fitted picks of every event.
+        event_picks = {}
+        groups = {}
+        for event_index in event_indices:
+            event_picks[event_index] = []
+            for _i in table.event_picks(event_index):
+                groups.setdefault(joint_inversion_group(table, event_index,
+                    _i, JOINT_Q_INVERSION), []).append((event_index, _i))
+        for key in sorted(groups.keys()):
+            picks = []
+            for event_index, _i in groups[key]:
+                pick = calculate_pick_spectrum(table, _i, traveltimes[_i])
+                if pick is None:
+                    continue
+                picks.append(pick)
+                event_picks[event_index].append(pick)
+            gates.extend(_i["gated"] for _i in picks)
+            noise_time += sum(_i["noise_time"] for _i in picks)
+            a = time.time()
+            fit_pick_spectra_jointly(picks)
+            fit_time += time.time() - a
+            discard_spectra(picks)
+        results = [calculate_event_result(table, _i, event_picks[_i])
+            for _i in event_indices]
+        results = [_i for _i in results if _i is not None]
+
+    if SNR_THRESHOLD:
+        gate = np.array(gates, dtype=bool)
+        # Estimate the time saved by assuming the gated picks would have
+        # taken as long to fit as the others.
+        saved_time = fit_time / max((~gate).sum(), 1) * gate.sum()
+        print "%i of %i picks below the SNR threshold of %.1f were not " \
+            "fitted, saving about %.2f seconds. The noise spectra of all " \
+            "picks took %.2f seconds." % (gate.sum(), len(gate),
+            SNR_THRESHOLD, saved_time, noise_time)
+    return results
+
+
+def create_result_store(results):
+    """
+    Converts the output of calculate_moment_magnitudes() to a ResultStore.
+    """
+    return ResultStore.from_records(results,
+        [_i for result in results for _i in result["picks"]])
 
-        # Calculate the seismic moment via basic statistics.
-        moments = np.array(moments)
-        moment = moments.mean()
-        moment_std = moments.std()
-
-        corner_frequencies = np.array(corner_frequencies)
-        corner_frequency = corner_frequencies.mean()
-        corner_frequency_std = corner_frequencies.std()
-
-        # Calculate the source radius.
-        source_radii = np.array(source_radii)
-        source_radius = source_radii.mean()
-        source_radius_std = source_radii.std()
-
-        # Calculate the stress drop of the event based on the average moment and
-        # source radii.
-        stress_drop = (7 * moment) / (16 * source_radius ** 3)
-        stress_drop_std = np.sqrt((stress_drop ** 2) * \
-            (((moment_std ** 2) / (moment ** 2)) + \
-            (9 * source_radius * source_radius_std ** 2)))
-        if source_radius > 0 and source_radius_std < source_radius:
-            print "Source radius:", source_radius, " Std:", source_radius_std
-            print "Stress drop:", stress_drop / 1E5, " Std:", stress_drop_std / 1E5
-
-        Mw = 2.0 / 3.0 * (np.log10(moment) - 9.1)
-        Mw_std = 2.0 / 3.0 * moment_std / (moment * np.log(10))
-        Mws_std.append(Mw_std)
-        Mws.append(Mw)
-        Mls.append(local_magnitude)
-        calc_diff = abs(Mw - local_magnitude)
-        Mw = ("%.3f" % Mw).rjust(7)
-        Ml = ("%.3f" % local_magnitude).rjust(7)
-        diff = ("%.3e" % calc_diff).rjust(7)
-
-        ret_string = colorama.Fore.GREEN + \
-            "For event %s: Ml=%s | Mw=%s | " % (event.resource_id.resource_id,
-            Ml, Mw)
-        if calc_diff >= 1.0:
-            ret_string += colorama.Fore.RED
-        ret_string += "Diff=%s" % diff
-        ret_string += colorama.Fore.GREEN
-        ret_string += " | Determined at %i stations" % len(moments)
-        ret_string += colorama.Style.RESET_ALL
-        print ret_string
+
+def add_magnitudes_to_catalog(cat, results):
+    """
+    Appends one Magnitude object per result to the corresponding event.
+
+    :param cat: obspy.core.event.Catalog object the pick table of the results
+        has been created from. Will be edited in-place.
+    :param results: The output of calculate_moment_magnitudes().
+    """
+    for result in results:
+        event = cat[result["event_index"]]
+        source_radius = result["source_radius"]
+        source_radius_std = result["source_radius_std"]
 
         mag = Magnitude()
-        mag.mag = Mw
-        mag.mag_errors.uncertainty = Mw_std
+        mag.mag = result["moment_magnitude"]
+        mag.mag_errors.uncertainty = result["moment_magnitude_std"]
+        if np.isfinite(result["moment_magnitude_lower"]):
+            mag.mag_errors.lower_uncertainty = result["moment_magnitude"] - \
+                result["moment_magnitude_lower"]
+            mag.mag_errors.upper_uncertainty = \
+                result["moment_magnitude_upper"] - result["moment_magnitude"]
+            mag.mag_errors.confidence_level = PERCENTILES[1] - PERCENTILES[0]
         mag.magnitude_type = "Mw"
         mag.origin_id = event.origins[0].resource_id
         mag.method_id = "smi:com.github/krischer/moment_magnitude_calculator/automatic/1"
-        mag.station_count = len(moments)
+        mag.station_count = result["station_count"]
         mag.evaluation_mode = "automatic"
         mag.evaluation_status = "preliminary"
         mag.comments.append(Comment( \
-            "Seismic Moment=%e Nm; standard deviation=%e" % (moment,
-            moment_std)))
+            "Seismic Moment=%e Nm; standard deviation=%e" % (
+            result["seismic_moment"], result["seismic_moment_std"])))
         mag.comments.append(Comment("Custom fit to Boatwright spectrum"))
         if source_radius > 0 and source_radius_std < source_radius:
             mag.comments.append(Comment( \
@@ -270,9 +703,6 @@ def calculate_moment_magnitudes(cat, output_file):
                 source_radius_std)))
         event.magnitudes.append(mag)
 
-    print "Writing output file..."
-    cat.write(output_file, format="quakeml")
-
 
 def fit_moment_magnitude_relation_curve(Mls, Mws, Mw_stds):
     """
@@ -291,38 +721,13 @@ def fit_moment_magnitude_relation_curve(Mls, Mws, Mw_stds):
     return popt[0], popt[1], popt[2]
 
 
-def plot_ml_vs_mw(catalog):
-    moment_magnitudes = []
-    moment_magnitudes_std = []
-    local_magnitudes = []
-    local_magnitudes_std = []
-    for event in catalog:
-        Mw = None
-        Mw_std = None
-        Ml = None
-        Ml_std = None
-        for mag in event.magnitudes:
-            if Mw is not None and Ml is not None:
-                break
-            mag_type = mag.magnitude_type.lower()
-            if mag_type == "mw":
-                if Mw is not None:
-                    continue
-                Mw = mag.mag
-                Mw_std = mag.mag_errors.uncertainty
-            elif mag_type == "ml":
-                if Ml is not None:
-                    continue
-                Ml = mag.mag
-                Ml_std = mag.mag_errors.uncertainty
-        moment_magnitudes.append(Mw)
-        moment_magnitudes_std.append(Mw_std)
-        local_magnitudes.append(Ml)
-        local_magnitudes_std.append(Ml_std)
-    moment_magnitudes = np.array(moment_magnitudes, dtype="float64")
-    moment_magnitudes_std = np.array(moment_magnitudes_std, dtype="float64")
-    local_magnitudes = np.array(local_magnitudes, dtype="float64")
-    local_magnitudes_std = np.array(local_magnitudes_std, dtype="float64")
+def plot_ml_vs_mw(store):
+    """
+    :param store: result_store.ResultStore object.
+    """
+    moment_magnitudes = store.events["moment_magnitude"]
+    moment_magnitudes_std = store.events["moment_magnitude_std"]
+    local_magnitudes = store.events["local_magnitude"]
 
     # Fit a curve through the data.
     a, b, c = fit_moment_magnitude_relation_curve(local_magnitudes,
@@ -357,77 +762,55 @@ def plot_ml_vs_mw(catalog):
     plt.legend(loc="lower right")
     plt.savefig("moment_mag_automatic.pdf")
 
-def plot_source_radius(cat):
-    mw = []
-    mw_std = []
-    source_radius = []
-    source_radius_std = []
-
+def plot_source_radius(store):
+    """
+    :param store: result_store.ResultStore object.
+    """
     plt.figure(figsize=(10, 4.5))
 
-    # Read the source radius.
-    for event in cat:
-        mag = event.magnitudes[1]
-        if len(mag.comments) != 2:
-            continue
-        mw.append(mag.mag)
-        mw_std.append(mag.mag_errors.uncertainty)
-        sr, std = mag.comments[1].text.split(";")
-        _, sr = sr.split("=")
-        _, std = std.split("=")
-        sr = float(sr[:-1])
-        std = float(std)
-        source_radius.append(sr)
-        source_radius_std.append(std)
-    plt.errorbar(mw, source_radius, yerr=source_radius_std,
-        fmt="o", linestyle="None")
+    # Only use the events with a meaningful source radius.
+    events = store.events
+    events = events[(events["source_radius"] > 0) & \
+        (events["source_radius_std"] < events["source_radius"])]
+    plt.errorbar(events["moment_magnitude"], events["source_radius"],
+        yerr=events["source_radius_std"], fmt="o", linestyle="None")
     plt.xlabel("Mw", fontsize="x-large")
     plt.ylabel("Source Radius [m]", fontsize="x-large")
     plt.grid()
-    plt.savefig("/Users/lion/Desktop/SourceRadius.pdf")
+    plt.savefig("source_radius.pdf")
 
 
-if __name__ == "__main__":
-    # Read all instrument responses.
-    widgets = ['Parsing instrument responses...', progressbar.Percentage(),
-        ' ', progressbar.Bar()]
-    pbar = progressbar.ProgressBar(widgets=widgets,
-        maxval=len(STATION_FILES)).start()
-    parsers = {}
-    # Read all waveform files.
-    for _i, xseed in enumerate(STATION_FILES):
-        pbar.update(_i)
-        parser = Parser(xseed)
-        channels = [c['channel_id'] for c in parser.getInventory()['channels']]
-        parsers_ = dict.fromkeys(channels, parser)
-        if any([k in parsers for k in parsers_.keys()]):
-            msg = "Channel(s) defined in more than one metadata file."
-            warnings.warn(msg)
-        parsers.update(parsers_)
-    pbar.finish()
+def index_waveform_file(filename, waveform_index, replace=False):
+    """
+    Adds the traces of a waveform file to the waveform index.
+
+    :param replace: Remove the entries of a previous version of the file.
+    """
+    if replace:
+        for entries in waveform_index.itervalues():
+            entries[:] = [_i for _i in entries if _i["filename"] != filename]
+    st = read(filename)
+    for trace in st:
+        if not trace.id in waveform_index:
+            waveform_index[trace.id] = []
+        waveform_index[trace.id].append( \
+            {"filename": filename,
+             "starttime": trace.stats.starttime,
+             "endtime": trace.stats.endtime})
 
-    # Parse all waveform files.
-    widgets = ['Indexing waveform files...     ', progressbar.Percentage(),
-        ' ', progressbar.Bar()]
-    pbar = progressbar.ProgressBar(widgets=widgets,
-        maxval=len(WAVEFORM_FILES)).start()
-    waveform_index = {}
-    # Read all waveform files.
-    for _i, waveform in enumerate(WAVEFORM_FILES):
-        pbar.update(_i)
-        st = read(waveform)
-        for trace in st:
-            if not trace.id in waveform_index:
-                waveform_index[trace.id] = []
-            waveform_index[trace.id].append( \
-                {"filename": waveform,
-                 "starttime": trace.stats.starttime,
-                 "endtime": trace.stats.endtime})
-    pbar.finish()
 
-    # Define it inplace to create a closure for the waveform_index dictionary
-    # because I am too lazy to fix the global variable issue right now...
-    def get_corresponding_stream(waveform_id, pick_time, padding=1.0):
+def create_stream_getter(station_index, waveform_index, cache=None):
+    """
+    Returns the get_corresponding_stream() function used by
+    calculate_pick_spectrum() for the given indices.
+
+    :param station_index: station_index.StationIndex object.
+    :param waveform_index: Dictionary created by index_waveform_file().
+    :param cache: Optional LRUCache keeping the instrument corrected streams,
+        e.g. across the requests of the service mode. Cached streams are
+        shared and must not be modified.
+    """
+    def get_corresponding_stream(seed_id, pick_time, padding=1.0):
         """
         Helper function to find a requested waveform in the previously created
         waveform_index file.
@@ -435,7 +818,12 @@ if __name__ == "__main__":
 
         Returns None if the file could not be found.
         """
-        trace_ids = [waveform_id.getSEEDString()[:-1] + comp for comp in "ZNE"]
+        key = (seed_id, str(pick_time), padding)
+        if cache is not None:
+            st = cache.get(key)
+            if st is not None:
+                return st
+        trace_ids = [seed_id[:-1] + comp for comp in "ZNE"]
         st = Stream()
         start = pick_time - padding
         end = pick_time + padding
@@ -447,20 +835,445 @@ if __name__ == "__main__":
                     continue
                 st += read(waveform["filename"]).select(id=trace_id)
         for trace in st:
-            paz = parsers[trace.id].getPAZ(trace.id, start)
+            paz = station_index.get_paz(trace.id, start)
             # PAZ in SEED correct to m/s. Add a zero to correct to m.
             paz["zeros"].append(0 + 0j)
+            trace.data = trace.data.astype(PRECISIONS[PRECISION])
             trace.detrend()
             trace.simulate(paz_remove=paz, water_level=WATERLEVEL)
+            trace.data = trace.data.astype(PRECISIONS[PRECISION], copy=False)
+        if cache is not None:
+            cache.put(key, st)
         return st
+    return get_corresponding_stream
+
+
+def modified_files(pattern, known_files):
+    """
+    Returns all files matching pattern that are new or have been modified
+    and all files that have been deleted since the last call.
+
+    :param known_files: Dictionary mapping filenames to their modification
+        time. Will be updated.
+    :returns: (modified, deleted)
+    """
+    modified = []
+    existing = set()
+    for filename in sorted(glob.glob(pattern)):
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            continue
+        existing.add(filename)
+        if known_files.get(filename) != mtime:
+            known_files[filename] = mtime
+            modified.append(filename)
+    deleted = sorted(set(known_files.keys()) - existing)
+    for filename in deleted:
+        del known_files[filename]
+    return modified, deleted
+
+
+def realtime_output_filename(event):
+    return os.path.join(WATCH_OUTPUT_DIRECTORY,
+        re.sub(r"[^\w.-]", "_", str(event.resource_id)) + ".xml")
+
+
+def process_realtime_event(entry, final):
+    """
+    Calculates the moment magnitude of a single queued event and writes it.
+
+    Returns False if the event should be retried later. final forces writing
+    the result even if less than WATCH_MIN_STATION_COUNT stations are
+    available.
+    """
+    event = entry["event"]
+    cat = Catalog()
+    cat.events.append(event)
+    try:
+        results = calculate_moment_magnitudes(catalog_to_pick_table(cat))
+    except Exception, e:
+        print "Problem while processing event %s: %s(%s)" % ( \
+            event.resource_id, e.__class__.__name__, str(e))
+        results = []
+    station_count = results[0]["station_count"] if results else 0
+    if station_count < WATCH_MIN_STATION_COUNT and not final:
+        print "Only %i stations for event %s so far. Will retry." % ( \
+            station_count, event.resource_id)
+        return False
+    if not results:
+        print "Giving up on event %s." % event.resource_id
+        return True
+    add_magnitudes_to_catalog(cat, results)
+    cat.write(realtime_output_filename(event), format="quakeml")
+    latency = time.time() - entry["arrival"]
+    with open(os.path.join(WATCH_OUTPUT_DIRECTORY, "latency.log"), "a") as \
+            open_file:
+        open_file.write("%s %s Mw=%.3f stations=%i attempts=%i "
+            "latency=%.1fs\n" % (UTCDateTime(), event.resource_id,
+            results[0]["moment_magnitude"], station_count, entry["attempts"],
+            latency))
+    print "Wrote event %s after %.1f seconds." % (event.resource_id, latency)
+    return True
+
+
+def watch(station_index, waveform_index):
+    """
+    Continuously processes new and modified event files. The station and
+    waveform indices are kept up to date and in memory.
+
+    The latency of an event is measured from the modification time of its
+    event file to writing its QuakeML file. Events whose output file is newer
+    than their event file are not processed again, e.g. after a restart.
+    """
+    if not os.path.exists(WATCH_OUTPUT_DIRECTORY):
+        os.makedirs(WATCH_OUTPUT_DIRECTORY)
+    known_events = {}
+    # The files indexed at startup. Files added since then will be detected
+    # as new.
+    known_stations = {}
+    known_waveforms = {}
+    for filenames, known_files in ((STATION_FILES, known_stations),
+                                   (WAVEFORM_FILES, known_waveforms)):
+        for filename in filenames:
+            if os.path.exists(filename):
+                known_files[filename] = os.path.getmtime(filename)
+    # Resource id -> queued event.
+    pending = {}
+    # Set if the last update of the station index failed.
+    stations_outdated = False
+    print "Watching for new events..."
+    while True:
+        poll_start = time.time()
+        modified, deleted = modified_files(STATION_FILE_PATTERN,
+            known_stations)
+        if modified or deleted or stations_outdated:
+            try:
+                station_index.update(sorted(known_stations.keys()))
+                stations_outdated = False
+            except Exception, e:
+                # Possibly not completely written yet or deleted in the
+                # meantime. Try again next time.
+                print "Problem while updating the station index: %s(%s)" % \
+                    (e.__class__.__name__, str(e))
+                for filename in modified:
+                    known_stations.pop(filename, None)
+                stations_outdated = True
+        modified, deleted = modified_files(WAVEFORM_FILE_PATTERN,
+            known_waveforms)
+        for filename in deleted:
+            for entries in waveform_index.itervalues():
+                entries[:] = [_i for _i in entries
+                    if _i["filename"] != filename]
+        for filename in modified:
+            try:
+                index_waveform_file(filename, waveform_index, replace=True)
+            except Exception:
+                # Possibly not completely written yet. Try again next time.
+                del known_waveforms[filename]
+        for filename in modified_files(EVENT_FILE_PATTERN, known_events)[0]:
+            arrival = known_events[filename]
+            try:
+                events = readEvents(filename)
+            except Exception:
+                del known_events[filename]
+                continue
+            for event in events:
+                output = realtime_output_filename(event)
+                if os.path.exists(output) and \
+                        os.path.getmtime(output) >= arrival:
+                    continue
+                pending[str(event.resource_id)] = {
+                    "event": event,
+                    "arrival": arrival,
+                    "attempts": 0,
+                    "next_attempt": 0.0}
+
+        for resource_id, entry in sorted(pending.items()):
+            now = time.time()
+            if entry["next_attempt"] > now:
+                continue
+            entry["attempts"] += 1
+            final = now - entry["arrival"] >= WATCH_MAX_WAIT
+            if process_realtime_event(entry, final):
+                del pending[resource_id]
+            else:
+                entry["next_attempt"] = now + WATCH_RETRY_INTERVAL
+        time.sleep(max(0.0, WATCH_POLL_INTERVAL - (time.time() - poll_start)))
+
+
+def json_compatible(value):
+    """
+    Converts NumPy scalars to Python types and NaN and infinite values, which
+    are not valid JSON, to None.
+    """
+    if isinstance(value, dict):
+        return dict((k, json_compatible(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [json_compatible(_i) for _i in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+class MagnitudeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    GET /magnitude?event=<resource id> calculates the magnitude of an event
+    of the EVENT_FILES. POST /magnitude calculates the magnitudes of all
+    events in the QuakeML document sent as the body.
+    """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != "/magnitude":
+            self._send(404, {"error": "Unknown path %s." % url.path})
+            return
+        resource_ids = urlparse.parse_qs(url.query).get("event")
+        if not resource_ids:
+            self._send(400, {"error": "Parameter event is missing."})
+            return
+        event = self.server.events.get(resource_ids[0])
+        if event is None:
+            self._send(404, {"error": "Unknown event %s." % resource_ids[0]})
+            return
+        self._send_magnitudes([event], ("event", resource_ids[0]))
+
+    def do_POST(self):
+        if urlparse.urlparse(self.path).path != "/magnitude":
+            self._send(404, {"error": "Unknown path %s." % self.path})
+            return
+        body = self.rfile.read(int(self.headers.getheader("content-length",
+            0)))
+        try:
+            cat = readEvents(StringIO.StringIO(body))
+        except Exception, e:
+            self._send(400, {"error": "Invalid QuakeML: %s(%s)" % (
+                e.__class__.__name__, str(e))})
+            return
+        self._send_magnitudes(cat.events, ("quakeml",
+            hashlib.md5(body).hexdigest()))
+
+    def _send_magnitudes(self, events, cache_key):
+        a = time.time()
+        results = self.server.cache.get(cache_key)
+        if results is None:
+            cat = Catalog()
+            cat.events = list(events)
+            try:
+                results = calculate_moment_magnitudes(
+                    catalog_to_pick_table(cat))
+            except Exception, e:
+                self._send(500, {"error": "%s(%s)" % (e.__class__.__name__,
+                    str(e))})
+                return
+            # The index is only valid for this request.
+            for result in results:
+                del result["event_index"]
+            # Events without a result might just lack data so far.
+            if len(results) == len(cat.events):
+                self.server.cache.put(cache_key, results)
+        self._send(200, {
+            "events": results,
+            "processing_time": time.time() - a})
+
+    def _send(self, status, content):
+        body = json.dumps(json_compatible(content), allow_nan=False)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(port, cat):
+    """
+    Creates the HTTP server of the service mode. Port 0 picks a free port.
+
+    :param cat: The events that can be requested by their resource id.
+    """
+    server = BaseHTTPServer.HTTPServer((SERVICE_HOST, port),
+        MagnitudeRequestHandler)
+    server.events = dict((str(_i.resource_id), _i) for _i in cat)
+    server.cache = LRUCache(SERVICE_CACHE_SIZE)
+    return server
+
 
+def serve(port, cat):
+    """
+    Answers magnitude requests until interrupted.
+    """
+    server = create_server(port, cat)
+    print "Serving on http://%s:%i/magnitude" % server.server_address
+    server.serve_forever()
+
+
+def read_catalog():
+    """
+    Reads all events of all EVENT_FILES.
+    """
     print "Reading all events."
     cat = Catalog()
     for filename in EVENT_FILES:
         cat += readEvents(filename)
     print "Done reading all events."
+    return cat
+
+
+def parse_shard(value):
+    """
+    Parses "i/N" to (i, N).
+    """
+    try:
+        shard, shard_count = [int(_i) for _i in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shards must be given as i/N.")
+    if not 0 <= shard < shard_count:
+        raise argparse.ArgumentTypeError("The shard i/N needs 0 <= i < N.")
+    return shard, shard_count
+
+
+def parse_positive_integer(value):
+    try:
+        value = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s is not an integer." % value)
+    if value < 1:
+        raise argparse.ArgumentTypeError("%i is not positive." % value)
+    return value
+
+
+def event_shard(event, shard_count):
+    """
+    Returns the shard an event belongs to. Independent of the order and the
+    number of the events.
+    """
+    return int(hashlib.md5(str(event.resource_id)).hexdigest(), 16) % \
+        shard_count
+
+
+def shard_filename(filename, shard, shard_count):
+    """
+    "out.xml" -> "out.shard-1-of-4.xml"
+    """
+    basename, extension = os.path.splitext(filename)
+    return "%s.shard-%i-of-%i%s" % (basename, shard, shard_count, extension)
+
+
+def merge_shards(shard_count):
+    """
+    Combines the partial output files of all shards into the final output
+    files. Events and result rows are in the order of the input catalog, so
+    the result does not depend on the number of shards.
+    """
+    cat = read_catalog()
+    order = dict((str(event.resource_id), _i) for _i, event in enumerate(cat))
+    events = {}
+    stores = []
+    for shard in xrange(shard_count):
+        print "Reading shard %i of %i." % (shard, shard_count)
+        for event in readEvents(shard_filename(OUTPUT_FILE, shard,
+                shard_count)):
+            events[str(event.resource_id)] = event
+        stores.append(ResultStore.read(shard_filename(RESULT_STORE_FILE,
+            shard, shard_count)))
+    merged = Catalog()
+    for event in cat:
+        merged.events.append(events.get(str(event.resource_id), event))
+    print "Writing output file..."
+    merged.write(OUTPUT_FILE, format="quakeml")
+
+    store = ResultStore.concatenate(stores)
+    # Stable sorts keep the order of the picks of every event.
+    store = ResultStore(
+        store.events[np.argsort([order[_i] for _i in
+            store.events["resource_id"]], kind="mergesort")],
+        store.picks[np.argsort([order[_i] for _i in
+            store.picks["resource_id"]], kind="mergesort")])
+    store.write(RESULT_STORE_FILE)
+    plot_ml_vs_mw(store)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Automatically determines "
+        "the moment magnitudes of all events. See the top of the file for "
+        "the configuration.")
+    # Only one mode at a time.
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument("--shard", type=parse_shard, metavar="i/N",
+        help="only process shard i of N and write partial output files")
+    modes.add_argument("--merge", type=parse_positive_integer, metavar="N",
+        help="merge the partial output files of N shards")
+    modes.add_argument("--watch", action="store_true",
+        help="keep running and process new events as they arrive")
+    modes.add_argument("--serve", type=parse_positive_integer,
+        metavar="PORT", help="answer magnitude requests on a local HTTP "
+        "server")
+    args = parser.parse_args()
+    if args.merge is not None:
+        merge_shards(args.merge)
+        sys.exit(0)
+
+    # Index all instrument responses.
+    widgets = ['Indexing instrument responses...', progressbar.Percentage(),
+        ' ', progressbar.Bar()]
+    pbar = progressbar.ProgressBar(widgets=widgets,
+        maxval=len(STATION_FILES)).start()
+    station_index = StationIndex(STATION_INDEX_DIRECTORY)
+    station_index.update(STATION_FILES, progress_callback=pbar.update)
+    pbar.finish()
+
+    # Parse all waveform files.
+    widgets = ['Indexing waveform files...     ', progressbar.Percentage(),
+        ' ', progressbar.Bar()]
+    pbar = progressbar.ProgressBar(widgets=widgets,
+        maxval=len(WAVEFORM_FILES)).start()
+    waveform_index = {}
+    # Read all waveform files.
+    for _i, waveform in enumerate(WAVEFORM_FILES):
+        pbar.update(_i)
+        index_waveform_file(waveform, waveform_index)
+    pbar.finish()
+
+    get_corresponding_stream = create_stream_getter(station_index,
+        waveform_index)
+
+    if args.watch:
+        watch(station_index, waveform_index)
+        sys.exit(0)
+    if args.serve is not None:
+        # Keep the instrument corrected streams warm across requests.
+        get_corresponding_stream = create_stream_getter(station_index,
+            waveform_index, LRUCache(SERVICE_STREAM_CACHE_SIZE))
+        serve(args.serve, read_catalog())
+        sys.exit(0)
+
+    cat = read_catalog()
+    output_file = OUTPUT_FILE
+    result_store_file = RESULT_STORE_FILE
+    if args.shard is not None:
+        shard, shard_count = args.shard
+        shard_cat = Catalog()
+        shard_cat.events = [_i for _i in cat
+            if event_shard(_i, shard_count) == shard]
+        cat = shard_cat
+        output_file = shard_filename(OUTPUT_FILE, shard, shard_count)
+        result_store_file = shard_filename(RESULT_STORE_FILE, shard,
+            shard_count)
+        print "Processing %i events in shard %i of %i." % (len(cat), shard,
+            shard_count)
+
+    # Flatten the catalog once. Everything up to writing the magnitudes works
+    # on the resulting arrays.
+    table = catalog_to_pick_table(cat)
+    results = calculate_moment_magnitudes(table)
 
     # Will edit the Catalog object inplace.
-    calculate_moment_magnitudes(cat, output_file=OUTPUT_FILE)
-    # Plot it.
-    plot_ml_vs_mw(cat)
+    add_magnitudes_to_catalog(cat, results)
+    print "Writing output file..."
+    cat.write(output_file, format="quakeml")
+    store = create_result_store(results)
+    store.write(result_store_file)
+    # Plot it. Shards are only plotted once merged.
+    if args.shard is None:
+        plot_ml_vs_mw(store)
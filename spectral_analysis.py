@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Spectral estimation and fitting of theoretical source spectra.
+
+Does not depend on PyQt so it can also be used in worker processes and
+scripts.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+
+# Supported precisions of the waveforms and spectra. float32 halves the memory
+# and its traffic. The fits are always done in float64.
+PRECISIONS = {
+    "float32": np.float32,
+    "float64": np.float64}
+
+
+# Spectral estimators. "multitaper" (mtspec) has the lowest variance.
+# "hann", a single Hann tapered FFT, and "welch", the average of Hann tapered
+# and half overlapping segments, are much faster and meant for screening large
+# data sets. All return one sided power spectral densities, but their tapers
+# weight a short transient differently, so the estimators must not be mixed
+# within a catalog. benchmarks/spectral_estimators.py measures the bias of
+# every estimator relative to the true values of synthetic pulses and, with
+# mtspec installed, the offset of "hann" and "welch" relative to
+# "multitaper".
+SPECTRAL_ESTIMATORS = ("multitaper", "hann", "welch")
+# Number of segments of the Welch estimator.
+WELCH_SEGMENT_COUNT = 3
+
+
+def _chi2_confidence_intervals(spec, dof):
+    """
+    95% confidence intervals of a power spectrum whose values are chi-square
+    distributed with dof degrees of freedom.
+    """
+    import scipy.stats
+
+    return np.column_stack([dof * spec / scipy.stats.chi2.ppf(0.975, dof),
+        dof * spec / scipy.stats.chi2.ppf(0.025, dof)])
+
+
+def power_spectrum(data, delta, estimator="multitaper", statistics=False):
+    """
+    Calculates the power spectral density of data.
+
+    :param data: The data array.
+    :param delta: The sample spacing in seconds.
+    :param estimator: One of SPECTRAL_ESTIMATORS.
+    :param statistics: If True, also calculate 95% confidence intervals. These
+        are the jackknife intervals for the multitaper estimator and
+        chi-square intervals otherwise.
+    :returns: (spectrum, frequencies, confidence_intervals).
+        confidence_intervals is None if statistics is False.
+    """
+    if estimator == "multitaper":
+        import mtspec
+
+        if statistics:
+            spec, freq, jackknife_errors, _, _ = mtspec.mtspec(data, delta,
+                2, statistics=True)
+            return spec, freq, jackknife_errors
+        spec, freq = mtspec.mtspec(data, delta, 2)
+        return spec, freq, None
+
+    import scipy.signal
+
+    npts = len(data)
+    if estimator == "hann":
+        freq, spec = scipy.signal.periodogram(data, 1.0 / delta,
+            window="hann", detrend=False)
+        dof = 2
+    elif estimator == "welch":
+        segment_length = max(2 * npts // (WELCH_SEGMENT_COUNT + 1), 1)
+        freq, spec = scipy.signal.welch(data, 1.0 / delta, window="hann",
+            nperseg=segment_length, detrend=False)
+        dof = 2 * ((npts - segment_length) // (segment_length // 2 or 1) + 1)
+    else:
+        msg = "Unknown spectral estimator '%s'. Use one of %s." % (estimator,
+            ", ".join(SPECTRAL_ESTIMATORS))
+        raise ValueError(msg)
+    if statistics:
+        return spec, freq, _chi2_confidence_intervals(spec, dof)
+    return spec, freq, None
+
+
+def calculate_spectrum(data, delta, statistics=False, dtype=np.float64,
+        estimator="multitaper"):
+    """
+    Calculates the amplitude spectrum of data.
+
+    :param data: The data array.
+    :param delta: The sample spacing in seconds.
+    :param statistics: If True, also calculate the 95% confidence intervals.
+    :param dtype: The dtype of the returned spectra.
+    :param estimator: One of SPECTRAL_ESTIMATORS.
+    :returns: (spectrum, frequencies, jackknife_errors). jackknife_errors is
+        None if statistics is False. All spectra are amplitude spectra.
+    """
+    spec, freq, jackknife_errors = power_spectrum(data, delta, estimator,
+        statistics)
+    if jackknife_errors is not None:
+        jackknife_errors = np.sqrt(jackknife_errors).astype(dtype, copy=False)
+    return np.sqrt(spec).astype(dtype, copy=False), \
+        freq.astype(dtype, copy=False), jackknife_errors
+
+
+def signal_to_noise_band(signal_spectrum, noise_spectrum, threshold):
+    """
+    Finds the longest run of consecutive frequencies at which the amplitude
+    signal to noise ratio reaches threshold.
+
+    :param signal_spectrum: Power spectrum of the signal window.
+    :param noise_spectrum: Power spectrum of a noise window of the same length
+        calculated with the same estimator.
+    :param threshold: Minimum ratio of the amplitude spectra.
+    :returns: A slice of the frequencies. Empty if no frequency reaches the
+        threshold.
+    """
+    good = np.asarray(signal_spectrum) >= \
+        threshold ** 2 * np.asarray(noise_spectrum)
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], good,
+        [False]]).astype(np.int8)))
+    if not len(edges):
+        return slice(0, 0)
+    starts = edges[::2]
+    ends = edges[1::2]
+    longest = (ends - starts).argmax()
+    return slice(starts[longest], ends[longest])
+
+
+def log_frequency_bands(spectrum, frequencies, bands_per_decade=10):
+    """
+    Averages a spectrum in logarithmically spaced frequency bands.
+
+    Spectra are linearly sampled so most samples are far above the corner
+    frequency. Fitting the band averages is much faster and not dominated by
+    the high frequencies. Empty bands and the zero frequency are dropped.
+
+    :param spectrum: The spectrum.
+    :param frequencies: The corresponding frequencies.
+    :param bands_per_decade: Number of bands per decade of frequency.
+    :returns: (band_spectrum, band_frequencies, weights). The weights are the
+        number of samples averaged in every band. fit_spectrum() does not
+        use them, see there.
+    """
+    spectrum = np.asarray(spectrum)
+    frequencies = np.asarray(frequencies)
+    positive = frequencies > 0
+    spectrum = spectrum[positive]
+    frequencies = frequencies[positive]
+    low = np.log10(frequencies.min())
+    high = np.log10(frequencies.max())
+    band_count = max(int(np.ceil((high - low) * bands_per_decade)), 1)
+    edges = np.logspace(low, high, band_count + 1)
+    bands = np.clip(np.searchsorted(edges, frequencies, side="right") - 1, 0,
+        band_count - 1)
+    weights = np.bincount(bands, minlength=band_count)
+    used = weights > 0
+    band_spectrum = np.bincount(bands, weights=spectrum,
+        minlength=band_count)[used] / weights[used]
+    band_frequencies = np.bincount(bands, weights=frequencies,
+        minlength=band_count)[used] / weights[used]
+    return band_spectrum.astype(spectrum.dtype, copy=False), \
+        band_frequencies.astype(frequencies.dtype, copy=False), weights[used]
+
+
+def initial_spectral_parameters(spectrum, frequencies):
+    """
+    Simple initial guess of omega_0 and the corner frequency.
+
+    Setting the corner frequency to 10 Hz is reasonable. Omega_0 is the mean
+    of all values below it.
+
+    :returns: (omega_0, corner_frequency)
+    """
+    corner_frequency = 10.0
+    corn_freq_index = np.abs(frequencies - corner_frequency).argmin()
+    return spectrum[:corn_freq_index].mean(), corner_frequency
+
+
+def grid_search_initial_parameters(spectrum, frequencies, traveltime, Q=None,
+        corner_frequencies=None, quality_factors=None):
+    """
+    Coarse grid search for the corner frequency and, if Q is None, the
+    quality factor to seed the final fit.
+
+    The theoretical spectra of all grid nodes are evaluated at once. For
+    every node, the best omega_0 is found by linear least squares.
+
+    :param spectrum: The measured spectrum.
+    :param frequencies: The corresponding frequencies.
+    :param traveltime: Hypocentral traveltime in [s].
+    :param Q: Fixed quality factor. Searched for if None.
+    :param corner_frequencies: Corner frequency grid. Defaults to 40
+        logarithmically spaced values between the lowest positive and the
+        highest frequency.
+    :param quality_factors: Quality factor grid used if Q is None. Defaults to
+        20 logarithmically spaced values from 10 to 10000.
+    :returns: (omega_0, corner_frequency, Q)
+    """
+    spectrum = np.asarray(spectrum, dtype=np.float64)
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    if corner_frequencies is None:
+        positive = frequencies[frequencies > 0]
+        corner_frequencies = np.logspace(np.log10(positive.min()),
+            np.log10(positive.max()), 40)
+    if Q is not None:
+        quality_factors = [Q]
+    elif quality_factors is None:
+        quality_factors = np.logspace(1, 4, 20)
+    # Shape: (Q, f_c, frequencies)
+    shapes = calculate_source_spectrum(frequencies[None, None, :], 1.0,
+        np.asarray(corner_frequencies, dtype=np.float64)[None, :, None],
+        np.asarray(quality_factors, dtype=np.float64)[:, None, None],
+        traveltime)
+    omega_0 = (shapes * spectrum).sum(axis=-1) / \
+        np.maximum((shapes ** 2).sum(axis=-1), np.finfo(np.float64).tiny)
+    misfit = ((spectrum - omega_0[..., None] * shapes) ** 2).sum(axis=-1)
+    q_index, f_c_index = np.unravel_index(misfit.argmin(), misfit.shape)
+    return omega_0[q_index, f_c_index], corner_frequencies[f_c_index], \
+        quality_factors[q_index]
+
+
+def window_indices(trace, time, seconds_before, seconds_after):
+    """
+    Returns the start and end sample indices of a window around time.
+    """
+    index = int(round((time - trace.stats.starttime) / trace.stats.delta))
+    start = index - int(seconds_before * trace.stats.sampling_rate)
+    end = index + int(seconds_after * trace.stats.sampling_rate)
+    return max(start, 0), min(end, trace.stats.npts)
+
+
+def calculate_source_spectrum(frequencies, omega_0, corner_frequency, Q,
+    traveltime):
+    """
+    After Abercrombie and Boatwright.
+
+    :param frequencies: Input array to perform the calculation on.
+    :param omega_0: Low frequency amplitude in [meter x second].
+    :param corner_frequency: Corner frequency in Hz.
+    :param Q: Quality factor.
+    :param traveltime: Hypocentral traveltime in [s].
+    """
+    num = omega_0 * np.exp(-np.pi * frequencies * traveltime / Q)
+    denom = (1 + (frequencies / corner_frequency) ** 4) ** 0.5
+    return num / denom
+
+
+def fit_spectrum(spectrum, frequencies, traveltime, initial_omega_0,
+    initial_f_c, Q, bands_per_decade=None):
+    """
+    Fit the theoretical source spectrum to a measured spectrum with a
+    Levenberg-Marquardt algorithm. Q is kept fixed.
+
+    The fit is always done in float64, independent of the precision of the
+    spectrum.
+
+    :param bands_per_decade: If given, the spectrum is averaged in
+        logarithmically spaced frequency bands before fitting, see
+        log_frequency_bands(). All bands are weighted equally, so every
+        decade of frequency has the same leverage. Weighting the bands with
+        their sample counts would give the high frequencies back the
+        leverage of the raw spectrum, see benchmarks/band_weighting.py.
+    :returns: (omega_0, corner_frequency, omega_0_var, corner_frequency_var)
+    """
+    import scipy.optimize
+
+    if bands_per_decade:
+        spectrum, frequencies, _ = log_frequency_bands(spectrum, frequencies,
+            bands_per_decade)
+    spectrum = np.asarray(spectrum, dtype=np.float64)
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+
+    def f(frequencies, omega_0, f_c):
+        return calculate_source_spectrum(frequencies, omega_0, f_c, Q,
+        traveltime)
+    popt, pcov = scipy.optimize.curve_fit(f, frequencies, spectrum, \
+        p0=[initial_omega_0, initial_f_c], maxfev=100000)
+    return popt[0], popt[1], pcov[0, 0], pcov[1, 1]
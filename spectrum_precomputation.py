@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Background computation of default spectra and fits for all picks.
+
+Right after the waveform data has been downloaded, the spectrum of a default
+window around every pick is calculated and fitted in a pool of worker
+processes. Once the analyst opens a pick, the results are already available.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import multiprocessing
+import numpy as np
+
+from spectral_analysis import calculate_spectrum, \
+    grid_search_initial_parameters, fit_spectrum
+
+
+def spectrum_key(trace, start, end, estimator):
+    """
+    The cache key of the spectrum of trace.data[start:end] calculated with
+    the given spectral estimator.
+    """
+    return (trace.id, str(trace.stats.starttime), start, end, estimator)
+
+
+def _compute_spectrum_and_fit(data, delta, traveltime, quality_factor,
+        bands_per_decade, estimator):
+    """
+    Runs in the worker processes. Returns None if anything fails.
+    """
+    try:
+        spec, freq, jackknife_errors = calculate_spectrum(data, delta,
+            statistics=True, dtype=data.dtype, estimator=estimator)
+    except Exception:
+        return None
+    try:
+        omega_0, corner_frequency, _ = grid_search_initial_parameters(spec,
+            freq, traveltime, quality_factor)
+        fit = fit_spectrum(spec, freq, traveltime, omega_0, corner_frequency,
+            quality_factor, bands_per_decade)
+    except Exception:
+        fit = None
+    return {
+        "spectrum": spec,
+        "frequencies": freq,
+        "jackknife_errors": jackknife_errors,
+        "quality_factor": quality_factor,
+        # (omega_0, corner_frequency, omega_0_var, corner_frequency_var) or
+        # None if the fit failed.
+        "fit": fit}
+
+
+class SpectrumPrecomputer(object):
+    """
+    Computes spectra and fits in a pool of worker processes and caches the
+    results.
+
+    :param processes: Number of worker processes. Defaults to the number of
+        CPUs.
+    """
+    def __init__(self, processes=None):
+        self.processes = processes
+        self.cache = {}
+        self._pending = set()
+        self._pool = None
+        # Incremented by clear() so results of earlier jobs are dropped.
+        self._generation = 0
+
+    def submit(self, key, data, delta, traveltime, quality_factor,
+            bands_per_decade=None, estimator="multitaper"):
+        """
+        Queues the computation of the spectrum of data unless it is already
+        cached or queued.
+
+        :param bands_per_decade: Passed on to
+            spectral_analysis.fit_spectrum().
+        :param estimator: Passed on to spectral_analysis.calculate_spectrum().
+        """
+        if key in self.cache or key in self._pending:
+            return
+        # Only start the processes once they are needed.
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        self._pending.add(key)
+        generation = self._generation
+
+        # Called in a thread of the pool in the main process.
+        def callback(result):
+            if generation != self._generation:
+                return
+            self._pending.discard(key)
+            if result is not None:
+                self.cache[key] = result
+        # Copy the data as it might be a view of a memory mapped file.
+        self._pool.apply_async(_compute_spectrum_and_fit,
+            (np.array(data), delta, traveltime, quality_factor,
+            bands_per_decade, estimator), callback=callback)
+
+    def get(self, key):
+        """
+        Returns the result for the given key or None if it is not (yet)
+        available.
+        """
+        return self.cache.get(key)
+
+    def clear(self):
+        """
+        Discards all cached results. Jobs that are still running will not be
+        cached.
+        """
+        self._generation += 1
+        self.cache = {}
+        self._pending = set()
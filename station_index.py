@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent index of the station metadata in (dataless) SEED files.
+
+Parsing all dataless SEED files with obspy.xseed.Parser on every run is slow
+and keeping all parsers around needs a lot of memory. The StationIndex parses
+every file once, extracts the poles and zeros and coordinates of every
+channel epoch and pickles them to a cache directory. Later runs only parse
+new or modified files.
+
+The pickled metadata of a file is only loaded once one of its channels is
+actually requested, e.g. only for stations that have picks.
+
+Several processes, e.g. the shards of the automatic script, can share one
+cache directory. All files are written to a temporary file first and then
+renamed, so readers never see a partially written file.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import cPickle
+import hashlib
+import os
+import warnings
+
+
+def _dump(obj, filename):
+    """
+    Pickles obj to filename. The rename is atomic so concurrent readers see
+    either the old or the new file.
+    """
+    temp_file = "%s.%i.tmp" % (filename, os.getpid())
+    with open(temp_file, "wb") as open_file:
+        cPickle.dump(obj, open_file, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temp_file, filename)
+
+
+class StationIndex(object):
+    """
+    Maps channel ids and times to poles and zeros and coordinates.
+
+    :param cache_directory: Directory to store the index in. Will be created
+        if it does not exist.
+    """
+    def __init__(self, cache_directory):
+        self.cache_directory = cache_directory
+        if not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+        self._manifest_file = os.path.join(cache_directory, "index.pickle")
+        try:
+            with open(self._manifest_file, "rb") as open_file:
+                self._manifest = cPickle.load(open_file)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            self._manifest = {}
+        # Maps channel ids to the metadata files containing them.
+        self._channel_files = {}
+        # Maps channel ids to the list of already loaded epochs.
+        self._epochs = {}
+        # Files whose pickled metadata has already been loaded.
+        self._loaded_files = set()
+        self._build_channel_map()
+
+    def update(self, filenames, progress_callback=None):
+        """
+        Makes sure the index reflects exactly the given metadata files. Only
+        files that are new or changed since the last run will be parsed.
+
+        :param progress_callback: Called with the index of every file.
+        """
+        manifest = {}
+        for _i, filename in enumerate(filenames):
+            if progress_callback is not None:
+                progress_callback(_i)
+            filename = os.path.abspath(filename)
+            stat = os.stat(filename)
+            entry = self._manifest.get(filename)
+            if entry is None or entry["mtime"] != stat.st_mtime or \
+                    entry["size"] != stat.st_size:
+                entry = self._index_file(filename, stat)
+            manifest[filename] = entry
+        # Remove the cache files of files that are no longer part of the
+        # index. Another process might have removed them already.
+        for filename, entry in self._manifest.iteritems():
+            if filename not in manifest:
+                try:
+                    os.remove(entry["cache_file"])
+                except OSError:
+                    pass
+        self._manifest = manifest
+        _dump(self._manifest, self._manifest_file)
+        self._epochs = {}
+        self._loaded_files = set()
+        self._build_channel_map()
+
+    def _index_file(self, filename, stat):
+        """
+        Parses a single metadata file and writes the extracted epochs to the
+        cache directory.
+        """
+        from obspy.xseed import Parser
+        parser = Parser(filename)
+        channels = {}
+        for channel in parser.getInventory()["channels"]:
+            channel_id = channel["channel_id"]
+            start = channel["start_date"]
+            end = channel["end_date"]
+            channels.setdefault(channel_id, []).append({
+                "starttime": start.timestamp,
+                "endtime": end.timestamp if end else float("inf"),
+                "paz": parser.getPAZ(channel_id, start),
+                "coordinates": parser.getCoordinates(channel_id, start)})
+        cache_file = os.path.join(self.cache_directory,
+            hashlib.md5(filename).hexdigest() + ".pickle")
+        _dump(channels, cache_file)
+        return {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "cache_file": cache_file,
+            "channels": sorted(channels.keys())}
+
+    def _build_channel_map(self):
+        self._channel_files = {}
+        for filename in sorted(self._manifest.keys()):
+            for channel_id in self._manifest[filename]["channels"]:
+                if channel_id in self._channel_files:
+                    msg = ("Channel %s defined in more than one metadata "
+                        "file.") % channel_id
+                    warnings.warn(msg)
+                self._channel_files.setdefault(channel_id, []).append(
+                    filename)
+
+    def _load_channel(self, channel_id):
+        for filename in self._channel_files.get(channel_id, []):
+            if filename in self._loaded_files:
+                continue
+            with open(self._manifest[filename]["cache_file"], "rb") as \
+                    open_file:
+                channels = cPickle.load(open_file)
+            for key, epochs in channels.iteritems():
+                self._epochs.setdefault(key, []).extend(epochs)
+            self._loaded_files.add(filename)
+
+    def __contains__(self, channel_id):
+        return channel_id in self._channel_files
+
+    def _get_epoch(self, channel_id, datetime):
+        if channel_id not in self._channel_files:
+            msg = "No metadata for channel %s." % channel_id
+            raise KeyError(msg)
+        self._load_channel(channel_id)
+        timestamp = datetime.timestamp
+        for epoch in self._epochs.get(channel_id, []):
+            if epoch["starttime"] <= timestamp < epoch["endtime"]:
+                return epoch
+        msg = "No metadata for channel %s at %s." % (channel_id, datetime)
+        raise KeyError(msg)
+
+    def get_paz(self, channel_id, datetime):
+        """
+        Returns the poles and zeros dictionary of the given channel at the
+        given time in the same format as obspy.xseed.Parser.getPAZ(). The
+        returned dictionary can be freely modified.
+        """
+        paz = dict(self._get_epoch(channel_id, datetime)["paz"])
+        paz["poles"] = list(paz["poles"])
+        paz["zeros"] = list(paz["zeros"])
+        return paz
+
+    def get_coordinates(self, channel_id, datetime):
+        """
+        Returns the coordinates of the given channel at the given time in the
+        same format as obspy.xseed.Parser.getCoordinates().
+        """
+        return dict(self._get_epoch(channel_id, datetime)["coordinates"])
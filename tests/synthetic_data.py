@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Small synthetic data set in the directory layout expected by
+scripts/moment_mag_automatic.py.
+
+The station files are the dataless SEED files shipped with ObsPy's own test
+data. Every event has a P and a S pick at every station and one MiniSEED file
+per station with noise and a decaying pulse behind each pick.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import os
+import shutil
+
+STATIONS = ["FURT", "MANZ", "ROTZ", "ZUGS"]
+SAMPLING_RATE = 200.0
+# Seconds of data before and after the origin time. Must cover the padding of
+# the script around every pick.
+SECONDS_BEFORE_ORIGIN = 30.0
+SECONDS_AFTER_ORIGIN = 40.0
+V_P = 4800.0
+V_S = V_P / 1.73
+
+
+def dataless_seed_directory():
+    """
+    Directory of ObsPy's dataless SEED test files. Moved in newer ObsPy
+    versions.
+    """
+    import obspy
+    for path in (["xseed"], ["io", "xseed"]):
+        directory = os.path.join(*([os.path.dirname(obspy.__file__)] + path +
+            ["tests", "data"]))
+        if os.path.isdir(directory):
+            return directory
+    raise IOError("ObsPy's dataless SEED test files not found.")
+
+
+def _pulse(npts, rng):
+    """
+    Exponentially decaying sine with a random dominant frequency.
+    """
+    t = np.arange(npts) / SAMPLING_RATE
+    frequency = rng.uniform(4.0, 12.0)
+    return np.sin(2.0 * np.pi * frequency * t) * np.exp(-t * frequency / 2.0)
+
+
+def create_synthetic_data(directory, event_count=6, seed=12345):
+    """
+    Writes events/events.xml, stations/* and waveforms/* to directory.
+
+    :returns: The written obspy.core.event.Catalog object.
+    """
+    from obspy import Stream, Trace, UTCDateTime
+    from obspy.core.event import Catalog, Event, Magnitude, Origin, Pick, \
+        WaveformStreamID
+
+    rng = np.random.RandomState(seed)
+    for name in ("events", "stations", "waveforms"):
+        os.makedirs(os.path.join(directory, name))
+    for station in STATIONS:
+        shutil.copy(os.path.join(dataless_seed_directory(),
+            "dataless.seed.BW_" + station),
+            os.path.join(directory, "stations"))
+
+    cat = Catalog()
+    npts = int((SECONDS_BEFORE_ORIGIN + SECONDS_AFTER_ORIGIN) * SAMPLING_RATE)
+    for _i in xrange(event_count):
+        origin_time = UTCDateTime(2012, 1, 1) + 3600 * _i
+        event = Event(resource_id="smi:local/synthetic/%i" % _i)
+        event.origins.append(Origin(time=origin_time, latitude=48.0,
+            longitude=11.5, depth=5000.0))
+        event.magnitudes.append(Magnitude(mag=1.0 + 0.3 * _i))
+        for station in STATIONS:
+            distance = rng.uniform(5000.0, 40000.0)
+            amplitude = 10 ** (2.0 + 0.3 * _i) * rng.uniform(0.5, 2.0)
+            data = rng.normal(0.0, 20.0, (3, npts))
+            for phase, velocity in (("P", V_P), ("S", V_S)):
+                pick_time = origin_time + distance / velocity
+                event.picks.append(Pick(time=pick_time, phase_hint=phase,
+                    waveform_id=WaveformStreamID(network_code="BW",
+                    station_code=station, location_code="",
+                    channel_code="EHZ")))
+                start = int(round((distance / velocity +
+                    SECONDS_BEFORE_ORIGIN) * SAMPLING_RATE))
+                for component in xrange(3):
+                    data[component, start:] += amplitude * \
+                        _pulse(npts - start, rng)
+            st = Stream()
+            for component, channel in zip(data, ("EHZ", "EHN", "EHE")):
+                trace = Trace(component.astype(np.int32))
+                trace.stats.network = "BW"
+                trace.stats.station = station
+                trace.stats.channel = channel
+                trace.stats.sampling_rate = SAMPLING_RATE
+                trace.stats.starttime = origin_time - SECONDS_BEFORE_ORIGIN
+                st.append(trace)
+            st.write(os.path.join(directory, "waveforms",
+                "event_%i.BW.%s.mseed" % (_i, station)), format="MSEED")
+        cat.events.append(event)
+    cat.write(os.path.join(directory, "events", "events.xml"),
+        format="QUAKEML")
+    return cat
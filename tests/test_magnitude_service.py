@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs the local magnitude service of scripts/moment_mag_automatic.py on a free
+port with synthetic events, waveforms and stations. Works fully offline.
+
+Run from the repository root:
+
+    python -m unittest discover tests
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import glob
+import imp
+import json
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import threading
+import unittest
+import urllib
+import urllib2
+
+import matplotlib
+# No display needed.
+matplotlib.use("Agg")
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from event_prefetcher import LRUCache
+from station_index import StationIndex
+from synthetic_data import STATIONS, create_synthetic_data
+
+SCRIPT = os.path.join(ROOT, "scripts", "moment_mag_automatic.py")
+
+
+class MagnitudeServiceTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.cat = create_synthetic_data(cls.directory)
+        cls.script = imp.load_source("moment_mag_automatic", SCRIPT)
+        # The only estimator that does not need mtspec.
+        cls.script.SPECTRAL_ESTIMATOR = "hann"
+        station_index = StationIndex(os.path.join(cls.directory,
+            "station_index"))
+        station_index.update(glob.glob(os.path.join(cls.directory,
+            "stations", "*")))
+        waveform_index = {}
+        for filename in glob.glob(os.path.join(cls.directory, "waveforms",
+                "*")):
+            cls.script.index_waveform_file(filename, waveform_index)
+        cls.stream_cache = LRUCache(100)
+        cls.script.get_corresponding_stream = \
+            cls.script.create_stream_getter(station_index, waveform_index,
+            cls.stream_cache)
+        cls.server = cls.script.create_server(0, cls.cat)
+        cls.url = "http://%s:%i/magnitude" % cls.server.server_address
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.directory)
+
+    def _request(self, url, data=None):
+        """
+        Returns the status and the decoded JSON body.
+        """
+        try:
+            response = urllib2.urlopen(url, data)
+        except urllib2.HTTPError, e:
+            response = e
+        self.assertEqual(response.info().getheader("Content-Type"),
+            "application/json")
+        return response.getcode(), json.loads(response.read())
+
+    def _assert_event(self, result, resource_id):
+        self.assertEqual(result["resource_id"], resource_id)
+        # The script counts every P and S pick with a moment.
+        self.assertEqual(result["station_count"], 2 * len(STATIONS))
+        for name in ("moment_magnitude", "moment_magnitude_std",
+                "seismic_moment", "corner_frequency", "source_radius",
+                "moment_magnitude_lower", "moment_magnitude_upper"):
+            self.assertTrue(isinstance(result[name], float), name)
+        self.assertTrue(result["moment_magnitude_lower"] <=
+            result["moment_magnitude"] <= result["moment_magnitude_upper"])
+        # Three components of a P and a S pick at every station.
+        self.assertEqual(len(result["picks"]), 6 * len(STATIONS))
+        for pick in result["picks"]:
+            self.assertEqual(pick["resource_id"], resource_id)
+            self.assertTrue(pick["phase"] in ("P", "S"))
+
+    def test_get_event(self):
+        resource_id = str(self.cat[0].resource_id)
+        url = self.url + "?" + urllib.urlencode({"event": resource_id})
+        status, content = self._request(url)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(content["events"]), 1)
+        self._assert_event(content["events"][0], resource_id)
+        self.assertTrue(content["processing_time"] >= 0.0)
+        # Same result as without the service.
+        expected = self.script.calculate_moment_magnitudes(
+            self.script.catalog_to_pick_table(self.cat[:1]))[0]
+        self.assertAlmostEqual(content["events"][0]["moment_magnitude"],
+            expected["moment_magnitude"])
+        # The streams of all picks stay warm and the second request is
+        # answered from the result cache.
+        self.assertTrue(len(self.stream_cache) >= 2 * len(STATIONS))
+        status, cached = self._request(url)
+        self.assertEqual(status, 200)
+        self.assertEqual(cached["events"], content["events"])
+
+    def test_post_quakeml(self):
+        cat = self.cat[1:3]
+        buf = StringIO.StringIO()
+        cat.write(buf, format="QUAKEML")
+        status, content = self._request(self.url, buf.getvalue())
+        self.assertEqual(status, 200)
+        self.assertEqual(len(content["events"]), 2)
+        for event, result in zip(cat, content["events"]):
+            self._assert_event(result, str(event.resource_id))
+
+    def test_errors(self):
+        status, content = self._request(self.url + "?event=smi:unknown")
+        self.assertEqual(status, 404)
+        self.assertTrue("error" in content)
+        status, content = self._request(self.url)
+        self.assertEqual(status, 400)
+        status, content = self._request(self.url, "not QuakeML")
+        self.assertEqual(status, 400)
+        self.assertTrue(content["error"].startswith("Invalid QuakeML"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs scripts/moment_mag_automatic.py with concurrent --shard i/N processes
+and --merge N on synthetic data and compares the result with a single
+process run.
+
+Run from the repository root:
+
+    python -m unittest discover tests
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from result_store import ResultStore
+from synthetic_data import create_synthetic_data
+
+SCRIPT = os.path.join(ROOT, "scripts", "moment_mag_automatic.py")
+SHARD_COUNT = 3
+
+try:
+    import mtspec
+    HAS_MTSPEC = True
+except ImportError:
+    HAS_MTSPEC = False
+
+
+@unittest.skipIf(not HAS_MTSPEC, "The script's default estimator needs "
+    "mtspec.")
+class ShardingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cat = create_synthetic_data(self.directory)
+        # No display needed for the plots.
+        self.env = dict(os.environ)
+        self.env["MPLBACKEND"] = "Agg"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self, *args):
+        return subprocess.Popen([sys.executable, SCRIPT] + list(args),
+            cwd=self.directory, env=self.env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+
+    def _wait(self, process):
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 0, output)
+
+    def test_merged_shards_equal_single_run(self):
+        # All shards start with a cold station index in the same directory.
+        processes = [self._run("--shard", "%i/%i" % (_i, SHARD_COUNT))
+            for _i in xrange(SHARD_COUNT)]
+        for process in processes:
+            self._wait(process)
+        self._wait(self._run("--merge", str(SHARD_COUNT)))
+        merged = ResultStore.read(os.path.join(self.directory,
+            "moment_magnitudes.npz"))
+
+        self._wait(self._run())
+        single = ResultStore.read(os.path.join(self.directory,
+            "moment_magnitudes.npz"))
+
+        self.assertEqual(len(single), len(self.cat))
+        for name, array in (("events", merged.events),
+                            ("picks", merged.picks)):
+            expected = getattr(single, name)
+            self.assertEqual(array.dtype.names, expected.dtype.names)
+            self.assertEqual(len(array), len(expected))
+            for field in expected.dtype.names:
+                np.testing.assert_array_equal(array[field], expected[field],
+                    err_msg="%s: %s" % (name, field))
+
+
+if __name__ == "__main__":
+    unittest.main()
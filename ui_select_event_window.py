@@ -164,6 +164,9 @@ class Ui_SelectEventWindow(object):
         self.horizontalLayout_2 = QtGui.QHBoxLayout()
         self.horizontalLayout_2.setSizeConstraint(QtGui.QLayout.SetMinimumSize)
         self.horizontalLayout_2.setObjectName(_fromUtf8("horizontalLayout_2"))
+        self.incremental_loading = QtGui.QCheckBox(self.groupBox)
+        self.incremental_loading.setObjectName(_fromUtf8("incremental_loading"))
+        self.horizontalLayout_2.addWidget(self.incremental_loading)
         spacerItem8 = QtGui.QSpacerItem(40, 20, QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Minimum)
         self.horizontalLayout_2.addItem(spacerItem8)
         self.search_events_button = QtGui.QPushButton(self.groupBox)
@@ -297,6 +300,8 @@ class Ui_SelectEventWindow(object):
         self.northeast_label.setText(QtGui.QApplication.translate("SelectEventWindow", "0.00, 0.00", None, QtGui.QApplication.UnicodeUTF8))
         self.label_6.setText(QtGui.QApplication.translate("SelectEventWindow", "Southwest Corner (lat, long):", None, QtGui.QApplication.UnicodeUTF8))
         self.southwest_label.setText(QtGui.QApplication.translate("SelectEventWindow", "0.00, 0.00", None, QtGui.QApplication.UnicodeUTF8))
+        self.incremental_loading.setToolTip(QtGui.QApplication.translate("SelectEventWindow", "Automatically load the events of newly visible map areas.", None, QtGui.QApplication.UnicodeUTF8))
+        self.incremental_loading.setText(QtGui.QApplication.translate("SelectEventWindow", "Load while panning", None, QtGui.QApplication.UnicodeUTF8))
         self.search_events_button.setText(QtGui.QApplication.translate("SelectEventWindow", "Search for Events", None, QtGui.QApplication.UnicodeUTF8))
         self.groupBox_2.setTitle(QtGui.QApplication.translate("SelectEventWindow", "Selected Event", None, QtGui.QApplication.UnicodeUTF8))
         self.label_7.setText(QtGui.QApplication.translate("SelectEventWindow", "Event id:", None, QtGui.QApplication.UnicodeUTF8))
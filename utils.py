@@ -9,29 +9,24 @@ Utility functions and classes.
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
-from PyQt4 import QtCore, QtGui, QtWebKit
+from PyQt4 import QtCore, QtGui
 
 import glob
+import hashlib
+import json
 import math
 import numpy as np
-from obspy.core import Stream, Trace, UTCDateTime
 import os
-import scipy.optimize
 
+# Kept here for backwards compatibility.
+from spectral_analysis import calculate_source_spectrum, fit_spectrum
 
-class GoogleMapsWebView(QtWebKit.QWebPage):
-    """
-    Subclass QWebPage to implement a custom user agent string and be able to
-    debug Javascript.
-    """
-    def javaScriptConsoleMessage(self, msg, line, source):
-        """
-        Print all Javascript Console Messages as a red string.
-        """
-        print "\033[1;31m" + \
-            "[JavaScript Console - {source} line {line}] {msg}".format( \
-            source=source, line=line, msg=msg) + \
-            "\033[1;m"
+# ObsPy and SciPy are only imported when needed to keep the startup of the GUI
+# fast.
+
+
+# Name of the file storing the hashes of the already compiled .ui files.
+UI_HASH_FILE = ".ui_file_hashes.json"
 
 
 def UTCtoQDateTime(dt):
@@ -46,6 +41,7 @@ def QDatetoUTCDateTime(dt):
     """
     Converts a QDateTime to a UTCDateTime object.
     """
+    from obspy.core import UTCDateTime
     # XXX: Microseconds might be lost.
     return UTCDateTime(dt.toPyDateTime())
 
@@ -102,24 +98,51 @@ def compile_ui_files(ui_directory, destination_directory):
     files which will be stored in the destination_directory. The filenames will
     be identical apart from the extension
 
-    The files will only be compiled if the last-modified time of the .ui file
-    is later/larger than the one of the corresponding .py file.
+    The files will only be compiled if the content of the .ui file changed
+    since it has last been compiled. The MD5 hashes of the compiled .ui files
+    are stored in a small JSON file in the destination_directory. Files
+    without a recorded hash, e.g. in a fresh checkout, are only compiled if
+    the .ui file is newer than the .py file.
     """
+    hash_file = os.path.join(destination_directory, UI_HASH_FILE)
+    try:
+        with open(hash_file, "r") as open_file:
+            hashes = json.load(open_file)
+    except (IOError, ValueError):
+        hashes = {}
+    old_hashes = dict(hashes)
     for filename in glob.glob(os.path.join(ui_directory, '*.ui')):
         ui_file = filename
         py_ui_file = os.path.splitext(ui_file)[0] + os.path.extsep + 'py'
         py_ui_file = os.path.join(destination_directory,
             os.path.basename(py_ui_file))
-        if not os.path.exists(py_ui_file) or \
-            (os.path.getmtime(ui_file) >= os.path.getmtime(py_ui_file)):
-            from PyQt4 import uic
-            print "Compiling ui file: %s" % ui_file
-            with open(py_ui_file, 'w') as open_file:
-                uic.compileUi(ui_file, open_file)
+        with open(ui_file, "rb") as open_file:
+            md5 = hashlib.md5(open_file.read()).hexdigest()
+        key = os.path.basename(ui_file)
+        if os.path.exists(py_ui_file):
+            if hashes.get(key) == md5:
+                continue
+            if key not in hashes and \
+                    os.path.getmtime(ui_file) < os.path.getmtime(py_ui_file):
+                hashes[key] = md5
+                continue
+        from PyQt4 import uic
+        print "Compiling ui file: %s" % ui_file
+        with open(py_ui_file, 'w') as open_file:
+            uic.compileUi(ui_file, open_file)
+        hashes[key] = md5
+    # Only touch the file if a hash changed. The separators avoid the
+    # trailing whitespace Python 2 writes with indent.
+    if hashes != old_hashes:
+        with open(hash_file, "w") as open_file:
+            json.dump(hashes, open_file, indent=4, sort_keys=True,
+                separators=(",", ": "))
+            open_file.write("\n")
 
 
 def brune_source(duration, sampling_rate=200, variation_signal=0.625,
-    stress_drop=50.0, shear_module=3.0E10, v_s=3.5, depth=20, distance=1):
+    stress_drop=50.0, shear_module=3.0E10, v_s=3.5, depth=20, distance=1,
+    dtype="float64"):
     """
     Calculate a theoretical source after (Brune, 1970) as has been done in the
     PITSA source code.
@@ -132,6 +155,7 @@ def brune_source(duration, sampling_rate=200, variation_signal=0.625,
     :param v_s: The shear wave velocity in [km/s].
     :param depth: The depth in [km].
     :param distance: The distance in [km].
+    :param dtype: The dtype of the data of the returned trace.
 
                 sigma = 50.0;
                 mu = 3.0e10;
@@ -151,9 +175,10 @@ def brune_source(duration, sampling_rate=200, variation_signal=0.625,
     # Calculate brune source.
     brune = 2.0 * variation_signal * stress_drop / shear_module * v_s * \
         distance / depth * t * np.exp(-2.34 * (v_s / distance) * t)
-    brune = brune.astype("float64")
+    brune = brune.astype(dtype)
 
     # Create a ObsPy Stream object.
+    from obspy.core import Stream, Trace
     trace = Trace(data=brune)
     trace.stats.sampling_rate = sampling_rate
     trace.stats.network = "SYN"
@@ -263,31 +288,3 @@ def calculate_stress_drop(seismic_moment, source_radius):
     :rtype: Stress drop in [Pa].
     """
     return (7 * seismic_moment) / (16 * source_radius ** 3)
-
-
-def calculate_source_spectrum(frequencies, omega_0, corner_frequency, Q,
-    traveltime):
-    """
-    After Abercrombie and Boatwright.
-
-    :param frequencies: Input array to perform the calculation on.
-    :param omega_0: Low frequency amplitude in [meter x second].
-    :param corner_frequency: Corner frequency in Hz.
-    :param Q: Quality factor.
-    :param traveltime: Hypocentral traveltime in [s].
-    """
-    num = omega_0 * np.exp(-np.pi * frequencies * traveltime / Q)
-    denom = (1 + (frequencies / corner_frequency) ** 4) ** 0.5
-    return num / denom
-
-
-def fit_spectrum(spectrum, frequencies, traveltime, initial_omega_0,
-    initial_f_c, Q):
-    """
-    """
-    def f(frequencies, omega_0, f_c):
-        return calculate_source_spectrum(frequencies, omega_0, f_c, Q,
-        traveltime)
-    popt, pcov = scipy.optimize.curve_fit(f, frequencies, spectrum, \
-        p0=[initial_omega_0, initial_f_c], maxfev=100000)
-    return popt[0], popt[1], pcov[0, 0], pcov[1, 1]
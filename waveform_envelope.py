@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution min/max envelopes for fast waveform plotting.
+
+Plotting every single sample of long, high-rate traces is slow and pointless
+as there are far more samples than pixels. The EnvelopePyramid computes the
+minimum and maximum of bins of 2, 4, 8, ... samples once per trace. For any
+visible range the coarsest level still having at least one bin per pixel is
+plotted, which looks identical to plotting all samples.
+
+The x-values are always sample indices, so positions picked on the plot map
+directly to samples of the original data.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import numpy as np
+
+
+class EnvelopePyramid(object):
+    """
+    Min/max envelopes of a data array at bin sizes of powers of two.
+
+    :param data: The data array.
+    :param min_bins: Stop creating coarser levels once a level has less than
+        this many bins.
+    """
+    def __init__(self, data, min_bins=256):
+        self.npts = len(data)
+        self.data = data
+        # levels[k] holds the minima and maxima of bins of 2 ** (k + 1)
+        # samples.
+        self.levels = []
+        mins = maxs = np.asarray(data)
+        while len(mins) >= 2 * min_bins:
+            # Pad odd lengths by repeating the last value.
+            if len(mins) % 2:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = np.minimum(mins[0::2], mins[1::2])
+            maxs = np.maximum(maxs[0::2], maxs[1::2])
+            self.levels.append((mins, maxs))
+
+    def get(self, start, end, pixels):
+        """
+        Returns the x and y values to plot the samples from start to end with
+        a line about pixels wide.
+        """
+        start = max(0, int(start))
+        end = min(self.npts, int(np.ceil(end)))
+        if end <= start:
+            return np.array([]), np.array([])
+        samples_per_pixel = (end - start) / max(float(pixels), 1.0)
+        # The largest bin size not larger than half a pixel. Each bin results
+        # in two points.
+        level = int(np.floor(np.log2(max(samples_per_pixel / 2.0, 1.0))))
+        level = min(level, len(self.levels))
+        if level == 0:
+            return np.arange(start, end), self.data[start:end]
+        bin_size = 2 ** level
+        mins, maxs = self.levels[level - 1]
+        first = start // bin_size
+        last = min(len(mins), -(-end // bin_size))
+        # Draw every bin as a vertical stroke at its center.
+        x = np.repeat(np.arange(first, last) * bin_size + bin_size / 2.0, 2)
+        y = np.empty(2 * (last - first), dtype=mins.dtype)
+        y[0::2] = mins[first:last]
+        y[1::2] = maxs[first:last]
+        return x, y
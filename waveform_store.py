@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+On disk store of the downloaded and instrument corrected waveforms.
+
+The data of all traces of an event is appended to a single file per event and
+read back through one read-only memory map, so only the parts actually looked
+at are paged into memory and an event needs a single file descriptor no
+matter how many picks it has. The headers of all traces of an event are kept
+in a small pickled index that is written once per event. Revisiting an event
+thus requires neither a download nor an instrument correction.
+
+:copyright:
+    Lion Krischer (krischer@geophysik.uni-muenchen.de), 2012
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import cPickle
+import hashlib
+import numpy as np
+import os
+import shutil
+
+# Derived from the data and not stored.
+_DERIVED_STATS = ["npts", "delta", "endtime"]
+# The data of every trace starts at a multiple of this many bytes.
+_ALIGNMENT = 16
+
+
+def pick_key(pick):
+    """
+    Identifies a pick across multiple downloads of the same event. The
+    resource ids of picks are generated anew every time an event is parsed.
+    """
+    wid = pick.waveform_id
+    return "%s.%s.%s.%s|%s|%s" % (wid.network_code, wid.station_code,
+        wid.location_code or "", wid.channel_code, pick.time,
+        pick.phase_hint)
+
+
+class WaveformStore(object):
+    """
+    Stores the waveforms of the picks of events as memory mapped arrays.
+
+    :param directory: The root directory of the store. Will be created if it
+        does not exist.
+    :param max_size: If given, the least recently used events are deleted
+        whenever the store grows beyond this many bytes.
+    """
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        # Event directory -> index dictionary.
+        self._indices = {}
+        # Event directory -> memory map of the data file.
+        self._data = {}
+
+    def _event_directory(self, event):
+        return os.path.join(self.directory,
+            hashlib.md5(str(event.resource_id)).hexdigest())
+
+    def _index(self, event_directory):
+        if event_directory not in self._indices:
+            index_file = os.path.join(event_directory, "index.pickle")
+            try:
+                with open(index_file, "rb") as open_file:
+                    self._indices[event_directory] = cPickle.load(open_file)
+                # The modification time marks the last use for evict().
+                os.utime(index_file, None)
+            except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+                self._indices[event_directory] = {}
+        return self._indices[event_directory]
+
+    def _memmap(self, event_directory):
+        if event_directory not in self._data:
+            self._data[event_directory] = np.memmap(os.path.join(
+                event_directory, "waveforms.bin"), dtype=np.uint8, mode="r")
+        return self._data[event_directory]
+
+    def load(self, event, pick, buffer_seconds):
+        """
+        Returns the stored stream of the pick with memory mapped data or None
+        if nothing with at least buffer_seconds around the pick is stored.
+        """
+        from obspy.core import Stream, Trace
+
+        event_directory = self._event_directory(event)
+        entry = self._index(event_directory).get(pick_key(pick))
+        if entry is None or entry["buffer_seconds"] < buffer_seconds - 0.05:
+            return None
+        try:
+            data = self._memmap(event_directory)
+        except (IOError, ValueError):
+            return None
+        traces = []
+        for header in entry["traces"]:
+            dtype = np.dtype(header["dtype"])
+            end = header["offset"] + header["npts"] * dtype.itemsize
+            if end > len(data):
+                return None
+            traces.append(Trace(data=data[header["offset"]:end].view(dtype),
+                header=dict(header["stats"])))
+        return Stream(traces=traces)
+
+    def save(self, event, pick, buffer_seconds, stream):
+        """
+        Appends the stream of the pick to the data file of the event.
+
+        The index is only written by commit(), which has to be called once
+        all picks of the event are saved.
+        """
+        event_directory = self._event_directory(event)
+        if not os.path.exists(event_directory):
+            os.makedirs(event_directory)
+        headers = []
+        with open(os.path.join(event_directory, "waveforms.bin"), "ab") as \
+                open_file:
+            open_file.seek(0, os.SEEK_END)
+            for trace in stream:
+                offset = open_file.tell()
+                padding = -offset % _ALIGNMENT
+                open_file.write("\0" * padding)
+                data = np.ascontiguousarray(trace.data)
+                open_file.write(data.tostring())
+                headers.append({
+                    "offset": offset + padding,
+                    "dtype": data.dtype.str,
+                    "npts": len(data),
+                    "stats": dict((k, v) for k, v in trace.stats.iteritems()
+                        if k not in _DERIVED_STATS)})
+        # The data file grew, the next load() maps it anew.
+        self._data.pop(event_directory, None)
+        self._index(event_directory)[pick_key(pick)] = {
+            "buffer_seconds": buffer_seconds,
+            "traces": headers}
+
+    def commit(self, event):
+        """
+        Writes the index of the event after its picks have been saved and
+        evicts old events if the store is too large. The data of picks that
+        have been saved again, e.g. with a longer buffer, is reclaimed.
+        """
+        event_directory = self._event_directory(event)
+        self._compact(event_directory)
+        with open(os.path.join(event_directory, "index.pickle"), "wb") as \
+                open_file:
+            cPickle.dump(self._index(event_directory), open_file,
+                cPickle.HIGHEST_PROTOCOL)
+        if self.max_size is not None:
+            self.evict(self.max_size, keep=event)
+
+    def _compact(self, event_directory):
+        """
+        Rewrites the data file of the event without the data no longer
+        referenced by its index. Streams loaded before stay valid as they map
+        the replaced file.
+        """
+        headers = [header for entry in
+            self._index(event_directory).itervalues()
+            for header in entry["traces"]]
+        sizes = [header["npts"] * np.dtype(header["dtype"]).itemsize
+            for header in headers]
+        data_file = os.path.join(event_directory, "waveforms.bin")
+        # The padding of every trace is less than _ALIGNMENT bytes.
+        if not os.path.exists(data_file) or \
+                os.path.getsize(data_file) <= sum(sizes) + \
+                _ALIGNMENT * len(headers):
+            return
+        data = np.memmap(data_file, dtype=np.uint8, mode="r")
+        temp_file = data_file + ".tmp"
+        offsets = []
+        with open(temp_file, "wb") as open_file:
+            for header, size in zip(headers, sizes):
+                open_file.write("\0" * (-open_file.tell() % _ALIGNMENT))
+                offsets.append(open_file.tell())
+                open_file.write(data[header["offset"]:header["offset"] +
+                    size].tostring())
+        del data
+        # The offsets in the old index are wrong once the file is replaced.
+        # Without an index the event is just downloaded again.
+        index_file = os.path.join(event_directory, "index.pickle")
+        if os.path.exists(index_file):
+            os.remove(index_file)
+        os.rename(temp_file, data_file)
+        for header, offset in zip(headers, offsets):
+            header["offset"] = offset
+        self._data.pop(event_directory, None)
+
+    def evict(self, max_size, keep=None):
+        """
+        Deletes the least recently used events until the store is at most
+        max_size bytes large.
+
+        :param keep: An event that is never deleted.
+        """
+        events = []
+        total_size = 0
+        for name in os.listdir(self.directory):
+            event_directory = os.path.join(self.directory, name)
+            if not os.path.isdir(event_directory):
+                continue
+            size = sum(os.path.getsize(os.path.join(event_directory, _i))
+                for _i in os.listdir(event_directory))
+            try:
+                last_used = os.path.getmtime(os.path.join(event_directory,
+                    "index.pickle"))
+            except OSError:
+                last_used = 0.0
+            events.append((last_used, event_directory, size))
+            total_size += size
+        kept = self._event_directory(keep) if keep is not None else None
+        for _, event_directory, size in sorted(events):
+            if total_size <= max_size:
+                break
+            if event_directory == kept:
+                continue
+            self._indices.pop(event_directory, None)
+            self._data.pop(event_directory, None)
+            shutil.rmtree(event_directory, ignore_errors=True)
+            total_size -= size